@@ -1,5 +1,6 @@
 from ..base_step import LigerIRISStep
 from .. import datamodels
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import numpy as np
 from photutils.background import Background2D, BiweightLocationBackground
 from astropy.stats import SigmaClip
@@ -21,6 +22,9 @@ class CalculateBackgroundImagerStep(LigerIRISStep):
         maxiters = integer(default = 100) # Maximum number of iterations for outlier rejection.
         box_size = integer(default = 101) # Size of the box for background estimation.
         filter_size = integer(default = None) # Size of the box for background estimation.
+        n_workers = integer(default = 1) # Number of frames to compute the Background2D of concurrently.
+        use_processes = boolean(default = False) # Use a process pool instead of threads for n_workers > 1.
+        keep_sky_results = boolean(default = True) # Keep the Background2D of each frame in background_result['sky_results']. False frees them as soon as their planes are extracted.
     """
 
     class_alias = "calc_bkg_imager"
@@ -53,7 +57,10 @@ class CalculateBackgroundImagerStep(LigerIRISStep):
             filter_size=self.filter_size,
             sigma_clip=(self.sigma_low, self.sigma_high),
             maxiters=self.maxiters,
-            fwhm=fwhm
+            fwhm=fwhm,
+            n_workers=self.n_workers,
+            use_processes=self.use_processes,
+            keep_sky_results=self.keep_sky_results
         )
         sky_model.data = self.background_result['sky']
         sky_model.err = self.background_result['sky_err']
@@ -68,31 +75,104 @@ def calc_scaled_sky_imager(
     filter_size : tuple[int, int] | None = None,
     sigma_clip : tuple[float, float] = (6.0, 2.0),
     maxiters : int = 100,
-    fwhm : float | None = None
+    fwhm : float | None = None,
+    n_workers : int = 1,
+    use_processes : bool = False,
+    keep_sky_results : bool = True
 ) -> dict:
+    """
+    Calculate the sky background of each frame with `calc_sky_imager`, scale the backgrounds to a common level
+    and combine them.
+
+    With keep_sky_results=False, only the background and background RMS planes of each frame are kept,
+    and the Background2D intermediates are freed as soon as the planes are extracted.
+
+    Args:
+        data_cube (np.ndarray): Stack of frames with shape (n_frames, ny, nx).
+        dq_cube (np.ndarray): DQ flags of the frames, flagged pixels are masked.
+        box_size (tuple[int, int] | None): Size of the Background2D boxes. None uses 10 * fwhm.
+        filter_size (tuple[int, int] | None): Size of the median filter of the background mesh. None uses (3, 3).
+        sigma_clip (tuple[float, float]): Lower and upper number of sigma for sigma clipping.
+        maxiters (int): Maximum number of sigma clipping iterations.
+        fwhm (float | None): FWHM of the PSF in pixels.
+        n_workers (int): Number of frames to compute the background of concurrently. The frames are kept in order.
+        use_processes (bool): Use a process pool instead of threads for n_workers > 1.
+        keep_sky_results (bool): Return the Background2D of each frame as sky_results.
+
+    Returns:
+        dict: The combined sky, sky_err and sky_dq, the sky_scales of the frames,
+            and the Background2D of each frame as sky_results if keep_sky_results.
+    """
     n_frames = data_cube.shape[0]
-    sky_results = [calc_sky_imager(data_cube[i, :, :], dq_cube[i, :, :] > 0, box_size=box_size, filter_size=filter_size, sigma_clip=sigma_clip, fwhm=fwhm, maxiters=maxiters) for i in range(n_frames)]
-    sky_medians = [math.biweight_location(sky.background) for sky in sky_results]
+    kwargs = dict(box_size=box_size, filter_size=filter_size, sigma_clip=sigma_clip, fwhm=fwhm, maxiters=maxiters)
+
+    # Background and RMS planes of each frame in the order of the frames, in the data type of Background2D
+    cubes = {}
+    sky_results = [None] * n_frames
+    worker = calc_sky_imager if keep_sky_results else calc_sky_planes
+    def store(i, result):
+        if keep_sky_results:
+            sky_results[i] = result
+            planes = result.background, result.background_rms
+        else:
+            planes = result
+        for key, plane in zip(('background', 'background_err'), planes):
+            if key not in cubes:
+                cubes[key] = np.empty((n_frames,) + plane.shape, dtype=plane.dtype)
+            cubes[key][i] = plane
+
+    if n_workers > 1:
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor(max_workers=n_workers) as pool:
+            futures = {
+                pool.submit(worker, data_cube[i, :, :], dq_cube[i, :, :] > 0, **kwargs): i
+                for i in range(n_frames)
+            }
+            for future in as_completed(futures):
+                store(futures.pop(future), future.result())
+    else:
+        for i in range(n_frames):
+            store(i, worker(data_cube[i, :, :], dq_cube[i, :, :] > 0, **kwargs))
+
+    # Scale the backgrounds to their mean level in place
+    sky_medians = math.frame_stats(cubes['background'], stats=('biweight_location',))['biweight_location']
     sky_ref = np.mean(sky_medians)
     scales = sky_medians / sky_ref
-    background_cube_scaled = np.array(
-        [sky_results[i].background * scales[i] for i in range(n_frames)],
-        dtype=data_cube.dtype
-    )
-    background_err_cube_scaled = np.array(
-        [sky_results[i].background_rms * scales[i] for i in range(n_frames)],
-        dtype=data_cube.dtype
-    )
+    for i in range(n_frames):
+        cubes['background'][i] *= scales[i]
+        cubes['background_err'][i] *= scales[i]
+    background_cube_scaled = cubes.pop('background').astype(data_cube.dtype, copy=False)
+    background_err_cube_scaled = cubes.pop('background_err').astype(data_cube.dtype, copy=False)
     result = _combine_frames(
         background_cube_scaled, background_err_cube_scaled, dq_cube,
         method='mean',
         do_sigma_clip=True, sigma_thresh_low=4, sigma_thresh_high=3, # NOTE: Should we still be more sensitive to upper outliers?
         dtype_out=background_cube_scaled.dtype,
     )
-    return dict(
+    result = dict(
         sky=result['data'], sky_err=result['err'], sky_dq=result['dq'],
-        sky_scales=scales, sky_results=sky_results
+        sky_scales=scales
     )
+    if keep_sky_results:
+        result['sky_results'] = sky_results
+    return result
+
+
+def calc_sky_planes(image : np.ndarray, mask : np.ndarray, **kwargs) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The background and background RMS planes of a single image from `calc_sky_imager`.
+    The Background2D object and its intermediates are freed when this returns.
+
+    Args:
+        image (np.ndarray) : The input image data.
+        mask (np.ndarray) : The input mask, True for masked pixels.
+        kwargs : Arguments passed to `calc_sky_imager`.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The background and background RMS.
+    """
+    bkg = calc_sky_imager(image, mask, **kwargs)
+    return bkg.background, bkg.background_rms
 
 
 def calc_sky_imager(
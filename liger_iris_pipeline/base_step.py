@@ -97,7 +97,7 @@ class LigerIRISStep(Step):
         return datamodels.open(init, **kwargs)
     
     
-    def open_model(self, name : str | LigerIRISDataModel, copy : bool = False):
+    def open_model(self, name : str | LigerIRISDataModel, copy : bool = False, memmap : bool = False):
         """
         Open a model from a file or copy an existing datamodel in the context of this Step.
         Any Step that opens a DataModel should call this method.
@@ -105,6 +105,7 @@ class LigerIRISStep(Step):
         Args:
             name (str | LigerIRISDataModel): The name of the file or the datamodel to open.
             copy (bool, optional): Copy and return the input if already a `LigerIRISDataModel`. Defaults to False.
+            memmap (bool, optional): Memory map the arrays when opening from a file. Defaults to False.
 
         Returns:
             (LigerIRISDataModel): The opened or copied datamodel.
@@ -115,7 +116,7 @@ class LigerIRISStep(Step):
             else:
                 return name
         if isinstance(name, str):
-            return datamodels.open(name)
+            return datamodels.open(name, memmap=memmap)
         else:
             raise ValueError(f"Cannot open model from {name}")
     
@@ -192,15 +193,15 @@ class LigerIRISStep(Step):
             if output_dir is None:
                 output_dir = self.output_dir
             if output_filename is None:
-                output_filename = model._filepath
+                output_filename = getattr(model, '_filepath', None)
             filepath = self.make_output_path(model, filename=output_filename, output_dir=output_dir, suffix=suffix)
-            filepath = model.save(output_path)
+            output_path = model.save(filepath)
 
         # Log
         self.log.info(f"Saved model in {output_path}")
 
         # Return the filepath
-        return filepath
+        return output_path
 
 
     def run(self, input, **kwargs):
@@ -247,6 +248,7 @@ class LigerIRISStep(Step):
 
                 # Prefetch references
                 self._reference_files_used = []
+                self._saved_results = []
                 if not self.skip and self.prefetch_references:
                     self.prefetch(input)
 
@@ -265,19 +267,23 @@ class LigerIRISStep(Step):
                     self.log.info(f"Skipping step {self.name}")
 
                 # Update meta information regardless of skip
+                # Results already saved during process were finalized before saving
                 if isinstance(step_result, Sequence):
                     for result in step_result:
-                        self.finalize_result(result, self._reference_files_used)
+                        if not any(result is saved for saved in self._saved_results):
+                            self.finalize_result(result, self._reference_files_used)
                 else:
                     self.finalize_result(step_result, self._reference_files_used)
 
                 self._reference_files_used = [] # Reset?
 
                 # Save the results even if skipped since metadata is udpated.
+                # Results already saved during process (e.g. in the background) are skipped.
                 if self.save_results:
                     if isinstance(step_result, Sequence):
                         for result in step_result:
-                            self.save_model(result, output_dir=self.output_dir)
+                            if not any(result is saved for saved in self._saved_results):
+                                self.save_model(result, output_dir=self.output_dir)
                     else:
                         self.save_model(step_result, output_dir=self.output_dir)
 
@@ -354,7 +360,7 @@ class LigerIRISStep(Step):
             
         # Determine the directory
         if output_dir is None:
-            if model._filename is not None:
+            if getattr(model, '_filepath', None) is not None:
                 output_dir = os.path.dirname(os.path.abspath(model._filepath))
             else:
                 output_dir = os.getcwd()
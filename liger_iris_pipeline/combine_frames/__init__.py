@@ -1,3 +1,4 @@
 from .combine_frames_step import CombineFramesStep
+from .frame_accumulator import FrameAccumulator
 
-__all__ = ['CombineFramesStep']
+__all__ = ['CombineFramesStep', 'FrameAccumulator']
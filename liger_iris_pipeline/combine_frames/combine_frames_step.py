@@ -1,16 +1,27 @@
 from ..base_step import LigerIRISStep
 from .. import datamodels
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
 import numpy as np
-import jwst.model_blender as model_blender
+from astropy.io import fits
 from ..utils import math
-from numba import njit
-from ..utils.errors import measure_error, propagate_error
+from numba import njit, prange
+from ..utils.errors import measure_error_n, propagate_error_n
 from ..utils.endian_utils import normalize_dtype_array
+from ..utils.parallel import numba_threads
 
 
 __all__ = ["CombineFramesStep", "combine_frames"]
 
 
+# Method codes of the fused combine kernel
+_COMBINE_METHODS = {'mean': 0, 'wmean': 1, 'median': 2, 'wmedian': 3}
+_ERROR_CALCS = {'measure': 0, 'propagate': 1}
+_REJECT_METHODS = {'sigma_clip': 0, 'minmax': 1, 'percentile': 2, 'threshold': 3}
+
+
 class CombineFramesStep(LigerIRISStep):
     """
     CombineFramesStep: Combines a set of 2D frames.
@@ -20,15 +31,24 @@ class CombineFramesStep(LigerIRISStep):
     spec = """
         method = string(default = 'mean') # Method for combining the frames - 'mean', 'wmean', 'median', 'wmedian'.
         do_sigma_clip = boolean(default = True) # Whether to do sigma clipping. Sigma clipping is based on the biweight location and biweight midvariance (both unweighted), regardless of the 'method' parameter.
+        reject = string(default = 'sigma_clip') # Outlier rejection - 'sigma_clip' (if do_sigma_clip), 'minmax' (num_mask_low lowest and num_mask_high highest values), 'percentile' (values outside percentile_low and percentile_high) or 'threshold' (values outside value_low and value_high).
+        percentile_low = float(default = None) # Lower percentile for reject='percentile'.
+        percentile_high = float(default = None) # Upper percentile for reject='percentile'.
+        value_low = float(default = None) # Values below this are rejected for reject='threshold'. At least one of value_low and value_high is required.
+        value_high = float(default = None) # Values above this are rejected for reject='threshold'.
         sigma_thresh_low = float(default = 4) # Number of sigma for low outlier rejection.
         sigma_thresh_high = float(default = 4) # Number of sigma for high outlier rejection.
-        thresh_low = float(default = None) # Low threshold for outlier rejection.
-        thresh_high = float(default = None) # High threshold for outlier rejection.
+        thresh_low = float(default = None) # Low threshold of the residuals from the center for sigma clipping.
+        thresh_high = float(default = None) # High threshold of the residuals from the center for sigma clipping.
         num_mask_low = integer(default = None) # Number of low outliers to mask.
         num_mask_high = integer(default = None) # Number of high outliers to mask.
         min_batch_size = integer(default = 3) # Minimum batch size for sigma clipping.
         maxiters = integer(default = 50) # Maximum number of iterations for sigma clipping.
         error_calc = string(default = 'measure') # Method for calculating the error - 'measure' or 'propagate'. Default is 'measure'.
+        n_threads = integer(default = None) # Number of threads for the sigma clipping and error kernels. None uses all available cores, 1 runs serially.
+        tile_rows = integer(default = None) # Number of rows of all frames to stack and combine at a time. Only one tile of rows of the input files is read at a time. None combines all rows at once unless max_memory is set.
+        max_memory = float(default = None) # Approximate memory budget in GB for each tile of rows. Ignored if tile_rows is set.
+        n_processes = integer(default = None) # Number of processes. Values > 1 place the stacks in shared memory and combine shards of tile_rows rows (default ny / (4 n_processes)) in a process pool. None runs in this process.
     """
 
     class_alias = "combine_frames"
@@ -43,22 +63,45 @@ class CombineFramesStep(LigerIRISStep):
             min_batch_size=self.min_batch_size,
             maxiters=self.maxiters,
             do_sigma_clip=self.do_sigma_clip,
-            dq_reduce='or'
+            reject=self.reject,
+            percentile_low=self.percentile_low, percentile_high=self.percentile_high,
+            value_low=self.value_low, value_high=self.value_high,
+            dq_reduce='or',
+            n_threads=self.n_threads,
+            tile_rows=self.tile_rows,
+            max_memory=self.max_memory,
+            n_processes=self.n_processes
         )
-        with datamodels.open(input[0]) as model:
-            target_model = model.__class__
+        if isinstance(input[0], str):
+            with fits.open(input[0], lazy_load_hdus=True) as hdulist:
+                target_model = datamodels.class_from_model_type(hdulist)
+        else:
+            target_model = input[0].__class__
         result = target_model(data=result['data'], err=result['err'], dq=result['dq'])
-        model_blender.blendmodels(result, input) # TODO: Make sure individual models are stored in header
+        datamodels.blend_models(result, input)
         self.status = "COMPLETE"
         return result
     
 
-def combine_frames(input : list[str | datamodels.LigerIRISDataModel], **kwargs) -> dict[str, np.ndarray]:
+def combine_frames(
+    input : list[str | datamodels.LigerIRISDataModel],
+    tile_rows : int | None = None,
+    max_memory : float | None = None,
+    n_processes : int | None = None,
+    **kwargs
+) -> dict[str, np.ndarray]:
     """
     Combine a stack of 2D frames.
 
+    The frames are combined one tile of rows at a time. Only the rows of each tile are read from the input files,
+    so the peak memory scales with the size of a (Nframes, tile_rows, Nx) stack rather than with the number of frames.
+
     Args:
         input (list[str | datamodels.LigerIRISDataModel]): List of input frames to combine.
+        tile_rows (int | None): Number of rows to stack and combine at a time. None combines all rows at once unless max_memory is set.
+        max_memory (float | None): Approximate memory budget in GB for each tile of rows. Ignored if tile_rows is set.
+        n_processes (int | None): Number of processes. Values > 1 place the full stacks in shared memory and combine
+            shards of `tile_rows` rows in a process pool, see `_combine_frames_sharded`. max_memory is then ignored.
         method (str): Method to use for combining the frames:
             - 'mean' : Unweighted mean.
             - 'wmean' : Weighted mean.
@@ -66,6 +109,7 @@ def combine_frames(input : list[str | datamodels.LigerIRISDataModel], **kwargs)
             - 'wmedian' : Weighted median.
             - 'sigma_clip' : Sigma clipping (see `cenfunc`, `stdfunc`, and `sigma`).
         sigma (float) : Number of sigmas for sigma-clipping.
+        reject (str): Outlier rejection, see `_combine_frames`.
         cenfunc (str): Function to use for calculating the center of the data:
             - 'mean' : Unweighted mean.
             - 'wmean' : Weighted mean.
@@ -75,15 +119,212 @@ def combine_frames(input : list[str | datamodels.LigerIRISDataModel], **kwargs)
             - 'measure' : Error is calcualted from the distribution (stddev) of the data relative to the final mean.
             - 'propagate' : Error is calculated by coadding the individual errors.
             Default is 'measure'.
+        n_threads (int | None): Number of threads for the sigma clipping and error kernels.
+            None uses all available cores, 1 runs serially.
+
+    Returns:
+        dict: Dictionary of combined frames.
+    """
+    with ExitStack() as stack:
+
+        # Open the input files without reading the arrays, models are used as given
+        frames = [
+            stack.enter_context(fits.open(x, lazy_load_hdus=True)) if isinstance(x, str) else x
+            for x in input
+        ]
+        ny, nx = frames[0]['DATA'].shape if isinstance(frames[0], fits.HDUList) else frames[0].shape
+        if n_processes is not None and n_processes > 1:
+            return _combine_frames_sharded(frames, n_processes, shard_rows=tile_rows, **kwargs)
+        tile_rows = get_tile_rows(frames[0], len(frames), tile_rows=tile_rows, max_memory=max_memory)
+
+        # Stack, clip and combine one tile of rows at a time into the output planes
+        out = {}
+        for y0 in range(0, ny, tile_rows):
+            y1 = min(y0 + tile_rows, ny)
+            cubes = make_tile_cubes(frames, attrs=('data', 'err', 'dq'), rows=slice(y0, y1))
+            result = _combine_frames(cubes['data'], cubes['err'], cubes['dq'], **kwargs)
+            for key, image in result.items():
+                if key not in out:
+                    out[key] = np.empty((ny, nx), dtype=image.dtype)
+                out[key][y0:y1] = image
+
+    return out
+
+
+def get_tile_rows(
+    frame : fits.HDUList | datamodels.LigerIRISDataModel,
+    n_frames : int,
+    tile_rows : int | None = None,
+    max_memory : float | None = None
+) -> int:
+    """
+    Number of rows to stack and combine at a time from `tile_rows` or `max_memory`.
+
+    Args:
+        frame (fits.HDUList | datamodels.LigerIRISDataModel): The first input frame.
+        n_frames (int): Number of frames to combine.
+        tile_rows (int | None): Number of rows per tile.
+        max_memory (float | None): Approximate memory budget in GB for each tile of rows.
+
+    Returns:
+        int: Number of rows per tile.
+    """
+    if isinstance(frame, fits.HDUList):
+        (ny, nx), itemsizes = frame['DATA'].shape, [abs(frame[name].header['BITPIX']) // 8 for name in ('DATA', 'ERR', 'DQ')]
+    else:
+        (ny, nx), itemsizes = frame.shape, [getattr(frame, name).dtype.itemsize for name in ('data', 'err', 'dq')]
+    if tile_rows is not None:
+        return int(np.clip(tile_rows, 1, ny))
+    if max_memory is not None:
+        # data, err and dq stacks, plus the weights and mask stacks of _combine_frames
+        bytes_per_pixel = itemsizes[0] + 2 * itemsizes[1] + itemsizes[2] + 1
+        bytes_per_row = n_frames * nx * bytes_per_pixel
+        return int(np.clip(max_memory * 1E9 // bytes_per_row, 1, ny))
+    return ny
+
+
+def make_tile_cubes(
+    frames : list[fits.HDUList | datamodels.LigerIRISDataModel],
+    attrs : tuple[str],
+    rows : slice
+) -> dict[str, np.ndarray]:
+    """
+    Create cubes of a tile of rows from a list of frames.
+    Only the rows of the tile are read for frames given as open FITS files.
+
+    Args:
+        frames (list[fits.HDUList | datamodels.LigerIRISDataModel]): The frames.
+        attrs (tuple[str]): List of attributes to extract from the frames.
+        rows (slice): The rows of the tile.
+
+    Returns:
+        dict[str, np.ndarray]: Dictionary of cubes with shape (Nframes, Ny_tile, Nx).
+    """
+    out = {}
+    n_frames = len(frames)
+    for attr in attrs:
+        for i in range(n_frames):
+            tile = _read_rows(frames[i], attr, rows)
+            if i == 0:
+                # Native byte order, FITS arrays are big-endian
+                out[attr] = np.empty((n_frames,) + tile.shape, dtype=tile.dtype.type)
+            out[attr][i] = tile
+    return out
+
+
+def _read_rows(frame : fits.HDUList | datamodels.LigerIRISDataModel, attr : str, rows : slice) -> np.ndarray:
+    """
+    Read rows of an array of a frame, only the rows are read for open FITS files.
+    """
+    if isinstance(frame, fits.HDUList):
+        return frame[attr.upper()].section[rows]
+    return getattr(frame, attr)[rows]
+
+
+def _combine_frames_sharded(
+    frames : list[fits.HDUList | datamodels.LigerIRISDataModel],
+    n_processes : int,
+    shard_rows : int | None = None,
+    **kwargs
+) -> dict[str, np.ndarray]:
+    """
+    Combine frames with a process pool. The data, err and dq stacks and the output images are placed in shared memory,
+    and each worker combines shards of rows with `_combine_frames`, writing into the shared outputs.
+    The results are identical to `_combine_frames` on the full stacks.
+
+    Args:
+        frames (list[fits.HDUList | datamodels.LigerIRISDataModel]): The frames.
+        n_processes (int): Number of processes.
+        shard_rows (int | None): Number of rows per shard. None uses ny / (4 n_processes) for load balancing.
+        kwargs: Arguments passed to `_combine_frames`. n_threads defaults to 1 per process.
 
     Returns:
         dict: Dictionary of combined frames.
     """
-    cubes = make_cubes(input, attrs=('data', 'err', 'dq'))
-    data_cube = cubes['data']
-    error_cube = cubes['err']
-    dq_cube = cubes['dq']
-    return _combine_frames(data_cube, error_cube, dq_cube, **kwargs)
+    n_frames = len(frames)
+    ny, nx = frames[0]['DATA'].shape if isinstance(frames[0], fits.HDUList) else frames[0].shape
+    if shard_rows is None:
+        shard_rows = -(-ny // (4 * n_processes))
+    shard_rows = int(np.clip(shard_rows, 1, ny))
+    kwargs.setdefault('n_threads', 1)
+
+    blocks = []
+    try:
+        # Copy the stacks into shared memory one frame at a time
+        specs = {}
+        for attr in ('data', 'err', 'dq'):
+            dtype = np.dtype(_read_rows(frames[0], attr, slice(0, 1)).dtype.type)
+            block = shared_memory.SharedMemory(create=True, size=max(n_frames * ny * nx * dtype.itemsize, 1))
+            blocks.append(block)
+            cube = np.ndarray((n_frames, ny, nx), dtype=dtype, buffer=block.buf)
+            for i in range(n_frames):
+                cube[i] = _read_rows(frames[i], attr, slice(None))
+            specs[attr] = (block.name, (n_frames, ny, nx), dtype.str)
+            del cube
+
+        # Shared outputs with the dtypes of _combine_frames
+        dtypes_out = dict(
+            data=np.dtype(kwargs['dtype_out']) if kwargs.get('dtype_out') is not None else np.dtype(specs['data'][2]),
+            err=np.dtype(specs['err'][2]), dq=np.dtype(specs['dq'][2])
+        )
+        for key, dtype in dtypes_out.items():
+            block = shared_memory.SharedMemory(create=True, size=max(ny * nx * dtype.itemsize, 1))
+            blocks.append(block)
+            specs[key + '_out'] = (block.name, (ny, nx), dtype.str)
+
+        # Combine the shards in worker processes started from a clean server process rather than forked,
+        # since forking after a parallel kernel ran (e.g. on the TBB threading layer) can hang the workers.
+        # The workers load the kernels from the numba cache instead of compiling them.
+        with ProcessPoolExecutor(
+            max_workers=n_processes, mp_context=_mp_context(), initializer=_attach_shared, initargs=(specs,)
+        ) as pool:
+            futures = [pool.submit(_combine_shard, y0, min(y0 + shard_rows, ny), kwargs) for y0 in range(0, ny, shard_rows)]
+            for future in futures:
+                future.result()
+
+        # Copy the outputs out of shared memory
+        out = {}
+        for key, block in zip(('data', 'err', 'dq'), blocks[3:]):
+            out[key] = np.ndarray((ny, nx), dtype=dtypes_out[key], buffer=block.buf).copy()
+        return out
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+# Shared arrays attached in each worker of _combine_frames_sharded
+_shared_arrays = {}
+
+
+def _mp_context():
+    """
+    The multiprocessing context of the workers of _combine_frames_sharded, 'forkserver' where available, else 'spawn'.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def _attach_shared(specs : dict):
+    _detach_shared()
+    for key, (name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        _shared_arrays[key] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+
+def _detach_shared():
+    blocks = [block for block, _ in _shared_arrays.values()]
+    _shared_arrays.clear()
+    for block in blocks:
+        block.close()
+
+
+def _combine_shard(y0 : int, y1 : int, kwargs : dict):
+    cubes = {key: _shared_arrays[key][1][:, y0:y1] for key in ('data', 'err', 'dq')}
+    result = _combine_frames(cubes['data'], cubes['err'], cubes['dq'], **kwargs)
+    for key, image in result.items():
+        _shared_arrays[key + '_out'][1][y0:y1] = image
 
 
 def _combine_frames(
@@ -97,9 +338,13 @@ def _combine_frames(
     num_mask_low : int | None = None, num_mask_high : int | None = None,
     min_batch_size : int = 3,
     maxiters : int = 50,
+    reject : str = 'sigma_clip',
+    percentile_low : float | None = None, percentile_high : float | None = None,
+    value_low : float | None = None, value_high : float | None = None,
     error_calc : str = 'measure',
     dtype_out = None,
     dq_reduce : str = 'and',
+    n_threads : int | None = None,
 ) -> dict[str, np.ndarray]:
     """
     Combine a stack of 2D frames.
@@ -119,69 +364,185 @@ def _combine_frames(
             - 'wmean' : Weighted mean.
             - 'median' : Unweighted median.
             - 'wmedian' : Weighted median.
+        reject (str): Outlier rejection of each pixel stack, after masking flagged and NaN values:
+            - 'sigma_clip' : Iterative sigma clipping if do_sigma_clip.
+            - 'minmax' : Reject the num_mask_low lowest and num_mask_high highest values.
+              Nothing is rejected for pixels with num_mask_low + num_mask_high or fewer good values.
+            - 'percentile' : Reject the values below the percentile_low and above the percentile_high
+              percentile (linear interpolation as in np.percentile).
+            - 'threshold' : Reject the values below value_low and above value_high, at least one is required.
+              Unlike thresh_low and thresh_high of the sigma clipping, these are absolute values rather than residuals.
+            The 'minmax', 'percentile' and 'threshold' rejections are single pass, O(N) per pixel with partial selection.
 
         error_calc (str): Method to use for calculating the error ('measure' or 'propagate').
             - 'measure' : Error is calcualted from the distribution (stddev) of the data relative to the final mean.
             - 'propagate' : Error is calculated by coadding the individual errors.
             Default is 'measure'.
+        n_threads (int | None): Number of threads for the sigma clipping and error kernels.
+            None uses all available cores, 1 runs serially.
 
     Returns:
         dict: Dictionary of combined frames.
     """
 
-    # Get weights and mask bad pixels
-    mask_cube = dq_cube > 0
-    weights_cube = 1 / error_cube**2
-    weights_cube[mask_cube] = 0 # Set weights to 0 where mask is True
+    method = method.lower()
+    if method not in _COMBINE_METHODS:
+        raise ValueError(f"Unknown method: {method}")
+    if error_calc not in _ERROR_CALCS:
+        raise ValueError(f"Unknown error calculation method: {error_calc}")
+    if dq_reduce.lower() not in ('or', 'and'):
+        raise ValueError(f"Unknown DQ reduction method: {dq_reduce}")
+    reject = reject.lower()
+    if reject not in _REJECT_METHODS:
+        raise ValueError(f"Unknown rejection method: {reject}")
+
+    # Bounds of the rank, percentile or threshold rejection, None rejects nothing on that side
+    if reject == 'minmax':
+        reject_low = 0 if num_mask_low is None else num_mask_low
+        reject_high = 0 if num_mask_high is None else num_mask_high
+    elif reject == 'percentile':
+        reject_low = 0 if percentile_low is None else percentile_low
+        reject_high = 100 if percentile_high is None else percentile_high
+        if not 0 <= reject_low <= reject_high <= 100:
+            raise ValueError(f"Percentiles must satisfy 0 <= percentile_low <= percentile_high <= 100, got {reject_low}, {reject_high}")
+    elif reject == 'threshold':
+        if value_low is None and value_high is None:
+            raise ValueError("reject='threshold' requires value_low or value_high")
+        reject_low = -np.inf if value_low is None else value_low
+        reject_high = np.inf if value_high is None else value_high
+    else:
+        reject_low = reject_high = 0
 
     # Get output data type
     if dtype_out is None:
         dtype_out = data_cube.dtype
 
-    # Check if we do sigma clipping
-    if do_sigma_clip:
-        sigma_clip_cube(
-            data_cube, mask_cube,
+    # Clip, combine and reduce each pixel stack in a single pass, the input cubes are not modified
+    _, ny, nx = data_cube.shape
+    data_out = np.empty((ny, nx), dtype=dtype_out)
+    err_out = np.empty((ny, nx), dtype=error_cube.dtype)
+    dq_out = np.empty((ny, nx), dtype=dq_cube.dtype)
+    with numba_threads(n_threads):
+        _combine_cube(
+            data_cube, error_cube, dq_cube,
+            data_out, err_out, dq_out,
+            _COMBINE_METHODS[method], _ERROR_CALCS[error_calc], dq_reduce.lower() == 'or',
+            do_sigma_clip, _REJECT_METHODS[reject],
             sigma_thresh_low=sigma_thresh_low, sigma_thresh_high=sigma_thresh_high,
             thresh_low=thresh_low, thresh_high=thresh_high,
             num_mask_low=num_mask_low, num_mask_high=num_mask_high,
             min_batch_size=min_batch_size,
             maxiters=maxiters,
+            reject_low=float(reject_low), reject_high=float(reject_high),
         )
-        weights_cube[mask_cube] = 0
-        data_cube[mask_cube] = np.nan
 
-    # Run the requeted method
-    method = method.lower()
-    if method == 'mean':
-        data_out = np.nanmean(data_cube, axis=0)
-    elif method == 'median':
-        data_out = np.nanmedian(data_cube, axis=0)
-    elif method == 'wmean':
-        masked_data = np.ma.masked_array(data_cube, mask=mask_cube)
-        data_out = np.ma.average(masked_data, axis=0, weights=weights_cube)
-    elif method == 'wmedian':
-        data_out = weighted_quantile_cube(data_cube, weights_cube, q=0.5)
-    else:
-        raise ValueError(f"Unknown method: {method}")
-    
-    # Calulate the error
-    if error_calc == 'measure':
-        err_out = meaure_error_cube(data_cube, error_cube, dq_cube)
-    elif error_calc == 'propagate':
-        err_out = propagate_error_cube(error_cube, dq_cube)
-    else:
-        raise ValueError(f"Unknown error calculation method: {error_calc}")
+    return dict(data=data_out, err=err_out, dq=dq_out)
 
-    # Reduce the DQ flags
-    if dq_reduce.lower() == 'or':
-        dq_out = np.bitwise_or.reduce(dq_cube, axis=0)
-    elif dq_reduce.lower() == 'and':
-        dq_out = np.bitwise_and.reduce(dq_cube, axis=0)
-    else:
-        raise ValueError(f"Unknown DQ reduction method: {dq_reduce}")
 
-    return dict(data=data_out, err=err_out, dq=dq_out)
+@njit(nogil=True, parallel=True, cache=True)
+def _combine_cube(
+    data_cube : np.ndarray, error_cube : np.ndarray, dq_cube : np.ndarray,
+    data_out : np.ndarray, err_out : np.ndarray, dq_out : np.ndarray,
+    method : int, error_calc : int, dq_or : bool,
+    do_sigma_clip : bool, reject : int,
+    sigma_thresh_low : float | None = None, sigma_thresh_high : float | None = None,
+    thresh_low : float | None = None, thresh_high : float = None,
+    num_mask_low : int | None = None, num_mask_high : int | None = None,
+    min_batch_size : int = 3,
+    maxiters : int = 50,
+    reject_low : float = 0.0, reject_high : float = 0.0,
+):
+    n_frames, ny, nx = data_cube.shape
+    for i in prange(ny):
+
+        # Thread-local scratch for the pixel stacks of this row, gathered along contiguous rows of each frame
+        data = np.empty((nx, n_frames), dtype=data_cube.dtype)
+        error = np.empty((nx, n_frames), dtype=error_cube.dtype)
+        dq = np.empty((nx, n_frames), dtype=dq_cube.dtype)
+        for k in range(n_frames):
+            for j in range(nx):
+                data[j, k] = data_cube[k, i, j]
+                error[j, k] = error_cube[k, i, j]
+                dq[j, k] = dq_cube[k, i, j]
+
+        # Workspaces for the mask, the sigma clipping and the good values of one stack
+        mask = np.empty(n_frames, dtype=np.bool_)
+        work = np.empty(2 * n_frames, dtype=np.float64)
+        values = np.empty(n_frames, dtype=np.float64)
+        errors = np.empty(n_frames, dtype=np.float64)
+        weights = np.empty(n_frames, dtype=np.float64)
+
+        for j in range(nx):
+
+            # Reduce the DQ flags and mask flagged and NaN values
+            dq_pix = dq[j, 0]
+            for k in range(n_frames):
+                if dq_or:
+                    dq_pix |= dq[j, k]
+                else:
+                    dq_pix &= dq[j, k]
+                mask[k] = dq[j, k] > 0 or np.isnan(data[j, k])
+            dq_out[i, j] = dq_pix
+
+            # Outlier rejection
+            if reject == 0:
+                if do_sigma_clip and not math.all_sc(mask):
+                    _sigma_clip_inplace(
+                        data[j], mask,
+                        sigma_thresh_low=sigma_thresh_low, sigma_thresh_high=sigma_thresh_high,
+                        thresh_low=thresh_low, thresh_high=thresh_high,
+                        num_mask_low=num_mask_low, num_mask_high=num_mask_high,
+                        min_batch_size=min_batch_size,
+                        maxiters=maxiters,
+                        work=work,
+                    )
+            elif reject == 1:
+                reject_minmax(data[j], mask, int(reject_low), int(reject_high), work)
+            elif reject == 2:
+                reject_percentile(data[j], mask, reject_low, reject_high, work)
+            else:
+                reject_threshold(data[j], mask, reject_low, reject_high)
+
+            # Gather the good values
+            n_good = 0
+            for k in range(n_frames):
+                if not mask[k]:
+                    values[n_good] = data[j, k]
+                    errors[n_good] = error[j, k]
+                    weights[n_good] = 1 / errors[n_good]**2
+                    n_good += 1
+
+            # Combine
+            if n_good == 0:
+                data_out[i, j] = np.nan
+            elif method == 0:
+                sum_x = 0.0
+                for k in range(n_good):
+                    sum_x += values[k]
+                data_out[i, j] = sum_x / n_good
+            elif method == 1:
+                sum_wx = 0.0
+                sum_w = 0.0
+                for k in range(n_good):
+                    sum_wx += weights[k] * values[k]
+                    sum_w += weights[k]
+                data_out[i, j] = sum_wx / sum_w
+            elif method == 2:
+                # Select in the workspace, the order of values is kept for the error
+                for k in range(n_good):
+                    work[k] = values[k]
+                data_out[i, j] = math.median_inplace(work, n_good)
+            else:
+                # Weighted selection in the workspace, permuting the weights with it
+                for k in range(n_good):
+                    work[k] = values[k]
+                data_out[i, j] = math.weighted_quantile_select(work, weights, n_good, 0.5)
+
+            # Error of the good values
+            if error_calc == 0:
+                err_out[i, j] = measure_error_n(values, errors, n_good)
+            else:
+                err_out[i, j] = propagate_error_n(errors, n_good)
 
 
 def make_cubes(
@@ -217,44 +578,99 @@ def make_cubes(
     return out
 
 
-@njit(nogil=True)
-def weighted_quantile_cube(cube : np.ndarray, weights : np.ndarray, image_out : np.ndarray, q : float = 0.5):
-    ny, nx = cube.shape[1:]
-    image_out = np.full((ny, nx), np.nan, dtype=cube.dtype)
-    for i in range(ny):
+@njit(nogil=True, parallel=True, cache=True)
+def weighted_quantile_cube(cube : np.ndarray, weights : np.ndarray, q : float = 0.5, image_out : np.ndarray | None = None) -> np.ndarray:
+    """
+    Weighted quantile of each pixel stack of a cube by weighted quickselect, in parallel over rows.
+    Only values with weights > 0 are used, pixels without any are NaN.
+
+    Args:
+        cube (np.ndarray): The data cube with shape (Nframes, Ny, Nx).
+        weights (np.ndarray): The weights, same shape as cube.
+        q (float): The quantile in [0, 1].
+        image_out (np.ndarray | None): Output image with shape (Ny, Nx). None allocates one with the dtype of cube.
+
+    Returns:
+        np.ndarray: The weighted quantile image.
+    """
+    n_frames, ny, nx = cube.shape
+    if image_out is None:
+        image_out = np.empty((ny, nx), dtype=cube.dtype)
+    for i in prange(ny):
+        # Thread-local workspaces for the good values and weights of one stack
+        values = np.empty(n_frames, dtype=np.float64)
+        _weights = np.empty(n_frames, dtype=np.float64)
         for j in range(nx):
-            good = np.where(weights[:, i, j] > 0)[0]
-            if len(good) > 0:
-                image_out[i, j] = math.weighted_quantile(cube[good, i, j], weights[good, i, j], q)
+            n_good = 0
+            for k in range(n_frames):
+                if weights[k, i, j] > 0:
+                    values[n_good] = cube[k, i, j]
+                    _weights[n_good] = weights[k, i, j]
+                    n_good += 1
+            image_out[i, j] = math.weighted_quantile_select(values, _weights, n_good, q)
     return image_out
 
 
-@njit(nogil=True)
+@njit(nogil=True, parallel=True, cache=True)
 def propagate_error_cube(
     error_cube : np.ndarray,
     dq_cube : np.ndarray,
 ) -> np.ndarray:
-    _, ny, nx = error_cube.shape
+    n_frames, ny, nx = error_cube.shape
     error_image_out = np.full((ny, nx), np.nan, dtype=error_cube.dtype)
-    for i in range(ny):
+    for i in prange(ny):
+        # Thread-local scratch for the pixel stacks of this row, gathered along contiguous rows of each frame
+        error = np.empty((nx, n_frames), dtype=error_cube.dtype)
+        dq = np.empty((nx, n_frames), dtype=dq_cube.dtype)
+        for k in range(n_frames):
+            for j in range(nx):
+                error[j, k] = error_cube[k, i, j]
+                dq[j, k] = dq_cube[k, i, j]
+
+        # Gather the good errors of each stack and reduce them with the core of _combine_cube
+        errors = np.empty(n_frames, dtype=np.float64)
         for j in range(nx):
-            error_image_out[i, j] = propagate_error(error_cube[:, i, j], dq_cube[:, i, j])
+            n_good = 0
+            for k in range(n_frames):
+                if dq[j, k] == 0:
+                    errors[n_good] = error[j, k]
+                    n_good += 1
+            error_image_out[i, j] = propagate_error_n(errors, n_good)
     return error_image_out
 
 
-@njit(nogil=True)
+@njit(nogil=True, parallel=True, cache=True)
 def meaure_error_cube(
     data_cube : np.ndarray, error_cube : np.ndarray, dq_cube : np.ndarray,
 ) -> np.ndarray:
-    _, ny, nx = error_cube.shape
+    n_frames, ny, nx = error_cube.shape
     error_image_out = np.full((ny, nx), np.nan, dtype=error_cube.dtype)
-    for i in range(ny):
+    for i in prange(ny):
+        # Thread-local scratch for the pixel stacks of this row
+        data = np.empty((nx, n_frames), dtype=data_cube.dtype)
+        error = np.empty((nx, n_frames), dtype=error_cube.dtype)
+        dq = np.empty((nx, n_frames), dtype=dq_cube.dtype)
+        for k in range(n_frames):
+            for j in range(nx):
+                data[j, k] = data_cube[k, i, j]
+                error[j, k] = error_cube[k, i, j]
+                dq[j, k] = dq_cube[k, i, j]
+
+        # Gather the good values of each stack and reduce them with the core of _combine_cube
+        values = np.empty(n_frames, dtype=np.float64)
+        errors = np.empty(n_frames, dtype=np.float64)
         for j in range(nx):
-            error_image_out[i, j] = measure_error(data_cube[:, i, j], error_cube[:, i, j], dq_cube[:, i, j])
+            n_good = 0
+            for k in range(n_frames):
+                if dq[j, k] == 0:
+                    values[n_good] = data[j, k]
+                    errors[n_good] = error[j, k]
+                    n_good += 1
+            error_image_out[i, j] = measure_error_n(values, errors, n_good)
     return error_image_out
 
 
-@njit(nogil=True)
+@njit(nogil=True, parallel=True, cache=True)
 def sigma_clip_cube(
     data_cube : np.ndarray, mask_cube : np.ndarray,
     sigma_thresh_low : float | None = None, sigma_thresh_high : float | None = None,
@@ -262,23 +678,34 @@ def sigma_clip_cube(
     num_mask_low : int | None = None, num_mask_high : int | None = None,
     min_batch_size : int = 3,
     maxiters : int = 50,
-) -> tuple[np.ndarray, np.ndarray]:
-    ny, nx = data_cube.shape[1:]
-    for i in range(ny):
+):
+    n_frames, ny, nx = data_cube.shape
+    for i in prange(ny):
+        # Thread-local scratch for the pixel stacks of this row and the sigma clipping workspace, as in _combine_cube
+        data = np.empty((nx, n_frames), dtype=data_cube.dtype)
+        mask = np.empty((nx, n_frames), dtype=mask_cube.dtype)
+        work = np.empty(2 * n_frames, dtype=np.float64)
+        for k in range(n_frames):
+            for j in range(nx):
+                data[j, k] = data_cube[k, i, j]
+                mask[j, k] = mask_cube[k, i, j]
         for j in range(nx):
-            mask = mask_cube[:, i, j]
-            if not math.all_sc(mask):
-                _mask_out, _, _, _ = sigma_clip(
-                    data_cube[:, i, j], mask,
+            if not math.all_sc(mask[j]):
+                _sigma_clip_inplace(
+                    data[j], mask[j],
                     sigma_thresh_low=sigma_thresh_low, sigma_thresh_high=sigma_thresh_high,
                     thresh_low=thresh_low, thresh_high=thresh_high,
                     num_mask_low=num_mask_low, num_mask_high=num_mask_high,
                     min_batch_size=min_batch_size,
                     maxiters=maxiters,
+                    work=work,
                 )
-                mask_cube[:, i, j] = _mask_out
+        for k in range(n_frames):
+            for j in range(nx):
+                mask_cube[k, i, j] = mask[j, k]
 
-@njit(nogil=True)
+
+@njit(nogil=True, cache=True)
 def sigma_clip(
     x: np.ndarray, mask: np.ndarray,
     sigma_thresh_low: float | None = None, sigma_thresh_high: float | None = None,
@@ -286,36 +713,80 @@ def sigma_clip(
     num_mask_low: int | None = None, num_mask_high: int | None = None,
     min_batch_size: int = 3,
     maxiters: int = 50,
+    work: np.ndarray | None = None,
 ) -> tuple[np.ndarray, float, float, int]:
 
     input_shape = x.shape
     x = x.ravel()
     mask = mask.ravel().copy()  # avoid modifying input mask
 
+    M, stddev, iters = _sigma_clip_inplace(
+        x, mask,
+        sigma_thresh_low=sigma_thresh_low, sigma_thresh_high=sigma_thresh_high,
+        thresh_low=thresh_low, thresh_high=thresh_high,
+        num_mask_low=num_mask_low, num_mask_high=num_mask_high,
+        min_batch_size=min_batch_size,
+        maxiters=maxiters,
+        work=work,
+    )
+
+    return mask.reshape(input_shape), M, stddev, iters
+
+
+@njit(nogil=True, cache=True)
+def _sigma_clip_inplace(
+    x: np.ndarray, mask: np.ndarray,
+    sigma_thresh_low: float | None = None, sigma_thresh_high: float | None = None,
+    thresh_low: float | None = None, thresh_high: float = None,
+    num_mask_low: int | None = None, num_mask_high: int | None = None,
+    min_batch_size: int = 3,
+    maxiters: int = 50,
+    work: np.ndarray | None = None,
+) -> tuple[float, float, int]:
+    """
+    Sigma clip the 1D array x, updating the 1D mask in place.
+    """
+
+    # Workspace for the unmasked values and the quickselect medians, reused across iterations
+    n = x.size
+    if work is None:
+        work = np.empty(2 * n, dtype=np.float64)
+    x_good = work[:n]
+    select_work = work[n:2 * n]
+
+    M = np.nan
+    stddev = np.nan
     for i in range(maxiters):
-        x_masked = x[~mask]  # select only unmasked values
-        if len(x_masked) <= min_batch_size:
+        # select only unmasked values
+        n_good = 0
+        for k in range(n):
+            if not mask[k]:
+                x_good[n_good] = x[k]
+                n_good += 1
+        if n_good <= min_batch_size:
             break
 
-        M = math.biweight_location(x_masked)
-        var = math.biweight_midvariance(x_masked, M=M)
+        M = math.biweight_location(x_good[:n_good], work=select_work)
+        var = math.biweight_midvariance(x_good[:n_good], M=M, work=select_work)
         stddev = np.sqrt(var)
 
-        n_good = np.sum(~mask)
-        mask = mask_outliers(
+        mask_outliers(
             x, M, stddev, mask,
             sigma_thresh_low=sigma_thresh_low, sigma_thresh_high=sigma_thresh_high,
             thresh_low=thresh_low, thresh_high=thresh_high,
             num_mask_low=num_mask_low, num_mask_high=num_mask_high,
         )
-        n_good_new = np.sum(~mask)
+        n_good_new = 0
+        for k in range(n):
+            if not mask[k]:
+                n_good_new += 1
         if n_good_new == n_good:
             break
 
-    return mask.reshape(input_shape), M, stddev, i + 1
+    return M, stddev, i + 1
 
 
-@njit(nogil=True)
+@njit(nogil=True, cache=True)
 def mask_outliers(
     x : np.ndarray,
     M : float, stddev : float,
@@ -324,27 +795,27 @@ def mask_outliers(
     thresh_low : float | None = None, thresh_high : float = None,
     num_mask_low : int | None = None, num_mask_high : int | None = None,
 ) -> np.ndarray:
-    res = (x - M).ravel()
+    x = x.ravel()
     mask = mask.ravel()
-    n = len(res)
+    n = len(x)
     masked_low = 0
     masked_high = 0
-    #import matplotlib.pyplot as plt
     for i in range(n):
         if mask[i]:
             continue
+        res_i = x[i] - M
 
         candidate_low = False
         candidate_high = False
 
-        if sigma_thresh_low is not None and res[i] < -sigma_thresh_low * stddev:
+        if sigma_thresh_low is not None and res_i < -sigma_thresh_low * stddev:
             candidate_low = True
-        if thresh_low is not None and res[i] < thresh_low:
+        if thresh_low is not None and res_i < thresh_low:
             candidate_low = True
 
-        if sigma_thresh_high is not None and res[i] > sigma_thresh_high * stddev:
+        if sigma_thresh_high is not None and res_i > sigma_thresh_high * stddev:
             candidate_high = True
-        if thresh_high is not None and res[i] > thresh_high:
+        if thresh_high is not None and res_i > thresh_high:
             candidate_high = True
 
         # Apply low-side masking
@@ -359,4 +830,86 @@ def mask_outliers(
                 mask[i] = True
                 masked_high += 1
 
-    return mask
\ No newline at end of file
+    return mask
+
+
+@njit(nogil=True, cache=True)
+def reject_minmax(x : np.ndarray, mask : np.ndarray, num_low : int, num_high : int, work : np.ndarray):
+    """
+    Mask the num_low lowest and num_high highest unmasked values of the 1D array x in place.
+    The cutoff values are found by partial selection in O(n), ties at the cutoffs are masked in order.
+    Nothing is masked if there are num_low + num_high or fewer unmasked values.
+
+    Args:
+        x (np.ndarray): The values.
+        mask (np.ndarray): The mask, True for masked values, updated in place.
+        num_low (int): Number of lowest values to mask.
+        num_high (int): Number of highest values to mask.
+        work (np.ndarray): Workspace with at least x.size elements.
+    """
+    n_good = _gather_unmasked(x, mask, work)
+    if n_good <= num_low + num_high:
+        return
+    if num_low > 0:
+        _mask_beyond(x, mask, math.select_kth(work, num_low - 1, n_good), num_low, True)
+    if num_high > 0:
+        _mask_beyond(x, mask, math.select_kth(work, n_good - num_high, n_good), num_high, False)
+
+
+@njit(nogil=True, cache=True)
+def reject_percentile(x : np.ndarray, mask : np.ndarray, percentile_low : float, percentile_high : float, work : np.ndarray):
+    """
+    Mask the unmasked values of the 1D array x below the percentile_low and above the percentile_high percentile
+    of the unmasked values in place. The percentiles are found by partial selection in O(n).
+
+    Args:
+        x (np.ndarray): The values.
+        mask (np.ndarray): The mask, True for masked values, updated in place.
+        percentile_low (float): Lower percentile in [0, 100].
+        percentile_high (float): Upper percentile in [0, 100].
+        work (np.ndarray): Workspace with at least x.size elements.
+    """
+    n_good = _gather_unmasked(x, mask, work)
+    if n_good == 0:
+        return
+    x_low = math.percentile_select(work, n_good, percentile_low)
+    x_high = math.percentile_select(work, n_good, percentile_high)
+    reject_threshold(x, mask, x_low, x_high)
+
+
+@njit(nogil=True, cache=True)
+def reject_threshold(x : np.ndarray, mask : np.ndarray, thresh_low : float, thresh_high : float):
+    """
+    Mask the values of the 1D array x below thresh_low and above thresh_high in place.
+    """
+    for k in range(x.size):
+        if x[k] < thresh_low or x[k] > thresh_high:
+            mask[k] = True
+
+
+@njit(nogil=True, cache=True)
+def _gather_unmasked(x : np.ndarray, mask : np.ndarray, work : np.ndarray) -> int:
+    n = 0
+    for k in range(x.size):
+        if not mask[k]:
+            work[n] = x[k]
+            n += 1
+    return n
+
+
+@njit(nogil=True, cache=True)
+def _mask_beyond(x : np.ndarray, mask : np.ndarray, cutoff : float, count : int, low : bool):
+    """
+    Mask the unmasked values below (low) or above the cutoff, then values equal to the cutoff until count are masked.
+    """
+    n_masked = 0
+    for k in range(x.size):
+        if not mask[k] and ((low and x[k] < cutoff) or (not low and x[k] > cutoff)):
+            mask[k] = True
+            n_masked += 1
+    for k in range(x.size):
+        if n_masked >= count:
+            break
+        if not mask[k] and x[k] == cutoff:
+            mask[k] = True
+            n_masked += 1
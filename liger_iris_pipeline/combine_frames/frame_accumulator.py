@@ -0,0 +1,436 @@
+from numba import njit, prange
+import numpy as np
+
+from .. import datamodels
+from ..utils.parallel import numba_threads
+from .combine_frames_step import _combine_frames
+
+__all__ = ['FrameAccumulator']
+
+
+class FrameAccumulator:
+    """
+    Incrementally combines frames as they arrive, e.g. to build master darks without holding all frames in memory.
+
+    Each frame updates per-pixel running statistics of the good values (DQ of 0 and not NaN) in a single O(pixels) pass:
+    the unweighted mean, the inverse variance weighted mean and variance (Welford/West), the sum of the weights,
+    and the bitwise OR and AND of the DQ flags. Optionally, the `num_reject_low` lowest and `num_reject_high` highest
+    values of each pixel are kept for min/max rejection and held out of the running statistics, and a bounded reservoir
+    sample of `reservoir_size` values per pixel is kept for medians and sigma clipping.
+
+    Accumulators of disjoint sets of frames (e.g. from other processes or nodes) are combined with `merge`.
+    The combined frame is emitted with `finalize`:
+
+        - 'mean' and 'wmean' without sigma clipping are exact, with min/max rejection if configured.
+        - 'median', 'wmedian' and sigma clipping use the reservoir as in `combine_frames`.
+          They are exact while each pixel has at most `reservoir_size` good values and approximate otherwise.
+
+    Example:
+        acc = FrameAccumulator((ny, nx), reservoir_size=32)
+        for model in frames:
+            acc.add(model)
+        result = acc.finalize('median', do_sigma_clip=True)
+    """
+
+    def __init__(
+        self,
+        shape : tuple[int, int],
+        num_reject_low : int = 0,
+        num_reject_high : int = 0,
+        reservoir_size : int = 0,
+        seed : int | None = None,
+        n_threads : int | None = None
+    ):
+        """
+        Args:
+            shape (tuple[int, int]): Shape (ny, nx) of the frames.
+            num_reject_low (int): Number of lowest values of each pixel to reject for 'mean' and 'wmean'.
+            num_reject_high (int): Number of highest values of each pixel to reject for 'mean' and 'wmean'.
+            reservoir_size (int): Number of values of each pixel to keep for medians and sigma clipping. 0 keeps none.
+            seed (int | None): Seed for the reservoir sampling.
+            n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
+        """
+        self.shape = tuple(shape)
+        self.num_reject_low = int(num_reject_low)
+        self.num_reject_high = int(num_reject_high)
+        self.reservoir_size = int(reservoir_size)
+        self.n_threads = n_threads
+        self.n_frames = 0
+        self._rng = np.random.default_rng(seed)
+        ny, nx = self.shape
+
+        # Running statistics of the good values
+        self._n = np.zeros((ny, nx), dtype=np.int64)
+        self._mean = np.zeros((ny, nx), dtype=np.float64)
+        self._sum_w = np.zeros((ny, nx), dtype=np.float64)
+        self._sum_w2 = np.zeros((ny, nx), dtype=np.float64)
+        self._mean_w = np.zeros((ny, nx), dtype=np.float64)
+        self._m2_w = np.zeros((ny, nx), dtype=np.float64)
+        self._dq_or = np.zeros((ny, nx), dtype=np.uint32)
+        self._dq_and = np.full((ny, nx), np.iinfo(np.uint32).max, dtype=np.uint32)
+
+        # Lowest values in ascending and highest values in descending order, with their weights
+        self._low = np.full((self.num_reject_low, ny, nx), np.inf, dtype=np.float64)
+        self._low_w = np.zeros((self.num_reject_low, ny, nx), dtype=np.float64)
+        self._high = np.full((self.num_reject_high, ny, nx), -np.inf, dtype=np.float64)
+        self._high_w = np.zeros((self.num_reject_high, ny, nx), dtype=np.float64)
+
+        # Reservoir sample of the good values and their errors
+        self._reservoir = np.zeros((self.reservoir_size, ny, nx), dtype=np.float32)
+        self._reservoir_err = np.zeros((self.reservoir_size, ny, nx), dtype=np.float32)
+
+
+    def add(self, frame : np.ndarray | str | datamodels.LigerIRISDataModel, err : np.ndarray | None = None, dq : np.ndarray | None = None):
+        """
+        Add a frame.
+
+        Args:
+            frame (np.ndarray | str | datamodels.LigerIRISDataModel): The data with shape (ny, nx), or a model or file
+                whose data, err and dq are used.
+            err (np.ndarray | None): The errors for array input. None weights all values equally.
+            dq (np.ndarray | None): The DQ flags for array input. None treats all values as good.
+        """
+        if not isinstance(frame, np.ndarray):
+            with datamodels.open(frame) as model:
+                return self.add(model.data, model.err, model.dq)
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame has shape {frame.shape}, expected {self.shape}")
+        if err is None:
+            err = np.ones(self.shape, dtype=np.float32)
+        if dq is None:
+            dq = np.zeros(self.shape, dtype=np.uint32)
+        u = self._rng.random(self.shape) if self.reservoir_size > 0 else np.zeros((1, 1))
+        with numba_threads(self.n_threads):
+            _add_frame(
+                frame, err, dq, u,
+                self._n, self._mean, self._sum_w, self._sum_w2, self._mean_w, self._m2_w, self._dq_or, self._dq_and,
+                self._low, self._low_w, self._high, self._high_w,
+                self._reservoir, self._reservoir_err
+            )
+        self.n_frames += 1
+
+
+    def merge(self, other : 'FrameAccumulator'):
+        """
+        Merge the statistics of an accumulator of a disjoint set of frames into this one.
+
+        Args:
+            other (FrameAccumulator): An accumulator with the same shape and configuration.
+        """
+        if (other.shape, other.num_reject_low, other.num_reject_high, other.reservoir_size) != \
+            (self.shape, self.num_reject_low, self.num_reject_high, self.reservoir_size):
+            raise ValueError("Can only merge accumulators with the same shape, num_reject_low, num_reject_high and reservoir_size")
+        u = self._rng.random((3,) + self.shape) if self.reservoir_size > 0 else np.zeros((3, 1, 1))
+        with numba_threads(self.n_threads):
+            _merge(
+                self._n, self._mean, self._sum_w, self._sum_w2, self._mean_w, self._m2_w, self._dq_or, self._dq_and,
+                self._low, self._low_w, self._high, self._high_w,
+                self._reservoir, self._reservoir_err,
+                other._n, other._mean, other._sum_w, other._sum_w2, other._mean_w, other._m2_w, other._dq_or, other._dq_and,
+                other._low, other._low_w, other._high, other._high_w,
+                other._reservoir, other._reservoir_err,
+                u
+            )
+        self.n_frames += other.n_frames
+
+
+    def finalize(
+        self,
+        method : str = 'mean',
+        error_calc : str = 'measure',
+        dq_reduce : str = 'or',
+        do_sigma_clip : bool = False,
+        **kwargs
+    ) -> dict[str, np.ndarray]:
+        """
+        Emit the combined frame from the frames added so far. The accumulator is not modified.
+
+        Args:
+            method (str): 'mean', 'wmean', 'median' or 'wmedian', see `combine_frames`.
+            error_calc (str): 'measure' or 'propagate', see `combine_frames`.
+            dq_reduce (str): 'or' or 'and' to reduce the DQ flags of all frames.
+            do_sigma_clip (bool): Whether to sigma clip the reservoir before combining.
+            kwargs: Sigma clipping arguments passed to `_combine_frames`, e.g. sigma_thresh_low and sigma_thresh_high.
+
+        Returns:
+            dict: Dictionary with the combined data, err and dq.
+        """
+        method = method.lower()
+        if dq_reduce.lower() == 'or':
+            dq_out = self._dq_or.copy()
+        elif dq_reduce.lower() == 'and':
+            dq_out = self._dq_and.copy()
+        else:
+            raise ValueError(f"Unknown DQ reduction method: {dq_reduce}")
+        if error_calc not in ('measure', 'propagate'):
+            raise ValueError(f"Unknown error calculation method: {error_calc}")
+
+        # Exact from the running statistics
+        if method in ('mean', 'wmean') and not do_sigma_clip:
+            with numba_threads(self.n_threads):
+                data_out, err_out = _finalize_moments(
+                    self._n, self._mean, self._sum_w, self._sum_w2, self._mean_w, self._m2_w,
+                    self._low, self._low_w, self._high, self._high_w,
+                    method == 'wmean', error_calc == 'measure'
+                )
+            return dict(data=data_out, err=err_out, dq=dq_out)
+
+        # From the reservoir, the empty slots are flagged
+        if self.reservoir_size == 0:
+            raise ValueError(f"method='{method}' and sigma clipping require reservoir_size > 0")
+        n_kept = np.minimum(self._n, self.reservoir_size)
+        reservoir_dq = (np.arange(self.reservoir_size)[:, None, None] >= n_kept).astype(np.uint8)
+        result = _combine_frames(
+            self._reservoir, self._reservoir_err, reservoir_dq,
+            method=method, error_calc=error_calc, do_sigma_clip=do_sigma_clip,
+            n_threads=self.n_threads, **kwargs
+        )
+
+        # Scale the error of a subsample to all good values
+        n = np.maximum(self._n, 1)
+        if error_calc == 'measure':
+            scale = np.sqrt(np.maximum(n_kept - 1, 0) / np.maximum(n - 1, 1))
+        else:
+            scale = np.sqrt(n_kept / n)
+        result['err'] = np.where(self._n > self.reservoir_size, result['err'] * scale, result['err']).astype(result['err'].dtype)
+        result['dq'] = dq_out
+        return result
+
+
+@njit(nogil=True)
+def _insert_sorted(values, weights, i, j, x, w, filled, ascending):
+    """
+    Insert x into the sorted values[:filled] of pixel (i, j). If all slots are filled,
+    the last value (or x itself) is displaced and returned with its weight.
+
+    Returns:
+        tuple[bool, float, float]: Whether a value was displaced, and the displaced value and weight.
+    """
+    k = values.shape[0]
+    if k == 0:
+        return True, x, w
+    if filled == k:
+        last = values[k - 1, i, j]
+        if (ascending and x >= last) or (not ascending and x <= last):
+            return True, x, w
+        x_out = last
+        w_out = weights[k - 1, i, j]
+        p = k - 1
+    else:
+        x_out = 0.0
+        w_out = 0.0
+        p = filled
+    while p > 0 and ((ascending and values[p - 1, i, j] > x) or (not ascending and values[p - 1, i, j] < x)):
+        values[p, i, j] = values[p - 1, i, j]
+        weights[p, i, j] = weights[p - 1, i, j]
+        p -= 1
+    values[p, i, j] = x
+    weights[p, i, j] = w
+    return filled == k, x_out, w_out
+
+
+@njit(nogil=True)
+def _add_value(
+    n, mean, sum_w, sum_w2, mean_w, m2_w,
+    low, low_w, high, high_w,
+    i, j, x, w
+):
+    """
+    Add a good value of pixel (i, j). The value first enters the lowest values, the value they displace enters
+    the highest values, and only the value displaced from those enters the running moments. So the moments never
+    contain the rejected values, as in `reject_minmax`, and are only ever updated forward.
+    """
+    k_low = low.shape[0]
+    k_high = high.shape[0]
+    c = n[i, j]
+    n[i, j] = c + 1
+    displaced, x, w = _insert_sorted(low, low_w, i, j, x, w, min(c, k_low), True)
+    if not displaced:
+        return
+    displaced, x, w = _insert_sorted(high, high_w, i, j, x, w, min(max(c - k_low, 0), k_high), False)
+    if not displaced:
+        return
+
+    # Welford update of the mean, West update of the weighted mean and variance
+    c_m = c - k_low - k_high + 1
+    mean[i, j] += (x - mean[i, j]) / c_m
+    _sum_w = sum_w[i, j] + w
+    d = x - mean_w[i, j]
+    mean_w[i, j] += d * w / _sum_w
+    m2_w[i, j] += w * d * (x - mean_w[i, j])
+    sum_w[i, j] = _sum_w
+    sum_w2[i, j] += w * w
+
+
+@njit(nogil=True)
+def _num_buffered(n, k_low, k_high):
+    """
+    Number of the n good values of a pixel held in the lowest and highest values rather than the moments.
+    """
+    return min(n, k_low) + min(max(n - k_low, 0), k_high)
+
+
+@njit(nogil=True, parallel=True)
+def _add_frame(
+    data, err, dq, u,
+    n, mean, sum_w, sum_w2, mean_w, m2_w, dq_or, dq_and,
+    low, low_w, high, high_w,
+    reservoir, reservoir_err
+):
+    ny, nx = data.shape
+    reservoir_size = reservoir.shape[0]
+    for i in prange(ny):
+        for j in range(nx):
+            dq_or[i, j] |= dq[i, j]
+            dq_and[i, j] &= dq[i, j]
+            x = data[i, j]
+            if dq[i, j] != 0 or np.isnan(x):
+                continue
+            w = 1 / err[i, j]**2
+
+            # Min/max rejection candidates and running moments
+            _add_value(n, mean, sum_w, sum_w2, mean_w, m2_w, low, low_w, high, high_w, i, j, x, w)
+            c = n[i, j]
+
+            # Reservoir sampling, each of the c values is kept with probability reservoir_size / c
+            if reservoir_size > 0:
+                if c <= reservoir_size:
+                    slot = c - 1
+                else:
+                    slot = int(u[i, j] * c)
+                if slot < reservoir_size:
+                    reservoir[slot, i, j] = x
+                    reservoir_err[slot, i, j] = err[i, j]
+
+
+@njit(nogil=True, parallel=True)
+def _merge(
+    n, mean, sum_w, sum_w2, mean_w, m2_w, dq_or, dq_and,
+    low, low_w, high, high_w,
+    reservoir, reservoir_err,
+    n_b, mean_b, sum_w_b, sum_w2_b, mean_w_b, m2_w_b, dq_or_b, dq_and_b,
+    low_b, low_w_b, high_b, high_w_b,
+    reservoir_b, reservoir_err_b,
+    u
+):
+    ny, nx = n.shape
+    k_low = low.shape[0]
+    k_high = high.shape[0]
+    reservoir_size = reservoir.shape[0]
+    for i in prange(ny):
+        # Thread-local scratch for the merged reservoir of a pixel
+        merged = np.empty(reservoir_size, dtype=reservoir.dtype)
+        merged_err = np.empty(reservoir_size, dtype=reservoir_err.dtype)
+        for j in range(nx):
+            dq_or[i, j] |= dq_or_b[i, j]
+            dq_and[i, j] &= dq_and_b[i, j]
+            na = n[i, j]
+            nb = n_b[i, j]
+            if nb == 0:
+                continue
+
+            # Add the rejection candidates of the other accumulator as new values,
+            # the other moments can't contain any of the merged candidates
+            for k in range(min(nb, k_low)):
+                _add_value(n, mean, sum_w, sum_w2, mean_w, m2_w, low, low_w, high, high_w, i, j, low_b[k, i, j], low_w_b[k, i, j])
+            for k in range(min(max(nb - k_low, 0), k_high)):
+                _add_value(n, mean, sum_w, sum_w2, mean_w, m2_w, low, low_w, high, high_w, i, j, high_b[k, i, j], high_w_b[k, i, j])
+
+            # Chan et al. merge of the moments
+            nb_m = nb - _num_buffered(nb, k_low, k_high)
+            if nb_m > 0:
+                na_m = n[i, j] - _num_buffered(n[i, j], k_low, k_high)
+                n[i, j] += nb_m
+                mean[i, j] += (mean_b[i, j] - mean[i, j]) * nb_m / (na_m + nb_m)
+                _sum_w = sum_w[i, j] + sum_w_b[i, j]
+                d = mean_w_b[i, j] - mean_w[i, j]
+                m2_w[i, j] += m2_w_b[i, j] + d * d * sum_w[i, j] * sum_w_b[i, j] / _sum_w
+                mean_w[i, j] += d * sum_w_b[i, j] / _sum_w
+                sum_w[i, j] = _sum_w
+                sum_w2[i, j] += sum_w2_b[i, j]
+
+            # Reservoirs, subsampled in proportion to the number of values if both do not fit
+            if reservoir_size > 0:
+                ca = min(na, reservoir_size)
+                cb = min(nb, reservoir_size)
+                if na + nb <= reservoir_size:
+                    ka = ca
+                    kb = cb
+                else:
+                    ka = int(reservoir_size * na / (na + nb) + u[0, i, j])
+                    ka = max(reservoir_size - cb, min(ka, ca))
+                    kb = reservoir_size - ka
+                # Random cyclic windows of the (exchangeable) reservoir slots
+                sa = int(u[1, i, j] * ca) if ka < ca else 0
+                sb = int(u[2, i, j] * cb) if kb < cb else 0
+                for k in range(ka):
+                    merged[k] = reservoir[(sa + k) % ca, i, j]
+                    merged_err[k] = reservoir_err[(sa + k) % ca, i, j]
+                for k in range(kb):
+                    merged[ka + k] = reservoir_b[(sb + k) % cb, i, j]
+                    merged_err[ka + k] = reservoir_err_b[(sb + k) % cb, i, j]
+                for k in range(ka + kb):
+                    reservoir[k, i, j] = merged[k]
+                    reservoir_err[k, i, j] = merged_err[k]
+
+
+@njit(nogil=True, parallel=True)
+def _finalize_moments(
+    n, mean, sum_w, sum_w2, mean_w, m2_w,
+    low, low_w, high, high_w,
+    weighted, measure
+):
+    ny, nx = n.shape
+    k_low = low.shape[0]
+    k_high = high.shape[0]
+    data_out = np.empty((ny, nx), dtype=np.float32)
+    err_out = np.empty((ny, nx), dtype=np.float32)
+    for i in prange(ny):
+        for j in range(nx):
+            _n = n[i, j]
+            if _n == 0:
+                data_out[i, j] = np.nan
+                err_out[i, j] = np.nan
+                continue
+
+            if _n <= k_low + k_high:
+                # Too few values to reject any, as in reject_minmax, all of them are in the lowest and highest values
+                n_low = min(_n, k_low)
+                _sum = 0.0
+                _sum_w = 0.0
+                _sum_wx = 0.0
+                _sum_w2 = 0.0
+                for k in range(_n):
+                    x = low[k, i, j] if k < n_low else high[k - n_low, i, j]
+                    w = low_w[k, i, j] if k < n_low else high_w[k - n_low, i, j]
+                    _sum += x
+                    _sum_w += w
+                    _sum_wx += w * x
+                    _sum_w2 += w * w
+                _mean = _sum / _n
+                _mean_w = _sum_wx / _sum_w
+                _m2_w = 0.0
+                for k in range(_n):
+                    x = low[k, i, j] if k < n_low else high[k - n_low, i, j]
+                    w = low_w[k, i, j] if k < n_low else high_w[k - n_low, i, j]
+                    _m2_w += w * (x - _mean_w)**2
+            else:
+                # The moments hold exactly the values that are not rejected
+                _n -= k_low + k_high
+                _mean = mean[i, j]
+                _sum_w = sum_w[i, j]
+                _sum_w2 = sum_w2[i, j]
+                _mean_w = mean_w[i, j]
+                _m2_w = m2_w[i, j]
+
+            data_out[i, j] = _mean_w if weighted else _mean
+
+            # Error as in measure_error and propagate_error
+            if not measure:
+                err_out[i, j] = _sum_w**-0.5
+            elif _n == 1:
+                err_out[i, j] = _sum_w**-0.5
+            else:
+                var = max(_m2_w, 0.0) / _sum_w / (1.0 - _sum_w2 / _sum_w**2)
+                err_out[i, j] = np.sqrt(var) / np.sqrt(_n - 1)
+    return data_out, err_out
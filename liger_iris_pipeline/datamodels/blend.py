@@ -0,0 +1,203 @@
+from functools import lru_cache
+
+import numpy as np
+from astropy.io import fits
+from asdf import schema as asdf_schema
+from stdatamodels import schema as dm_schema
+from stdatamodels import fits_support
+
+from .model_base import LigerIRISDataModel
+from .utils import read_asdf_meta
+
+__all__ = ['blend_models']
+
+
+def _multi(values : list):
+    """
+    The common value of the values if all are identical, otherwise 'MULTIPLE'.
+    """
+    unique = set(values)
+    return unique.pop() if len(unique) == 1 else 'MULTIPLE'
+
+
+# Functions for the blend_rule of each metadata attribute in the schemas
+BLEND_RULES = {
+    'multi': _multi,
+    'mean': np.mean,
+    'sum': np.sum,
+    'max': np.max,
+    'min': np.min,
+    'mintime': min,
+    'maxtime': max,
+}
+
+
+def blend_models(
+    product : LigerIRISDataModel,
+    inputs : list[str | fits.HDUList | LigerIRISDataModel],
+    ignore : list[str] | None = None
+):
+    """
+    Blend the metadata of the input models into the product, in place.
+    This is a faster replacement of `jwst.model_blender.blendmodels` with the same results:
+
+    1. The product metadata starts from the metadata of the first input.
+    2. Attributes with a `blend_rule` in the schema ('multi', 'mean', 'sum', 'min', 'max') are blended over all inputs.
+    3. Attributes with `blend_table: True` are stored as columns of the `hdrtab` table, one row per input.
+
+    Only the blended attributes are read from each input. For files, these are the FITS keywords of the primary header,
+    so no arrays and no ASDF trees are read except for the first input.
+    The blend rules are resolved once per schema.
+
+    Args:
+        product (LigerIRISDataModel): The combined model.
+        inputs (list[str | fits.HDUList | LigerIRISDataModel]): The input models or FITS files.
+        ignore (list[str] | None): Dotted paths of metadata attributes to not set on the product, e.g. 'meta.filename'.
+    """
+    columns, rules, keywords, schema_ignores = _blend_schema(product.schema_url)
+    ignore = ['meta.wcs'] + schema_ignores + (list(ignore) if ignore is not None else [])
+    attrs = list(dict.fromkeys(list(columns) + list(rules)))
+
+    # One row of values per input
+    values = [_read_blend_values(x, attrs, keywords) for x in inputs]
+
+    # Start from the metadata of the first input
+    meta = {
+        attr: value for attr, value in _read_flat_meta(inputs[0]).items()
+        if not any(attr.startswith(i) for i in ignore)
+    }
+
+    # Blend the columns with rules
+    for attr, rule in rules.items():
+        if rule == 'first' or any(attr.startswith(i) for i in ignore):
+            continue
+        j = attrs.index(attr)
+        column = [row[j] for row in values if row[j] is not None]
+        meta[attr] = BLEND_RULES[rule](column) if len(column) > 0 else None
+    for attr, value in meta.items():
+        try:
+            product[attr] = value
+        except KeyError:
+            # Keys in the ASDF tree but not in the schema
+            pass
+
+    # Table of the metadata of each input
+    arrays, names = [], []
+    for attr, name in columns.items():
+        j = attrs.index(attr)
+        column = [row[j] for row in values]
+        if all(v is None for v in column):
+            continue
+        arrays.append(np.array([np.nan if v is None else v for v in column]))
+        names.append(name)
+    table = np.rec.fromarrays(arrays, names=names)
+    schema = _table_schema(table)
+    product.add_schema_entry('hdrtab', schema)
+
+    # Roundtrip through a BinTableHDU so boolean columns are stored correctly
+    product.hdrtab = fits_support.from_fits_hdu(fits.BinTableHDU.from_columns(table), schema)
+
+
+@lru_cache
+def _blend_schema(schema_url : str) -> tuple[dict, dict, dict, list]:
+    """
+    The blend instructions of a model schema.
+
+    Args:
+        schema_url (str): The schema URL of the model class.
+
+    Returns:
+        tuple[dict, dict, dict, list]: The table column name and blend rule of each attribute,
+            the primary header keyword of each attribute if any, and the attributes that can't be blended.
+    """
+    schema = asdf_schema.load_schema(schema_url, resolve_references=True)
+    columns, rules, keywords, ignores = {}, {}, {}, []
+
+    def callback(subschema, path, combiner, ctx, recurse):
+        if len(path) <= 1 or path[0] != 'meta' or 'items' in path or subschema.get('properties'):
+            return
+        for schema_combiner in ('anyOf', 'oneOf'):
+            if schema_combiner in path:
+                path = path[:path.index(schema_combiner)]
+                break
+        attr = '.'.join(path)
+        if subschema.get('type') == 'array':
+            ignores.append(attr)
+            return
+        if 'blend_rule' in subschema:
+            rules[attr] = subschema['blend_rule']
+        if subschema.get('blend_table'):
+            columns[attr] = subschema.get('fits_keyword', attr)
+        if 'fits_keyword' in subschema and subschema.get('fits_hdu', 'PRIMARY') == 'PRIMARY':
+            keywords[attr] = subschema['fits_keyword']
+
+    dm_schema.walk_schema(schema, callback)
+    return columns, rules, keywords, ignores
+
+
+def _read_blend_values(input : str | fits.HDUList | LigerIRISDataModel, attrs : list[str], keywords : dict) -> list:
+    """
+    The values of the attributes of an input, None if not set.
+    Files are read from the primary header, and from the ASDF tree only for attributes without a FITS keyword.
+    """
+    if isinstance(input, LigerIRISDataModel):
+        # Read the tree directly, so unset attributes are None rather than the schema defaults
+        return [_get_path(input.instance, attr) for attr in attrs]
+    header = fits.getheader(input) if isinstance(input, str) else input[0].header
+    row = [header.get(keywords[attr]) if attr in keywords else None for attr in attrs]
+    if any(attr not in keywords for attr in attrs):
+        meta = _read_flat_meta(input)
+        row = [meta.get(attr) if attr not in keywords else value for attr, value in zip(attrs, row)]
+    return row
+
+
+def _read_flat_meta(input : str | fits.HDUList | LigerIRISDataModel) -> dict:
+    """
+    The flattened metadata of an input, read from the ASDF extension for files.
+    """
+    if isinstance(input, LigerIRISDataModel):
+        return {attr: value for attr, value in input.to_flat_dict(include_arrays=False).items() if attr.startswith('meta')}
+    if isinstance(input, str):
+        with fits.open(input, lazy_load_hdus=True) as hdulist:
+            return _flatten(read_asdf_meta(hdulist), 'meta')
+    return _flatten(read_asdf_meta(input), 'meta')
+
+
+def _get_path(tree : dict, attr : str):
+    for key in attr.split('.'):
+        if not isinstance(tree, dict) or key not in tree:
+            return None
+        tree = tree[key]
+    return tree
+
+
+def _flatten(tree : dict, prefix : str) -> dict:
+    flat = {}
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}.{key}"))
+        else:
+            flat[f"{prefix}.{key}"] = value
+    return flat
+
+
+def _table_schema(table : np.recarray) -> dict:
+    """
+    The schema to store the metadata table in the HDRTAB extension.
+    """
+    datatypes = []
+    for name in table.dtype.names:
+        dtype = table.dtype[name]
+        if dtype.kind == 'U':
+            datatype = ['ascii', dtype.itemsize // 4]
+        elif dtype.kind == 'b':
+            # Boolean columns are stored as int8
+            datatype = 'int8'
+        else:
+            datatype = str(dtype)
+        datatypes.append(dict(name=name, datatype=datatype))
+    return {
+        'title': 'Combined header table',
+        'fits_hdu': 'HDRTAB',
+        'datatype': datatypes
+    }
@@ -37,7 +37,7 @@ class LigerIRISDataModel(DataModel):
         if isinstance(init, str):
             self._filepath = os.path.abspath(init)
             self.meta.filename = os.path.basename(self._filepath)
-        elif isinstance(init, fits.hdu.hdulist.HDUList):
+        elif isinstance(init, fits.hdu.hdulist.HDUList) and init.filename() is not None:
             self._filepath = os.path.abspath(init.filename())
             self.meta.filename = os.path.basename(self._filepath)
 
@@ -1,4 +1,13 @@
+import os
+import warnings
+
+import numpy as np
+from astropy.io import fits
+from stdatamodels import fits_support
+from stdatamodels.model_base import _FileReference
+
 from .model_base import LigerIRISDataModel
+from .utils import read_asdf_meta
 
 
 __all__ = ['RampModel']
@@ -6,7 +15,12 @@ __all__ = ['RampModel']
 
 class RampModel(LigerIRISDataModel):
     """
-    A data model for 4D ramps from Liger or IRIS for the IFU or Imager. 4D arrays are formatted as (groups, reads, pixely, pixelx).
+    A data model for 4D ramps from Liger or IRIS for the IFU or Imager.
+    4D arrays are formatted as (pixely, pixelx, groups, reads) by default (pixel-major), or as
+    (groups, reads, pixely, pixelx) if meta.exposure.ramp_layout is 'read_major', which stores whole read planes contiguously.
+
+    Files written with `save_read_difference` store the first read of each group and the read differences,
+    tile compressed, and are decoded when loaded.
 
     Parameters:
     data (np.ndarray): 4-D array of counts for each read.
@@ -15,9 +29,243 @@ class RampModel(LigerIRISDataModel):
     schema_url = "https://oirlab.github.io/schemas/RampModel.schema"
 
     def __init__(self, init=None, **kwargs):
+
+        # Set by _migrate_hdulist for files written with save_read_difference
+        self._encoded_hdulist = None
+
         super().__init__(init=init, **kwargs)
 
+        # HDUList and data encoding for reading row bands from disk, see open_lazy
+        self._row_hdulist = None
+        self._row_encoding = 'raw'
+
+        # Decode files written with save_read_difference, the compressed HDUs are read with astropy
+        if self._encoded_hdulist is not None:
+            hdulist = self._encoded_hdulist
+            self._encoded_hdulist = None
+            fileinfo = hdulist.fileinfo(0)
+            self.meta = read_asdf_meta(hdulist)
+            self.meta.exposure.ramp_encoding = 'raw'
+            self.times = hdulist['TIMES'].data
+            self.data = _decode_read_differences(hdulist['DATA'].data)
+            self.dq = hdulist['DQ'].data
+            if fileinfo is not None and fileinfo.get('filename'):
+                self._filepath = os.path.abspath(fileinfo['filename'])
+
         # Implicitly create arrays
         self.times = self.times
         self.data = self.data
-        self.dq = self.dq
\ No newline at end of file
+        self.dq = self.dq
+
+
+    def _migrate_hdulist(self, hdulist : fits.HDUList) -> fits.HDUList:
+        """
+        Hook of the normal open on the opened HDUList. Files written with `save_read_difference` are detected
+        from the RMPENC keyword (meta.exposure.ramp_encoding) of the primary header that is already read,
+        and are decoded in __init__ instead of loaded through the schema.
+        """
+        if hdulist[0].header.get('RMPENC') == 'read_difference':
+            self._encoded_hdulist = hdulist
+            return fits.HDUList([fits.PrimaryHDU()])
+        return hdulist
+
+
+    @classmethod
+    def open_lazy(cls, filepath : str):
+        """
+        Open a RampModel FITS file without reading the 4-D data and dq arrays into memory.
+        The metadata and times are loaded as usual, while data and dq are 1-pixel placeholders.
+        Use `read_rows` or `read_window` to read bands of rows or windows from disk and `ramp_shape` for the shape on disk.
+
+        Args:
+            filepath (str): Path to the RampModel FITS file.
+
+        Returns:
+            RampModel: The lazily loaded model.
+        """
+        hdulist = fits.open(filepath, memmap=False, lazy_load_hdus=True)
+        if 'ASDF' not in hdulist:
+            hdulist.close()
+            return cls(filepath)
+        meta = read_asdf_meta(hdulist)
+        model = cls(times=hdulist['TIMES'].data, data=np.zeros((1, 1, 1, 1), dtype=np.uint16))
+        model.meta = meta
+        if model.meta.exposure.ramp_encoding == 'read_difference':
+            model._row_encoding = 'read_difference'
+            model.meta.exposure.ramp_encoding = 'raw'
+        model._filepath = os.path.abspath(filepath)
+        model._row_hdulist = hdulist
+        model._file_references.append(_FileReference(hdulist))
+        return model
+
+
+    @property
+    def ramp_layout(self) -> str:
+        """
+        The layout of the 4-D arrays, 'pixel_major' (y, x, groups, reads) or 'read_major' (groups, reads, y, x).
+        """
+        layout = self.meta.exposure.ramp_layout
+        return 'pixel_major' if layout is None else layout
+
+
+    @property
+    def ramp_shape(self) -> tuple[int, int, int, int]:
+        """
+        The shape (ny, nx, n_groups, n_reads) of the 4-D ramp for either layout, also for lazily loaded models.
+        """
+        if self._row_hdulist is not None:
+            shape = self._row_hdulist['DATA'].shape
+        else:
+            shape = self.data.shape
+        if self.ramp_layout == 'read_major':
+            return shape[2:] + shape[:2]
+        return shape
+
+
+    def to_read_major(self):
+        """
+        Convert the 4-D arrays in place to the read-major layout (groups, reads, y, x).
+        """
+        if self.ramp_layout != 'read_major':
+            self.data = np.ascontiguousarray(np.moveaxis(self.data, (0, 1), (2, 3)))
+            self.dq = np.ascontiguousarray(np.moveaxis(self.dq, (0, 1), (2, 3)))
+            self.meta.exposure.ramp_layout = 'read_major'
+
+
+    def to_pixel_major(self):
+        """
+        Convert the 4-D arrays in place to the pixel-major layout (y, x, groups, reads).
+        """
+        if self.ramp_layout != 'pixel_major':
+            self.data = np.ascontiguousarray(np.moveaxis(self.data, (2, 3), (0, 1)))
+            self.dq = np.ascontiguousarray(np.moveaxis(self.dq, (2, 3), (0, 1)))
+            self.meta.exposure.ramp_layout = 'pixel_major'
+
+
+    def read_rows(self, name : str, start : int, stop : int) -> np.ndarray:
+        """
+        Read the rows [start, stop) of a 4-D array. Only the requested rows are read from disk for lazily loaded models.
+
+        Args:
+            name (str): The array to read, 'data' or 'dq'.
+            start (int): The first row.
+            stop (int): The last row (exclusive).
+
+        Returns:
+            np.ndarray: The band of rows in the layout of the model.
+        """
+        return self.read_window(name, start, stop)
+
+
+    def read_window(self, name : str, ystart : int, ystop : int, xstart : int | None = None, xstop : int | None = None) -> np.ndarray:
+        """
+        Read the window [ystart, ystop) x [xstart, xstop) of a 4-D array (0-based).
+        Only the requested pixels are read from disk for lazily loaded models.
+
+        Args:
+            name (str): The array to read, 'data' or 'dq'.
+            ystart (int): The first row.
+            ystop (int): The last row (exclusive).
+            xstart (int | None): The first column. None starts at the first column.
+            xstop (int | None): The last column (exclusive). None stops at the last column.
+
+        Returns:
+            np.ndarray: The window in the layout of the model.
+        """
+        window = (slice(ystart, ystop), slice(xstart, xstop))
+        index = (slice(None), slice(None)) + window if self.ramp_layout == 'read_major' else window
+        if self._row_hdulist is not None:
+            band = self._row_hdulist[name.upper()].section[index]
+            if name == 'data' and self._row_encoding == 'read_difference':
+                return _decode_read_differences(band)
+            return band.astype(np.uint16, copy=False)
+        return getattr(self, name)[index]
+
+
+    def iter_read_planes(self, name : str = 'data'):
+        """
+        Iterate over the read planes of a 4-D array in readout order.
+        For lazily loaded read-major models, only one plane is read from disk (and decoded) at a time.
+
+        Args:
+            name (str): The array to read, 'data' or 'dq'.
+
+        Yields:
+            tuple[int, int, np.ndarray]: The group index, read index and read plane with shape (ny, nx).
+        """
+        _, _, n_groups, n_reads = self.ramp_shape
+        read_major = self.ramp_layout == 'read_major'
+        decode = name == 'data' and self._row_encoding == 'read_difference'
+        for k in range(n_groups):
+            plane = None
+            for r in range(n_reads):
+                if self._row_hdulist is not None:
+                    hdu = self._row_hdulist[name.upper()]
+                    read = hdu.section[k, r] if read_major else hdu.section[:, :, k, r]
+                else:
+                    array = getattr(self, name)
+                    read = array[k, r] if read_major else array[:, :, k, r]
+                read = read.astype(np.uint16, copy=False)
+                if decode and plane is not None:
+                    plane = plane + (read - np.uint16(2**15)) # mod 2**16
+                else:
+                    plane = read
+                yield k, r, plane
+
+
+    def save_read_difference(self, filepath : str, compression_type : str = 'RICE_1', **kwargs) -> str:
+        """
+        Save the ramp losslessly as the first read and the read differences of each group, tile compressed.
+        The differences are computed mod 2**16 and offset by 2**15, so they are stored on disk as signed int16
+        and small negative differences compress well.
+        The file is written in the read-major layout with one compression tile per row of each read plane,
+        so bands of rows and single read planes can be decoded on their own (see `open_lazy` and `iter_read_planes`).
+        The file is decoded when loaded as usual.
+
+        Args:
+            filepath (str): The filepath to save to.
+            compression_type (str): FITS tile compression algorithm, e.g. 'RICE_1' or 'GZIP_2'.
+            kwargs: Additional arguments to pass to the fits.writeto() function.
+
+        Returns:
+            str: The filepath.
+        """
+        model = self.copy()
+        model.to_read_major()
+        model.data = _encode_read_differences(model.data)
+        model.meta.exposure.ramp_encoding = 'read_difference'
+        model._filepath = os.path.abspath(filepath)
+        model.on_save()
+        hdulist = fits_support.to_fits(model._instance, model._schema)
+        for name in ('DATA', 'DQ'):
+            index = hdulist.index_of(name)
+            hdulist[index] = fits.CompImageHDU(
+                hdulist[index].data, header=hdulist[index].header, name=name,
+                compression_type=compression_type, tile_shape=(1, 1, 1, model.data.shape[-1])
+            )
+        if 'overwrite' not in kwargs:
+            kwargs['overwrite'] = True
+        os.makedirs(os.path.dirname(model._filepath), exist_ok=True)
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='Card is too long')
+            hdulist.writeto(model._filepath, **kwargs)
+        return model._filepath
+
+
+def _encode_read_differences(data : np.ndarray) -> np.ndarray:
+    """
+    First read and read differences (mod 2**16, offset by 2**15) along the read axis of read-major uint16 ramps.
+    """
+    encoded = data.copy()
+    encoded[:, 1:] -= data[:, :-1]
+    encoded[:, 1:] += np.uint16(2**15)
+    return encoded
+
+
+def _decode_read_differences(encoded : np.ndarray) -> np.ndarray:
+    """
+    Inverse of `_encode_read_differences`, the cumulative sum wraps mod 2**16.
+    """
+    decoded = encoded.astype(np.uint16, copy=True)
+    decoded[:, 1:] -= np.uint16(2**15)
+    return np.cumsum(decoded, axis=1, dtype=np.uint16, out=decoded)
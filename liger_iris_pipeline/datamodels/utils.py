@@ -1,3 +1,5 @@
+import io
+import copy
 from pathlib import Path
 import sys
 import os
@@ -173,3 +175,16 @@ def class_from_model_type(init):
     # Return the class
     return model_class
 
+
+def read_asdf_meta(hdulist : fits.HDUList) -> dict:
+    """
+    Read the meta tree from the ASDF extension of a FITS file without loading any arrays.
+
+    Args:
+        hdulist (fits.HDUList): The opened FITS file.
+
+    Returns:
+        dict: A copy of the meta tree.
+    """
+    with asdf.open(io.BytesIO(hdulist['ASDF'].data)) as af:
+        return copy.deepcopy(af.tree['meta'])
@@ -2,6 +2,8 @@ import numpy as np
 import logging
 import scipy.stats
 
+from ..utils import math
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
@@ -45,8 +47,10 @@ def apply_norm(input, method):
         the input science data
 
     method: string
-        name of numpy method to use for normalization, e.g.
-        median (default) or mean
+        name of the statistic to use for normalization, e.g.
+        median (default) or mean, or any of `utils.math.FRAME_STATS`
+        such as biweight_location, computed with `utils.math.frame_stats`
+        ignoring NaNs and pixels flagged in the DQ array.
         mode uses `scipy.stats.mode`
 
     Returns
@@ -63,10 +67,11 @@ def apply_norm(input, method):
 
     if method is None:
         norm_factor = 1
-    elif method == "mean":
-        norm_factor = np.mean(input.data)
-    elif method == "median":
-        norm_factor = np.median(input.data)
+    elif method in math.FRAME_STATS:
+        # A single statistic over the whole array, whatever its dimensionality
+        norm_factor = math.frame_stats(
+            input.data.reshape(1, -1), input.dq.reshape(1, -1), stats=(method,)
+        )[method][0]
     elif method == "mode":
         norm_factor = scipy.stats.mode(input.data, axis=None).mode
 
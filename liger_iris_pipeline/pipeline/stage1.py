@@ -1,3 +1,6 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from .base_pipeline import LigerIRISPipeline
 
 # step imports
@@ -9,12 +12,17 @@ __all__ = ['Stage1Pipeline']
 class Stage1Pipeline(LigerIRISPipeline):
     """
     Stage 1 pipeline to process a series of raw reads to slope maps.
-    
+
     Steps:
         NonlinCorrectionStep
         FitRampStep
     """
 
+    spec = """
+        fuse_nonlin = boolean(default=False) # Linearize each read inside the ramp fit kernel instead of running nonlin_corr separately. The corrected 4D ramp is never stored.
+        n_workers = integer(default=1) # Number of I/O threads. Values > 1 read the next exposures from disk and save finished results while the current exposure is processed. Up to n_workers exposures are held in memory ahead of the current one.
+    """
+
     # Define aliases to steps
     step_defs = {
         "nonlin_corr": NonlinearCorrectionStep,
@@ -23,9 +31,85 @@ class Stage1Pipeline(LigerIRISPipeline):
 
     # start the actual processing
     def process(self, input):
+        if self.n_workers > 1:
+            return self.process_concurrent(input)
         results = []
         for sci in input:
-            result = self.nonlin_corr.run(sci)
-            result = self.ramp_fit.run(result)
-            results.append(result)
-        return results
\ No newline at end of file
+            results.append(self.process_exposure(sci))
+        return results
+
+
+    def process_exposure(self, sci):
+        """
+        Process a single exposure.
+        """
+        if self.fuse_nonlin:
+            return self.run_fused(sci)
+        result = self.nonlin_corr.run(sci)
+        return self.ramp_fit.run(result)
+
+
+    def process_concurrent(self, input):
+        """
+        Process the exposures in order in this thread, while `n_workers` threads read the next exposures from disk
+        and a separate thread saves the finished results. At most `n_workers` results wait to be saved,
+        so a slow save does not hold up the next read. The compute itself is parallelized by the steps.
+        """
+        inputs = list(input)
+        results = []
+        saves = deque()
+        with ThreadPoolExecutor(max_workers=self.n_workers) as load_pool, ThreadPoolExecutor(max_workers=1) as save_pool:
+            loads = deque(load_pool.submit(self.prefetch_exposure, sci) for sci in inputs[:self.n_workers])
+            n_submitted = len(loads)
+            while len(loads) > 0:
+                sci = loads.popleft().result()
+                if n_submitted < len(inputs):
+                    loads.append(load_pool.submit(self.prefetch_exposure, inputs[n_submitted]))
+                    n_submitted += 1
+                result = self.process_exposure(sci)
+                results.append(result)
+
+                # Write the result while the next exposure is processed.
+                # The result is finalized here before saving, and skipped by `run` (see _saved_results).
+                if self.save_results:
+                    while len(saves) >= self.n_workers:
+                        saves.popleft().result()
+                    self.finalize_result(result, self._reference_files_used)
+                    saves.append(save_pool.submit(self.save_model, result, output_dir=self.output_dir))
+                    self._saved_results.append(result)
+            for save in saves:
+                save.result()
+        return results
+
+
+    def prefetch_exposure(self, sci):
+        """
+        Read an exposure from disk ahead of processing. Filenames are kept as is
+        if the ramp fit reads rows from disk as needed (tile_rows or max_memory).
+        """
+        if isinstance(sci, str) and (self.ramp_fit.tile_rows is not None or self.ramp_fit.max_memory is not None):
+            return sci
+        return self.open_model(sci)
+
+
+    def run_fused(self, sci):
+        """
+        Run the nonlinearity correction and ramp fit in a single pass over the reads.
+        The nonlinearity reference is resolved as in `nonlin_corr` and passed to `ramp_fit`.
+        If `nonlin_corr` is skipped, the reads are fit without correction.
+        """
+        if self.nonlin_corr.skip:
+            self.log.info("Skipping the nonlinearity correction of the fused ramp fit")
+            return self.ramp_fit.run(sci)
+        nonlin = self.nonlin_corr.nonlin
+        if nonlin is None:
+            sci = self.open_model(sci)
+            nonlin = self.nonlin_corr.get_reference_file(sci, "nonlin")
+        self.log.info(f"Running fused nonlinearity correction and ramp fit with nonlin reference {nonlin}")
+        nonlin_prev = self.ramp_fit.nonlin
+        self.ramp_fit.nonlin = nonlin
+        try:
+            result = self.ramp_fit.run(sci)
+        finally:
+            self.ramp_fit.nonlin = nonlin_prev
+        return result
@@ -1,4 +1,5 @@
 from .fit_ramp_step import FitRampStep
 from .nonlincorr_step import NonlinearCorrectionStep
-from .fit_ramp_numba import fit_ramps_ols, fit_ramps_mcds
-from .nonlinear_correction_numba import correct_nonlinearity
\ No newline at end of file
+from .fit_ramp_numba import fit_ramps_ols, fit_ramps_mcds, fit_ramps_ols_dq, fit_ramps_optimal
+from .nonlinear_correction_numba import correct_nonlinearity
+from .ramp_accumulator import RampAccumulator, fit_ramps_read_major, fit_read_planes
\ No newline at end of file
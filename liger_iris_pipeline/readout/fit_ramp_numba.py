@@ -1,7 +1,30 @@
-from numba import njit
+from functools import lru_cache
+
+from numba import njit, prange
 import numpy as np
+import scipy.stats
+
+from .nonlinear_correction_numba import polyval_scalar
+from ..datamodels import dqflags
+from ..utils.parallel import numba_threads
+
+# TODO: Look into more sophisticated jump detection methods
+
+# Per-read flags that exclude a read from the fit
+_DQ_EXCLUDE_READ = dqflags.group['DO_NOT_USE'] | dqflags.group['SATURATED'] | dqflags.group['DROPOUT']
+_DQ_DO_NOT_USE = dqflags.pixel['DO_NOT_USE']
+_DQ_SATURATED = dqflags.pixel['SATURATED']
+_DQ_JUMP_DET = dqflags.pixel['JUMP_DET']
+
+# Minimum number of rate differences between good reads for jump detection.
+# Below this, the threshold calibrated to the false-positive rate of jump_sigma (see `jump_thresholds`) leaves
+# almost no power, e.g. < 35% for a 50 sigma jump with 6 differences.
+_JUMP_MIN_DIFFS = 6
 
-# TODO: Implement jump detection, look into more sophisticated methods
+# Signal-to-noise bins of the optimal weight lookup table, see `optimal_weights`
+_OPTIMAL_LOG_SNR_MIN = -2.0
+_OPTIMAL_LOG_SNR_MAX = 5.0
+_OPTIMAL_N_BINS = 57
 
 @njit(nogil=True)
 def _fit_ramp_ols(times, ramp):
@@ -34,16 +57,98 @@ def _fit_ramp_ols(times, ramp):
 
 
 @njit(nogil=True)
-def _fit_ramps_ols(times, ramps):
+def _read_value(ramp, r, coeffs=None):
+    """
+    Returns read r of a ramp in float64, linearized with the nonlinearity polynomial coeffs if given.
+    """
+    if coeffs is None:
+        return np.float64(ramp[r])
+    return polyval_scalar(coeffs, ramp[r])
+
+
+@njit(nogil=True)
+def _ols_design(times):
+    """
+    Precomputes the OLS design terms shared by every pixel, one set per group.
+    The slope of a ramp y in group k is then sum(weights[k] * y).
+
+    Args:
+        times (np.ndarray): Read times with shape (n_groups, n_reads).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The slope weights (t - mean(t)) / Sxx with shape (n_groups, n_reads), and Sxx = sum((t - mean(t))**2) with shape (n_groups,).
+    """
+    n_groups, n_reads = times.shape
+    weights = np.empty((n_groups, n_reads), dtype=np.float64)
+    sxx = np.empty(n_groups, dtype=np.float64)
+    for k in range(n_groups):
+        t_mean = 0.0
+        for r in range(n_reads):
+            t_mean += times[k, r]
+        t_mean /= n_reads
+        _sxx = 0.0
+        for r in range(n_reads):
+            _sxx += (times[k, r] - t_mean)**2
+        for r in range(n_reads):
+            weights[k, r] = (times[k, r] - t_mean) / _sxx
+        sxx[k] = _sxx
+    return weights, sxx
+
+
+@njit(nogil=True)
+def _fit_ramp_ols_design(weights, sxx, ramp, coeffs=None):
+    """
+    Closed-form OLS fit of a single ramp from precomputed design terms (see `_ols_design`).
+    Equivalent to `_fit_ramp_ols`, but only needs one pass of running sums along the read axis.
+
+    Args:
+        weights (np.ndarray): Slope weights for this group.
+        sxx (float): Sum of squared, centered read times for this group.
+        ramp (np.ndarray): The ramp data.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients for this pixel, applied to each read before fitting.
+
+    Returns:
+        tuple[float, float] : slope and slope error
+    """
+    n = len(ramp)
+
+    # Reference to the first read to avoid cancellation in the residual sum of squares
+    y0 = _read_value(ramp, 0, coeffs)
+    sum_wy = 0.0
+    sum_y = 0.0
+    sum_y2 = 0.0
+    for r in range(n):
+        y = _read_value(ramp, r, coeffs) - y0
+        sum_wy += weights[r] * y
+        sum_y += y
+        sum_y2 += y * y
+    slope = sum_wy
+
+    # Residual sum of squares
+    rss = sum_y2 - sum_y * sum_y / n - slope * slope * sxx
+    if rss < 0:
+        rss = 0.0
+
+    slope_err = np.sqrt(rss / (n - 2) / sxx)
+    return slope, slope_err
+
+
+@njit(nogil=True, parallel=True)
+def _fit_ramps_ols(times, ramps, coeffs=None):
     ny, nx, n_groups, _ = ramps.shape
     slope = np.zeros((ny, nx), dtype=np.float32)
     slope_error = np.zeros((ny, nx), dtype=np.float32)
-    slope_groups = np.zeros(n_groups, dtype=np.float32)
-    slope_error_groups = np.zeros(n_groups, dtype=np.float32)
-    for i in range(ny):
+    weights, sxx = _ols_design(times)
+    for i in prange(ny):
+        # Thread-local scratch for the group fits of this row
+        slope_groups = np.zeros(n_groups, dtype=np.float32)
+        slope_error_groups = np.zeros(n_groups, dtype=np.float32)
         for j in range(nx):
             for k in range(n_groups):
-                slope_groups[k], slope_error_groups[k] = _fit_ramp_ols(times[k, :], ramps[i, j, k, :])
+                if coeffs is None:
+                    slope_groups[k], slope_error_groups[k] = _fit_ramp_ols_design(weights[k], sxx[k], ramps[i, j, k, :])
+                else:
+                    slope_groups[k], slope_error_groups[k] = _fit_ramp_ols_design(weights[k], sxx[k], ramps[i, j, k, :], coeffs[i, j, :])
             slope[i, j], slope_error[i, j] = _combine_group_slopes(slope_groups, slope_error_groups)
     return slope, slope_error
 
@@ -55,67 +160,546 @@ def _combine_group_slopes(slopes, slope_errors):
     else:
         w = 1 / slope_errors**2
         slope_combined = np.sum(slopes * w) / np.sum(w)
-        slope_error_combined = np.sqrt(1 / np.sum(slope_errors**2))
+        slope_error_combined = np.sqrt(1 / np.sum(w))
         return slope_combined, slope_error_combined
 
+def fit_ramps_ols(times, ramps, coeffs=None, n_threads : int | None = None):
+    """
+    Top-level function for fitting ramps. Rows are fit in parallel.
+
+    Args:
+        times (np.ndarray): Read times.
+        ramps (np.ndarray): 4D array of ramp data with shape (ny, nx, n_groups, n_reads).
+            Integer (e.g. the native uint16) ramps are used directly with float64 accumulators.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients with shape (ny, nx, n_coeffs).
+            If given, each read is linearized inside the kernel and the corrected ramp is never stored.
+        n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The slope and slope error images.
+    """
+    with numba_threads(n_threads):
+        return _fit_ramps_ols(times, ramps, coeffs)
+
+
+def jump_thresholds(jump_sigma : float, n_reads : int) -> np.ndarray:
+    """
+    Thresholds of the jump statistic for each number of degrees of freedom, see `_fit_ramp_ols_dq`.
+
+    The statistic of a rate difference is its deviation from the mean of the other differences in units of their
+    leave-one-out standard deviation, which follows a Student t distribution with n_diffs - 2 degrees of freedom
+    for Gaussian noise. The thresholds are the t quantiles with the same two-sided false-positive rate
+    as jump_sigma for a normal distribution, so few reads do not inflate the false-positive rate.
+
+    Args:
+        jump_sigma (float): The jump detection threshold in units of the standard deviation.
+        n_reads (int): The number of reads per group.
+
+    Returns:
+        np.ndarray: The threshold for 0 to n_reads degrees of freedom, inf for 0.
+    """
+    dof = np.arange(n_reads + 1)
+    thresholds = np.full(n_reads + 1, np.inf)
+    thresholds[1:] = scipy.stats.t.isf(scipy.stats.norm.sf(jump_sigma), dof[1:])
+    return thresholds
+
+
 @njit(nogil=True)
-def fit_ramps_ols(times, ramps):
+def _fit_ramp_ols_dq(times, ramp, dq, saturation, thresholds, read_noise, gain, coeffs, t_good, y_good, breaks, scratch):
     """
-    Top-level function for fitting ramps.
+    OLS fit of a single ramp that excludes flagged and saturated reads and fits the clean segments between jumps.
+
+    Reads flagged DO_NOT_USE, SATURATED or DROPOUT, and reads at or above the saturation level (and all following reads), are excluded.
+    A segment break is placed before reads flagged JUMP_DET, and before reads whose rate relative to the previous
+    good read deviates from the mean of the other rates by more than the threshold for n_diffs - 2 degrees of freedom
+    times the leave-one-out standard deviation of the other rates (see `jump_thresholds`).
+    The segments are fit jointly with a common slope and one intercept per segment.
+    If only a single segment of 2 reads is left, the slope is their CDS slope, and the error is from the noise model
+    if read_noise is given, else NaN.
+
+    Args:
+        times (np.ndarray): The read times.
+        ramp (np.ndarray): The ramp data.
+        dq (np.ndarray): The per-read data quality flags.
+        saturation (float | None): Saturation level of the raw reads. None only uses the DQ flags.
+        thresholds (np.ndarray | None): Jump thresholds for each number of degrees of freedom, see `jump_thresholds`.
+            None disables jump detection. Needs at least _JUMP_MIN_DIFFS + 1 good reads.
+        read_noise (float | None): Read noise per read for the error of 2-read fits. None gives a NaN error.
+        gain (float): Gain in e-/DN for the error of 2-read fits.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients for this pixel.
+        t_good, y_good, breaks, scratch (np.ndarray): Scratch arrays with length >= len(ramp).
+
+    Returns:
+        tuple[float, float, int] : slope, slope error and the pixel DQ flags set by this ramp.
+    """
+    n = len(ramp)
+    flags = 0
+
+    # Collect the good reads
+    n_good = 0
+    saturated = False
+    for r in range(n):
+        if saturation is not None and not saturated and ramp[r] >= saturation:
+            saturated = True
+        if saturated:
+            flags |= _DQ_SATURATED
+            continue
+        if dq[r] & _DQ_EXCLUDE_READ:
+            if dq[r] & _DQ_SATURATED:
+                flags |= _DQ_SATURATED
+            continue
+        t_good[n_good] = times[r]
+        y_good[n_good] = _read_value(ramp, r, coeffs)
+        breaks[n_good] = n_good > 0 and (dq[r] & _DQ_JUMP_DET) != 0
+        n_good += 1
+
+    # Jump detection from outliers in the rates between consecutive good reads
+    n_diffs = n_good - 1
+    if thresholds is not None and n_diffs >= _JUMP_MIN_DIFFS:
+        rate_mean = 0.0
+        for m in range(n_diffs):
+            scratch[m] = (y_good[m + 1] - y_good[m]) / (t_good[m + 1] - t_good[m])
+            rate_mean += scratch[m]
+        rate_mean /= n_diffs
+        ss = 0.0
+        for m in range(n_diffs):
+            ss += (scratch[m] - rate_mean)**2
+        # Deviation from the mean of the other rates in units of their standard deviation with n_diffs - 2 dof,
+        # so that a jump does not inflate its own scale
+        threshold = thresholds[n_diffs - 2]
+        for m in range(n_diffs):
+            dev = (scratch[m] - rate_mean) * n_diffs / (n_diffs - 1)
+            ss_other = ss - dev * dev * (n_diffs - 1) / n_diffs
+            var_other = ss_other / (n_diffs - 2) * n_diffs / (n_diffs - 1)
+            if var_other > 0 and dev * dev > threshold * threshold * var_other:
+                breaks[m + 1] = True
+    for m in range(1, n_good):
+        if breaks[m]:
+            flags |= _DQ_JUMP_DET
+
+    # Joint fit of the segments with a common slope
+    sxx_tot = 0.0
+    sxy_tot = 0.0
+    syy_tot = 0.0
+    n_tot = 0
+    n_segments = 0
+    start = 0
+    for m in range(1, n_good + 1):
+        if m < n_good and not breaks[m]:
+            continue
+        n_seg = m - start
+        if n_seg >= 2:
+            t_mean = 0.0
+            y_mean = 0.0
+            for q in range(start, m):
+                t_mean += t_good[q]
+                y_mean += y_good[q] - y_good[start]
+            t_mean /= n_seg
+            y_mean /= n_seg
+            for q in range(start, m):
+                dt = t_good[q] - t_mean
+                dy = y_good[q] - y_good[start] - y_mean
+                sxx_tot += dt * dt
+                sxy_tot += dt * dy
+                syy_tot += dy * dy
+            n_tot += n_seg
+            n_segments += 1
+        start = m
+
+    if n_segments == 0 or sxx_tot == 0:
+        return np.nan, np.nan, flags
+    slope = sxy_tot / sxx_tot
+    dof = n_tot - n_segments - 1
+    if dof <= 0:
+        # A single 2-read segment (CDS), there are no residuals to estimate the error from
+        if read_noise is None:
+            return slope, np.nan, flags
+        dt = np.sqrt(2 * sxx_tot)
+        var = 2 * read_noise**2 + max(slope, 0.0) * dt / gain
+        return slope, np.sqrt(var) / dt, flags
+    rss = syy_tot - slope * sxy_tot
+    if rss < 0:
+        rss = 0.0
+    slope_err = np.sqrt(rss / dof / sxx_tot)
+    return slope, slope_err, flags
+
+
+@njit(nogil=True, parallel=True)
+def _fit_ramps_ols_dq(times, ramps, dq, saturation=None, thresholds=None, read_noise=None, gain=1.0, coeffs=None):
+    ny, nx, n_groups, n_reads = ramps.shape
+    slope = np.zeros((ny, nx), dtype=np.float32)
+    slope_error = np.zeros((ny, nx), dtype=np.float32)
+    dq_out = np.zeros((ny, nx), dtype=np.uint32)
+    for i in prange(ny):
+        # Thread-local scratch for this row
+        slope_groups = np.zeros(n_groups, dtype=np.float32)
+        slope_error_groups = np.zeros(n_groups, dtype=np.float32)
+        slope_cds_groups = np.zeros(n_groups, dtype=np.float32)
+        t_good = np.zeros(n_reads, dtype=np.float64)
+        y_good = np.zeros(n_reads, dtype=np.float64)
+        breaks = np.zeros(n_reads, dtype=np.bool_)
+        scratch = np.zeros(n_reads, dtype=np.float64)
+        for j in range(nx):
+            flags = 0
+            n_valid = 0
+            n_cds = 0
+            for k in range(n_groups):
+                if coeffs is None:
+                    _slope, _slope_err, _flags = _fit_ramp_ols_dq(
+                        times[k, :], ramps[i, j, k, :], dq[i, j, k, :],
+                        saturation, thresholds, read_noise, gain, None,
+                        t_good, y_good, breaks, scratch
+                    )
+                else:
+                    _slope, _slope_err, _flags = _fit_ramp_ols_dq(
+                        times[k, :], ramps[i, j, k, :], dq[i, j, k, :],
+                        saturation, thresholds, read_noise, gain, coeffs[i, j, :],
+                        t_good, y_good, breaks, scratch
+                    )
+                flags |= _flags
+                if np.isfinite(_slope) and np.isfinite(_slope_err):
+                    slope_groups[n_valid] = _slope
+                    slope_error_groups[n_valid] = _slope_err
+                    n_valid += 1
+                elif np.isfinite(_slope):
+                    # 2-read fit without an error
+                    slope_cds_groups[n_cds] = _slope
+                    n_cds += 1
+            if n_valid > 0:
+                slope[i, j], slope_error[i, j] = _combine_group_slopes(slope_groups[:n_valid], slope_error_groups[:n_valid])
+            elif n_cds > 0:
+                slope[i, j] = np.mean(slope_cds_groups[:n_cds])
+                slope_error[i, j] = np.nan
+            else:
+                slope[i, j] = np.nan
+                slope_error[i, j] = np.nan
+                flags |= _DQ_DO_NOT_USE
+            dq_out[i, j] = flags
+    return slope, slope_error, dq_out
+
+
+def fit_ramps_ols_dq(
+        times, ramps, dq, saturation : float | None = None, jump_sigma : float | None = None,
+        read_noise : float | None = None, gain : float = 1.0, coeffs=None, n_threads : int | None = None
+    ):
+    """
+    Fits ramps with OLS using the per-read DQ flags. Saturation, jumps and flagged reads are handled in the same pass as the fit.
+    Flagged and saturated reads are excluded, jumps split each ramp into segments which are fit with a common slope.
+    Groups without a valid fit are ignored. Groups with only 2 good reads left give their CDS slope, which is used
+    if no group of the pixel has a fitted error. Rows are fit in parallel.
+
+    Args:
+        times (np.ndarray): Read times.
+        ramps (np.ndarray): 4D array of ramp data with shape (ny, nx, n_groups, n_reads).
+        dq (np.ndarray): 4D array of per-read DQ flags with the same shape as ramps.
+        saturation (float | None): Saturation level of the raw reads. None only uses the per-read DQ flags.
+        jump_sigma (float | None): Threshold in units of the standard deviation of the read-to-read rates
+            for jump detection. The threshold is converted to the Student t quantile with the same false-positive rate
+            for the number of rates of each ramp (see `jump_thresholds`). Ramps with fewer than _JUMP_MIN_DIFFS + 1 good
+            reads are not searched for jumps. None disables jump detection.
+        read_noise (float | None): Read noise per read in DN for the error of 2-read fits. None gives a NaN error.
+        gain (float): Gain in e-/DN for the error of 2-read fits.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients with shape (ny, nx, n_coeffs).
+        n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The slope, slope error and pixel DQ images.
+            The DQ image has SATURATED and JUMP_DET set where found, and DO_NOT_USE where no group could be fit.
+    """
+    with numba_threads(n_threads):
+        return _fit_ramps_ols_dq(
+            times, ramps, dq,
+            None if saturation is None else float(saturation),
+            None if jump_sigma is None else jump_thresholds(jump_sigma, ramps.shape[-1]),
+            None if read_noise is None else float(read_noise), float(gain),
+            coeffs
+        )
+
+
+@lru_cache(maxsize=32)
+def _optimal_weights_group(times : tuple[float, ...]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Optimal (GLS) slope weights of one group for each signal-to-noise bin, for unit read noise.
+    Cached per readout pattern, so the table is only built once per set of read times.
+    """
+    t = np.asarray(times, dtype=np.float64)
+    n_reads = len(t)
+    span = t[-1] - t[0]
+    design = np.stack([np.ones(n_reads), t - t[0]], axis=1)
+    cov_signal = np.minimum.outer(t - t[0], t - t[0]) / span
+    snrs = np.concatenate([[0.0], np.logspace(_OPTIMAL_LOG_SNR_MIN, _OPTIMAL_LOG_SNR_MAX, _OPTIMAL_N_BINS - 1)])
+    weights = np.empty((_OPTIMAL_N_BINS, n_reads), dtype=np.float64)
+    variances = np.empty(_OPTIMAL_N_BINS, dtype=np.float64)
+    for b, snr in enumerate(snrs):
+        # Read noise on the diagonal, accumulated shot noise between reads
+        cov_inv = np.linalg.inv(np.eye(n_reads) + snr * cov_signal)
+        fisher_inv = np.linalg.inv(design.T @ cov_inv @ design)
+        weights[b] = (fisher_inv @ design.T @ cov_inv)[1]
+        variances[b] = fisher_inv[1, 1]
+    return weights, variances
+
+
+def optimal_weights(times : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lookup table of optimal (GLS) slope weights for each group and signal-to-noise bin.
+
+    The covariance of the reads in a group is read_noise**2 * I + (signal / gain) * min(t_i, t_j).
+    Dividing by read_noise**2, the weights only depend on the dimensionless signal-to-noise
+    snr = signal * (t_last - t_first) / (gain * read_noise**2), which is binned logarithmically
+    between 10**_OPTIMAL_LOG_SNR_MIN and 10**_OPTIMAL_LOG_SNR_MAX, with the first bin for snr = 0 (OLS weights).
+
+    Args:
+        times (np.ndarray): Read times with shape (n_groups, n_reads).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The slope weights with shape (n_groups, n_bins, n_reads),
+            and the slope variances for unit read noise with shape (n_groups, n_bins).
+    """
+    tables = [_optimal_weights_group(tuple(float(t) for t in times_group)) for times_group in times]
+    weights = np.stack([w for w, _ in tables])
+    variances = np.stack([v for _, v in tables])
+    return weights, variances
+
+
+@njit(nogil=True)
+def _optimal_bin(snr):
+    if not snr > 0: # also catches NaN
+        return 0
+    b = 1 + int(np.round((np.log10(snr) - _OPTIMAL_LOG_SNR_MIN) / (_OPTIMAL_LOG_SNR_MAX - _OPTIMAL_LOG_SNR_MIN) * (_OPTIMAL_N_BINS - 2)))
+    return min(max(b, 1), _OPTIMAL_N_BINS - 1)
+
+
+@njit(nogil=True)
+def _fit_ramp_optimal(ols_weights, weights, variances, snr_scale, read_noise, ramp, y, coeffs=None):
+    """
+    Optimal-weighted fit of a single ramp from the lookup table (see `optimal_weights`).
+    The signal is first estimated with OLS to select the signal-to-noise bin.
+
+    Args:
+        ols_weights (np.ndarray): OLS slope weights for this group.
+        weights (np.ndarray): Optimal slope weights for this group with shape (n_bins, n_reads).
+        variances (np.ndarray): Slope variances for unit read noise for this group.
+        snr_scale (float): Converts a slope to the signal-to-noise snr, (t_last - t_first) / (gain * read_noise**2).
+        read_noise (float): The read noise.
+        ramp (np.ndarray): The ramp data.
+        y (np.ndarray): Scratch array for the reads.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients for this pixel.
+
+    Returns:
+        tuple[float, float] : slope and slope error
+    """
+    n = len(ramp)
+    y0 = _read_value(ramp, 0, coeffs)
+    slope_ols = 0.0
+    for r in range(n):
+        y[r] = _read_value(ramp, r, coeffs) - y0
+        slope_ols += ols_weights[r] * y[r]
+    b = _optimal_bin(slope_ols * snr_scale)
+    slope = 0.0
+    for r in range(n):
+        slope += weights[b, r] * y[r]
+    return slope, read_noise * np.sqrt(variances[b])
+
+
+@njit(nogil=True, parallel=True)
+def _fit_ramps_optimal(times, ramps, weights, variances, read_noise, gain, coeffs=None):
+    ny, nx, n_groups, n_reads = ramps.shape
+    slope = np.zeros((ny, nx), dtype=np.float32)
+    slope_error = np.zeros((ny, nx), dtype=np.float32)
+    ols_weights, _ = _ols_design(times)
+    snr_scale = np.empty(n_groups, dtype=np.float64)
+    for k in range(n_groups):
+        snr_scale[k] = (times[k, n_reads - 1] - times[k, 0]) / (gain * read_noise**2)
+    for i in prange(ny):
+        # Thread-local scratch for this row
+        slope_groups = np.zeros(n_groups, dtype=np.float32)
+        slope_error_groups = np.zeros(n_groups, dtype=np.float32)
+        y = np.zeros(n_reads, dtype=np.float64)
+        for j in range(nx):
+            for k in range(n_groups):
+                if coeffs is None:
+                    slope_groups[k], slope_error_groups[k] = _fit_ramp_optimal(
+                        ols_weights[k], weights[k], variances[k], snr_scale[k], read_noise, ramps[i, j, k, :], y
+                    )
+                else:
+                    slope_groups[k], slope_error_groups[k] = _fit_ramp_optimal(
+                        ols_weights[k], weights[k], variances[k], snr_scale[k], read_noise, ramps[i, j, k, :], y, coeffs[i, j, :]
+                    )
+            slope[i, j], slope_error[i, j] = _combine_group_slopes(slope_groups, slope_error_groups)
+    return slope, slope_error
+
+
+def fit_ramps_optimal(times, ramps, read_noise : float, gain : float = 1.0, coeffs=None, n_threads : int | None = None):
+    """
+    Fits ramps with optimal (GLS) weighting of the reads from a precomputed lookup table. Rows are fit in parallel.
+
+    The weights for each group and signal-to-noise bin are built once per readout pattern and cached (see `optimal_weights`).
+    Each pixel then costs an OLS estimate to select the bin and one dot product with the tabulated weights.
+    The slope error is the GLS error of the selected bin, i.e. from the noise model rather than the residuals.
 
     Args:
         times (np.ndarray): Read times.
         ramps (np.ndarray): 4D array of ramp data with shape (ny, nx, n_groups, n_reads).
+        read_noise (float): Read noise per read in DN.
+        gain (float): Gain in e-/DN.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients with shape (ny, nx, n_coeffs).
+        n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
 
     Returns:
-        dict[str, np.ndarray]: Dictionary with keys 'slope' and 'slope_err'.
+        tuple[np.ndarray, np.ndarray]: The slope and slope error images.
     """
-    return _fit_ramps_ols(times, ramps)
+    weights, variances = optimal_weights(times)
+    with numba_threads(n_threads):
+        return _fit_ramps_optimal(times, ramps, weights, variances, float(read_noise), float(gain), coeffs)
 
 
 @njit(nogil=True)
-def _fit_ramp_mcds(times, ramp, num_coadd=1):
+def _fit_ramp_mcds(times, ramp, num_coadd=1, coeffs=None):
     n = len(times)
-    n1 = np.sum(ramp[:num_coadd])
-    n2 = np.sum(ramp[-num_coadd:])
-    d1 = np.sum(times[:num_coadd])
-    d2 = np.sum(times[-num_coadd:])
+
+    # Accumulate in float64 so integer (e.g. uint16) ramps are neither promoted nor wrapped
+    n1 = 0.0
+    n2 = 0.0
+    d1 = 0.0
+    d2 = 0.0
+    for r in range(num_coadd):
+        n1 += _read_value(ramp, r, coeffs)
+        n2 += _read_value(ramp, n - num_coadd + r, coeffs)
+        d1 += times[r]
+        d2 += times[n - num_coadd + r]
     if num_coadd > 1:
         n1 = n1 / num_coadd
         n2 = n2 / num_coadd
         d1 = d1 / num_coadd
         d2 = d2 / num_coadd
     slope = (n2 - n1) / (d2 - d1)
-    residuals = ramp - slope * times
-    slope_err = np.sqrt(np.sum(residuals**2) / (n - 1) / np.sum(times**2))
+    rss = 0.0
+    times2_tot = 0.0
+    for r in range(n):
+        residual = _read_value(ramp, r, coeffs) - slope * times[r]
+        rss += residual * residual
+        times2_tot += times[r] * times[r]
+    slope_err = np.sqrt(rss / (n - 1) / times2_tot)
     return slope, slope_err
 
 
 @njit(nogil=True)
-def _fit_ramps_mcds(times, ramps, num_coadd=1):
+def _mcds_design(times, num_coadd):
+    """
+    Precomputes the (M)CDS / Fowler-N terms shared by every pixel, one set per group.
+
+    Args:
+        times (np.ndarray): Read times with shape (n_groups, n_reads).
+        num_coadd (int): Number of Fowler pairs.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The time between the mean of the first and last num_coadd reads with shape (n_groups,),
+            and the shot noise coefficient c with shape (n_groups,) such that the shot noise variance
+            of the difference of the means is (signal / gain) * c.
+    """
+    n_groups, n_reads = times.shape
+    dt = np.empty(n_groups, dtype=np.float64)
+    shot = np.empty(n_groups, dtype=np.float64)
+    for k in range(n_groups):
+        d1 = 0.0
+        d2 = 0.0
+        for r in range(num_coadd):
+            d1 += times[k, r]
+            d2 += times[k, n_reads - num_coadd + r]
+        dt[k] = (d2 - d1) / num_coadd
+
+        # Var(mean(last) - mean(first)) with Cov(y_i, y_j) = (signal / gain) * min(t_i, t_j)
+        c = 0.0
+        for p in range(num_coadd):
+            for q in range(num_coadd):
+                t1p = times[k, p]
+                t1q = times[k, q]
+                t2p = times[k, n_reads - num_coadd + p]
+                t2q = times[k, n_reads - num_coadd + q]
+                c += min(t1p, t1q) + min(t2p, t2q) - 2 * min(t1p, t2q)
+        shot[k] = c / num_coadd**2
+    return dt, shot
+
+
+@njit(nogil=True)
+def _fit_ramp_mcds_read_noise(dt, shot, read_noise, gain, ramp, num_coadd=1, coeffs=None):
+    """
+    (M)CDS / Fowler-N fit of a single ramp with the error from the noise model.
+    Only the first and last num_coadd reads are touched.
+
+    Args:
+        dt (float): Time between the mean of the first and last num_coadd reads.
+        shot (float): Shot noise coefficient, see `_mcds_design`.
+        read_noise (float): Read noise per read.
+        gain (float): Gain in e-/DN.
+        ramp (np.ndarray): The ramp data.
+        num_coadd (int): Number of Fowler pairs.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients for this pixel.
+
+    Returns:
+        tuple[float, float] : slope and slope error
+    """
+    n = len(ramp)
+    diff = 0.0
+    for r in range(num_coadd):
+        diff += _read_value(ramp, n - num_coadd + r, coeffs) - _read_value(ramp, r, coeffs)
+    slope = diff / num_coadd / dt
+    var = 2 * read_noise**2 / num_coadd + max(slope, 0.0) * shot / gain
+    return slope, np.sqrt(var) / dt
+
+
+@njit(nogil=True, parallel=True)
+def _fit_ramps_mcds(times, ramps, num_coadd=1, coeffs=None, read_noise=None, gain=1.0):
     ny, nx, n_groups, _ = ramps.shape
     slope = np.zeros((ny, nx), dtype=np.float32)
     slope_error = np.zeros((ny, nx), dtype=np.float32)
-    slope_groups = np.zeros(shape=n_groups, dtype=np.float32)
-    slope_error_groups = np.zeros(shape=n_groups, dtype=np.float32)
-    for i in range(ny):
+    dt, shot = _mcds_design(times, num_coadd)
+    for i in prange(ny):
+        # Thread-local scratch for the group fits of this row
+        slope_groups = np.zeros(shape=n_groups, dtype=np.float32)
+        slope_error_groups = np.zeros(shape=n_groups, dtype=np.float32)
         for j in range(nx):
             for k in range(n_groups):
-                slope_groups[k], slope_error_groups[k] = _fit_ramp_mcds(times[k, :], ramps[i, j, k, :], num_coadd=num_coadd)
+                if read_noise is not None:
+                    if coeffs is None:
+                        slope_groups[k], slope_error_groups[k] = _fit_ramp_mcds_read_noise(dt[k], shot[k], read_noise, gain, ramps[i, j, k, :], num_coadd)
+                    else:
+                        slope_groups[k], slope_error_groups[k] = _fit_ramp_mcds_read_noise(dt[k], shot[k], read_noise, gain, ramps[i, j, k, :], num_coadd, coeffs[i, j, :])
+                elif coeffs is None:
+                    slope_groups[k], slope_error_groups[k] = _fit_ramp_mcds(times[k, :], ramps[i, j, k, :], num_coadd)
+                else:
+                    slope_groups[k], slope_error_groups[k] = _fit_ramp_mcds(times[k, :], ramps[i, j, k, :], num_coadd, coeffs[i, j, :])
             slope[i, j], slope_error[i, j] = _combine_group_slopes(slope_groups, slope_error_groups)
     return slope, slope_error
 
 
-def fit_ramps_mcds(times, ramps, num_coadd=1):
+def fit_ramps_mcds(times, ramps, num_coadd=1, coeffs=None, read_noise : float | None = None, gain : float = 1.0, n_threads : int | None = None):
     """
-    Fits ramps using the (M)CDS method.
+    Fits ramps using the (M)CDS / Fowler-N method. Rows are fit in parallel.
+
+    By default, the slope error is computed from the residuals over the full ramp.
+    If read_noise is given, the error is computed from the noise model instead, 2 * read_noise**2 / num_coadd
+    plus the shot noise of the signal, and only the first and last num_coadd reads of each ramp are touched.
 
     Args:
         times (np.ndarray): Read times.
-        ramps (np.ndarray): 3D array of ramp data with shape (ny, nx, n_reads, n_groups).
-        num_coadd (int): Number of coadds. num_coadd=1 for CDS.
+        ramps (np.ndarray): 4D array of ramp data with shape (ny, nx, n_groups, n_reads).
+            Integer (e.g. the native uint16) ramps are used directly with float64 accumulators.
+        num_coadd (int): Number of coadds (Fowler pairs). num_coadd=1 for CDS.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients with shape (ny, nx, n_coeffs).
+            If given, each read is linearized inside the kernel and the corrected ramp is never stored.
+        read_noise (float | None): Read noise per read in DN for the noise model error. None uses the residuals.
+        gain (float): Gain in e-/DN for the noise model error.
+        n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
 
     Returns:
-        dict[str, np.ndarray]: Dictionary with keys 'slope' and 'slope_err' containing the fitted slopes and errors.
+        tuple[np.ndarray, np.ndarray]: The slope and slope error images.
     """
-    return _fit_ramps_mcds(times, ramps, num_coadd=num_coadd)
\ No newline at end of file
+    n_reads = ramps.shape[-1]
+    if read_noise is not None and 2 * num_coadd > n_reads:
+        raise ValueError(f"num_coadd={num_coadd} Fowler pairs need at least {2 * num_coadd} reads, got {n_reads}")
+    with numba_threads(n_threads):
+        return _fit_ramps_mcds(
+            times, ramps, num_coadd, coeffs,
+            None if read_noise is None else float(read_noise), float(gain)
+        )
\ No newline at end of file
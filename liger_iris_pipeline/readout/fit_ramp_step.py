@@ -1,10 +1,14 @@
 from ..base_step import LigerIRISStep
-from ..datamodels import RampModel, ImagerModel, IFUImageModel
-from .fit_ramp_numba import fit_ramps_ols, fit_ramps_mcds
+from ..datamodels import RampModel, ImagerModel, IFUImageModel, dqflags
+from .fit_ramp_numba import fit_ramps_ols, fit_ramps_mcds, fit_ramps_ols_dq, fit_ramps_optimal
+from .ramp_accumulator import fit_ramps_read_major, fit_read_planes
+from ..utils.endian_utils import normalize_dtype_array
+from ..utils.subarray import parse_windows, window_slices, extract_windows
 
 import warnings
 import copy
 import numpy as np
+from stdatamodels import filetype
 
 __all__ = ["FitRampStep"]
 
@@ -12,8 +16,21 @@ __all__ = ["FitRampStep"]
 class FitRampStep(LigerIRISStep):
 
     spec = """
-        method = string(default='ols')  # Ramp fit method. Options are 'utr' and 'mcds'. For 'cds', use 'mcds' and set num_coadd to 1.
+        method = string(default='ols')  # Ramp fit method. Options are 'ols', 'optimal' and 'mcds'. For 'cds', use 'mcds' and set num_coadd to 1.
         num_coadd = integer(default=3) # The number of coadds for the 'mcds' method.
+        mcds_error = string(default='residual') # Slope error for the 'mcds' and 'cds' methods. 'residual' uses the residuals of the full ramp, 'read_noise' the noise model, which only touches the first and last num_coadd reads.
+        read_noise = float(default=None) # Read noise per read in DN for the 'optimal' method, mcds_error='read_noise' and the error of 2-read fits with read_dq.
+        gain = float(default=1.0) # Gain in e-/DN for the 'optimal' method, mcds_error='read_noise' and the error of 2-read fits with read_dq.
+        n_threads = integer(default=None) # Number of threads for the ramp fitting kernels. None uses all available cores, 1 runs serially.
+        tile_rows = integer(default=None) # Number of detector rows to read and fit at a time. None fits all rows at once unless max_memory is set.
+        max_memory = float(default=None) # Approximate memory budget in GB for each tile of rows. Ignored if tile_rows is set.
+        nonlin = is_string_or_datamodel(default=None) # Nonlinearity reference file applied to each read inside the fit kernel (fused Stage 1). None fits the reads as given.
+        read_dq = boolean(default=False) # Use the per-read DQ flags in the fit: exclude flagged and saturated reads and fit around jumps. Only for the 'ols' method.
+        saturation = float(default=None) # Saturation level of the raw reads in counts, used with read_dq. None only uses the per-read DQ flags.
+        jump_sigma = float(default=5.0) # Jump detection threshold in units of the standard deviation of the read-to-read rates, used with read_dq. Converted to the Student t threshold with the same false-positive rate. Needs at least 7 good reads. None disables jump detection.
+        roi = boolean(default=False) # Only read, linearize and fit the windows in meta.subarray_map (or windows). Pixels outside the windows are NaN and flagged DO_NOT_USE.
+        windows = list(default=None) # Windows to fit as (xstart, ystart, xsize, ysize) with 1-based xstart/ystart as in meta.subarray_map. Setting windows enables roi.
+        roi_output = string(default='full') # Output of the ROI mode. 'full' returns a full-frame model, 'windows' a list with one compact model per window.
     """
 
     class_alias = "ramp_fit"
@@ -22,27 +39,80 @@ class FitRampStep(LigerIRISStep):
         """
         Step for ramp fitting
         """
-        # Load the input data model
-        with self.open_model(input) as input_model:
+        # Load the input data model, FITS files are opened lazily so only the rows, windows or read planes being fit are read (and decoded) from disk
+        roi = self.roi or self.windows is not None
+        if isinstance(input, str) and filetype.check(input) == 'fits':
+            input_model = RampModel.open_lazy(input)
+        else:
+            input_model = self.open_model(input)
+
+        with input_model:
 
             # Vector of read times for all pixels
-            input_times = input_model.times
-
-            # Correct the nonlinearity
-            if self.method.lower() == 'ols':
-                result = fit_ramps_ols(input_times.astype(np.float32), input_model.data.astype(np.float32))
-            elif self.method.lower() == 'mcds':
-                result = fit_ramps_mcds(input_times.astype(np.float32), input_model.data.astype(np.float32), num_coadd=self.num_coadd)
-            elif self.method.lower() == 'cds':
-                if self.num_coadd != 1:
-                    warnings.warn(f"Using 'cds' method but num_coadd={self.num_coadd}. Ignoring.")
-                result = fit_ramps_mcds(input_times.astype(np.float32), input_model.data.astype(np.float32), num_coadd=1)
+            input_times = normalize_dtype_array(input_model.times)
+
+            # Nonlinearity coefficients to apply within the fit
+            if self.nonlin is not None:
+                nonlin_model = self.open_model(self.nonlin, memmap=True)
+                self.log.info(f"Applying nonlinearity correction within the ramp fit using {nonlin_model.meta.filename}")
+                coeffs = nonlin_model.coeffs
+            else:
+                nonlin_model = None
+                coeffs = None
+
+            # Preallocate the outputs and fit one band of rows at a time
+            layout = input_model.ramp_layout
+            ny, nx = input_model.ramp_shape[:2]
+            tile_rows = self.get_tile_rows(input_model.ramp_shape)
+            slope = np.empty((ny, nx), dtype=np.float32)
+            slope_err = np.empty((ny, nx), dtype=np.float32)
+            dq = np.empty((ny, nx), dtype=np.uint32)
+            if roi:
+                # Only fit the windows, one at a time
+                windows = self.get_windows(input_model)
+                slope[:] = np.nan
+                slope_err[:] = np.nan
+                dq[:] = dqflags.pixel['DO_NOT_USE']
+                for window in windows:
+                    ys, xs = window_slices(window)
+                    ramps = normalize_dtype_array(input_model.read_window('data', ys.start, ys.stop, xs.start, xs.stop))
+                    ramps_dq = normalize_dtype_array(input_model.read_window('dq', ys.start, ys.stop, xs.start, xs.stop))
+                    slope[ys, xs], slope_err[ys, xs], dq[ys, xs] = self.fit_ramps(
+                        input_times, ramps, ramps_dq,
+                        coeffs=normalize_dtype_array(coeffs[ys, xs]) if coeffs is not None else None,
+                        layout=layout
+                    )
+            elif layout == 'read_major' and tile_rows == ny and self.streams_planes():
+                # Stream (and decode) one read plane at a time into the fit
+                slope[:], slope_err[:] = fit_read_planes(
+                    input_times, input_model.iter_read_planes('data'), (ny, nx),
+                    method=self.method.lower(), num_coadd=self.num_coadd if self.method.lower() == 'mcds' else 1,
+                    coeffs=normalize_dtype_array(coeffs) if coeffs is not None else None, n_threads=self.n_threads
+                )
+                dq[:] = True
+                for _, _, plane in input_model.iter_read_planes('dq'):
+                    dq &= plane != 0
+            else:
+                for y0 in range(0, ny, tile_rows):
+                    y1 = min(y0 + tile_rows, ny)
+                    # The kernels consume the native uint16 reads, no promoted copy is made
+                    ramps = normalize_dtype_array(input_model.read_rows('data', y0, y1))
+                    ramps_dq = normalize_dtype_array(input_model.read_rows('dq', y0, y1))
+                    slope[y0:y1], slope_err[y0:y1], dq[y0:y1] = self.fit_ramps(
+                        input_times, ramps, ramps_dq,
+                        coeffs=normalize_dtype_array(coeffs[y0:y1]) if coeffs is not None else None,
+                        layout=layout
+                    )
+
+            # Close the nonlinearity file
+            if nonlin_model is not None:
+                nonlin_model.close()
 
         # TODO: Generalize the conversion from RampModel -> ImagerModel/IFUImageModel
         if input_model.meta.instrument.mode.lower() == 'img':
-            model_result = ImagerModel(data=result[0], err=result[1], dq=np.all(input_model.dq, axis=(2, 3)))
+            model_result = ImagerModel(data=slope, err=slope_err, dq=dq)
         elif input_model.meta.instrument.mode.lower() in ('slicer', 'lenslet'):
-            model_result = IFUImageModel(data=result[0], err=result[1], dq=np.all(input_model.dq, axis=(2, 3)))
+            model_result = IFUImageModel(data=slope, err=slope_err, dq=dq)
         _meta = copy.deepcopy(input_model.meta.instance)
         _meta.update(input_model.meta.instance) # TODO: Check if this is the right way to merge the meta data
         model_result.meta = _meta
@@ -50,4 +120,128 @@ class FitRampStep(LigerIRISStep):
         model_result.meta.data_level = 1
         self.status = "COMPLETE"
 
-        return model_result
\ No newline at end of file
+        if roi and self.roi_output.lower() == 'windows':
+            return extract_windows(model_result, windows)
+        elif roi and self.roi_output.lower() != 'full':
+            raise ValueError(f"Unknown roi_output: {self.roi_output}")
+
+        return model_result
+
+
+    def fit_ramps(self, times : np.ndarray, ramps : np.ndarray, dq : np.ndarray, coeffs : np.ndarray | None = None, layout : str = 'pixel_major') -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Fit a band of ramps with the configured method.
+
+        Args:
+            times (np.ndarray): Read times with shape (n_groups, n_reads).
+            ramps (np.ndarray): 4D array of ramp data with shape (ny, nx, n_groups, n_reads),
+                or (n_groups, n_reads, ny, nx) for the 'read_major' layout.
+            dq (np.ndarray): 4D array of per-read DQ flags with the same shape as ramps.
+            coeffs (np.ndarray | None): Nonlinearity coefficients with shape (ny, nx, n_coeffs) to apply to each read.
+            layout (str): The layout of ramps and dq, 'pixel_major' or 'read_major'.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The slope, slope error and DQ images.
+        """
+        method = self.method.lower()
+        if layout == 'read_major':
+            # Stream whole read planes where possible, otherwise fit a transposed view
+            if self.streams_planes():
+                if method == 'cds' and self.num_coadd != 1:
+                    warnings.warn(f"Using 'cds' method but num_coadd={self.num_coadd}. Ignoring.")
+                slope, slope_err = fit_ramps_read_major(
+                    times, ramps, method=method,
+                    num_coadd=self.num_coadd if method == 'mcds' else 1,
+                    coeffs=coeffs, n_threads=self.n_threads
+                )
+                return slope, slope_err, np.all(dq, axis=(0, 1))
+            ramps = np.moveaxis(ramps, (0, 1), (2, 3))
+            dq = np.moveaxis(dq, (0, 1), (2, 3))
+        if self.read_dq:
+            if method != 'ols':
+                raise ValueError(f"read_dq is only supported for the 'ols' method, got {self.method}")
+            return fit_ramps_ols_dq(
+                times, ramps, dq,
+                saturation=self.saturation, jump_sigma=self.jump_sigma,
+                read_noise=self.read_noise, gain=self.gain,
+                coeffs=coeffs, n_threads=self.n_threads
+            )
+        if method == 'ols':
+            slope, slope_err = fit_ramps_ols(times, ramps, coeffs=coeffs, n_threads=self.n_threads)
+        elif method == 'optimal':
+            if self.read_noise is None:
+                raise ValueError("The 'optimal' method requires read_noise")
+            slope, slope_err = fit_ramps_optimal(times, ramps, read_noise=self.read_noise, gain=self.gain, coeffs=coeffs, n_threads=self.n_threads)
+        elif method in ('mcds', 'cds'):
+            if method == 'cds' and self.num_coadd != 1:
+                warnings.warn(f"Using 'cds' method but num_coadd={self.num_coadd}. Ignoring.")
+            slope, slope_err = fit_ramps_mcds(
+                times, ramps, num_coadd=self.num_coadd if method == 'mcds' else 1, coeffs=coeffs,
+                read_noise=self.get_mcds_read_noise(), gain=self.gain, n_threads=self.n_threads
+            )
+        else:
+            raise ValueError(f"Unknown ramp fit method: {self.method}")
+        return slope, slope_err, np.all(dq, axis=(2, 3))
+
+
+    def streams_planes(self) -> bool:
+        """
+        Whether the configured fit can stream read planes of read-major ramps.
+        """
+        return not self.read_dq and self.method.lower() in ('ols', 'mcds', 'cds') and self.get_mcds_read_noise() is None
+
+
+    def get_mcds_read_noise(self) -> float | None:
+        """
+        Read noise for the (M)CDS noise model error, or None to use the residuals.
+        """
+        mcds_error = self.mcds_error.lower()
+        if mcds_error == 'residual':
+            return None
+        elif mcds_error == 'read_noise':
+            if self.read_noise is None:
+                raise ValueError("mcds_error='read_noise' requires read_noise")
+            return self.read_noise
+        else:
+            raise ValueError(f"Unknown mcds_error: {self.mcds_error}")
+
+
+    def get_windows(self, input_model : RampModel) -> list[dict]:
+        """
+        The windows to fit in ROI mode from `windows` or else the input meta.subarray_map.
+
+        Args:
+            input_model (RampModel): The input ramp model.
+
+        Returns:
+            list[dict]: The subarray parameters of each window, see `parse_windows`.
+        """
+        if self.windows is not None:
+            windows = self.windows
+        else:
+            windows = input_model.meta.subarray_map
+        windows = parse_windows(windows if windows is not None else [], input_model.ramp_shape[:2])
+        if len(windows) == 0:
+            raise ValueError("The ROI mode requires windows or a meta.subarray_map with at least one subarray")
+        self.log.info(f"Fitting {len(windows)} windows")
+        return windows
+
+
+    def get_tile_rows(self, shape : tuple[int, int, int, int]) -> int:
+        """
+        Number of rows to fit at a time from `tile_rows` or `max_memory`.
+
+        Args:
+            shape (tuple[int, int, int, int]): Shape of the 4D ramp (ny, nx, n_groups, n_reads).
+
+        Returns:
+            int: Number of rows per tile.
+        """
+        ny, nx, n_groups, n_reads = shape
+        if self.tile_rows is not None:
+            return int(np.clip(self.tile_rows, 1, ny))
+        if self.max_memory is not None:
+            # uint16 data and dq as read
+            bytes_per_row = nx * n_groups * n_reads * (2 + 2)
+            return int(np.clip(self.max_memory * 1E9 // bytes_per_row, 1, ny))
+        return ny
\ No newline at end of file
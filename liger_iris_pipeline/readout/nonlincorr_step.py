@@ -14,6 +14,8 @@ class NonlinearCorrectionStep(LigerIRISStep):
 
     spec = """
         nonlin = is_string_or_datamodel(default=None) # Reference file for nonlinearity correction
+        in_place = boolean(default=False) # Correct the input ramp in place instead of a copy.
+        n_threads = integer(default=None) # Number of threads. None uses all available cores, 1 runs serially.
     """
 
     def process(self, input):
@@ -21,32 +23,50 @@ class NonlinearCorrectionStep(LigerIRISStep):
         Step for Nonlinearity correction
         """
         # Load the input data model
-        with self.open_model(input) as input_model:
+        input_model = self.open_model(input)
 
-            # Result
-            model_result = input_model.copy()
-
-            # Get the name of the nonlin reference file to use
-            if self.nonlin is None:
-                self.nonlin_filename = self.get_reference_file(input_model, "nonlin")
-                nonlin_model = self.open_model(self.nonlin_filename)
-            else:
-                nonlin_model = self.open_model(self.nonlin)
-                self.nonlin_filename = nonlin_model._filepath
-            
-            self.log.info(f"Using nonlin reference file {self.nonlin_filename}")
+        # The corrected input is returned, so it is left open
+        if self.in_place:
+            self.correct(input_model, input_model)
+            return input_model
 
-            # Alias coeffs and utr times
-            coeffs = nonlin_model.coeffs
+        with input_model:
+            model_result = input_model.copy()
+            self.correct(input_model, model_result)
 
-            # Correct the nonlinearity
-            data = model_result.data.astype(np.float32)
-            coeffs = coeffs.astype(np.float32)
-            model_result.data = correct_nonlinearity(data, coeffs)
+        return model_result
 
-            # Close the nonlinearity file
-            nonlin_model.close()
 
-            self.status = "COMPLETE"
+    def correct(self, input_model, model_result):
+        """
+        Correct the nonlinearity of the reads of input_model into model_result.
+        The data keeps the uint16 dtype of the RampModel schema, so the corrected reads are truncated to integers
+        and clipped to [0, 65535].
 
-        return model_result
\ No newline at end of file
+        Args:
+            input_model (RampModel): The input ramp model, used to look up the reference file.
+            model_result (RampModel): The model to correct in place, input_model itself or a copy.
+        """
+        # Get the name of the nonlin reference file to use, the coeffs are memory mapped
+        if self.nonlin is None:
+            self.nonlin_filename = self.get_reference_file(input_model, "nonlin")
+            nonlin_model = self.open_model(self.nonlin_filename, memmap=True)
+        else:
+            nonlin_model = self.open_model(self.nonlin, memmap=True)
+            self.nonlin_filename = nonlin_model.meta.filename
+        
+        self.log.info(f"Using nonlin reference file {self.nonlin_filename}")
+
+        # Alias coeffs and utr times
+        coeffs = nonlin_model.coeffs
+
+        # Correct the nonlinearity in place, the data keeps the dtype of the schema
+        correct_nonlinearity(
+            model_result.data, coeffs,
+            layout=model_result.ramp_layout, n_threads=self.n_threads
+        )
+
+        # Close the nonlinearity file
+        nonlin_model.close()
+
+        self.status = "COMPLETE"
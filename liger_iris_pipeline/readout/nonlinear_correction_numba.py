@@ -1,22 +1,109 @@
 from numba import njit, prange
 import numpy as np
 
-__all__ = ['correct_nonlinearity']
+from ..utils.endian_utils import normalize_dtype_array
+from ..utils.parallel import numba_threads
 
+__all__ = ['correct_nonlinearity', 'linearize_plane', 'polyval_scalar']
 
-@njit
-def correct_nonlinearity(ramps, coeffs):
-    ny, nx, n_groups, _ = ramps.shape
-    for i in range(ny):
+
+# Rows of coefficients converted to native byte order at a time, so memory-mapped reference files are never copied whole
+_COEFFS_TILE_ROWS = 256
+
+
+def correct_nonlinearity(
+        ramps : np.ndarray, coeffs : np.ndarray, out : np.ndarray | None = None,
+        layout : str = 'pixel_major', n_threads : int | None = None
+    ) -> np.ndarray:
+    """
+    Corrects the nonlinearity of each read with the per-pixel polynomial. Rows are corrected in parallel with no per-pixel allocation.
+
+    Args:
+        ramps (np.ndarray): 4D array of ramps with shape (ny, nx, n_groups, n_reads),
+            or (n_groups, n_reads, ny, nx) for the 'read_major' layout.
+        coeffs (np.ndarray): Polynomial coefficients in increasing order with shape (ny, nx, n_coeffs).
+            May be memory-mapped, only bands of rows are read at a time.
+        out (np.ndarray | None): Output array with the same shape as ramps. None corrects ramps in place.
+            Values are cast to the dtype of out. For integer dtypes, e.g. the uint16 ramps, they are clipped to the range
+            of the dtype and truncated.
+        layout (str): The layout of ramps, 'pixel_major' or 'read_major'.
+        n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
+
+    Returns:
+        np.ndarray: The corrected ramps (out).
+    """
+    if out is None:
+        out = ramps
+    if np.issubdtype(out.dtype, np.integer):
+        lo, hi = float(np.iinfo(out.dtype).min), float(np.iinfo(out.dtype).max)
+    else:
+        lo, hi = -np.inf, np.inf
+    ny = coeffs.shape[0]
+    with numba_threads(n_threads):
+        for y0 in range(0, ny, _COEFFS_TILE_ROWS):
+            y1 = min(y0 + _COEFFS_TILE_ROWS, ny)
+            _coeffs = normalize_dtype_array(coeffs[y0:y1])
+            if layout == 'read_major':
+                _correct_nonlinearity_read_major(ramps[:, :, y0:y1], _coeffs, out[:, :, y0:y1], lo, hi)
+            else:
+                _correct_nonlinearity(ramps[y0:y1], _coeffs, out[y0:y1], lo, hi)
+    return out
+
+
+@njit(nogil=True, parallel=True)
+def _correct_nonlinearity(ramps, coeffs, out, lo, hi):
+    ny, nx, n_groups, n_reads = ramps.shape
+    for i in prange(ny):
         for j in range(nx):
             for k in range(n_groups):
-                ramps[i, j, k, :] = polyval(coeffs[i, j, :], ramps[i, j, k, :])
-    return ramps
+                for r in range(n_reads):
+                    out[i, j, k, r] = min(max(polyval_scalar(coeffs[i, j, :], ramps[i, j, k, r]), lo), hi)
+
+
+@njit(nogil=True, parallel=True)
+def _correct_nonlinearity_read_major(ramps, coeffs, out, lo, hi):
+    # One contiguous read plane at a time
+    n_groups, n_reads, ny, nx = ramps.shape
+    for k in range(n_groups):
+        for r in range(n_reads):
+            for i in prange(ny):
+                for j in range(nx):
+                    out[k, r, i, j] = min(max(polyval_scalar(coeffs[i, j, :], ramps[k, r, i, j]), lo), hi)
+
+
+@njit(nogil=True, parallel=True)
+def linearize_plane(plane, coeffs, out):
+    """
+    Evaluates the nonlinearity polynomial of each pixel on a read plane.
+
+    Args:
+        plane (np.ndarray): The read with shape (ny, nx).
+        coeffs (np.ndarray): Polynomial coefficients in increasing order with shape (ny, nx, n_coeffs).
+        out (np.ndarray): Output float array with shape (ny, nx).
+
+    Returns:
+        np.ndarray: The linearized read plane (out).
+    """
+    ny, nx = plane.shape
+    for i in prange(ny):
+        for j in range(nx):
+            out[i, j] = polyval_scalar(coeffs[i, j, :], plane[i, j])
+    return out
+
+
+@njit(nogil=True)
+def polyval_scalar(coeffs, x):
+    """
+    Evaluates the polynomial sum(coeffs[k] * x**k) at a scalar x with Horner's method, without allocating.
 
+    Args:
+        coeffs (np.ndarray): Polynomial coefficients in increasing order.
+        x (float): The value to evaluate.
 
-@njit
-def polyval(coeffs, x):
-    v = np.zeros_like(x)
-    for coeff in coeffs[::-1]:
-        v = v * x + coeff
-    return v
\ No newline at end of file
+    Returns:
+        float: The polynomial value in float64.
+    """
+    v = 0.0
+    for k in range(len(coeffs) - 1, -1, -1):
+        v = v * x + coeffs[k]
+    return v
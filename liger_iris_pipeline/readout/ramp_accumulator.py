@@ -0,0 +1,280 @@
+from numba import njit, prange
+import numpy as np
+
+from .fit_ramp_numba import _combine_group_slopes
+from .nonlinear_correction_numba import linearize_plane
+from ..utils.parallel import numba_threads
+
+__all__ = ['RampAccumulator', 'fit_ramps_read_major', 'fit_read_planes']
+
+
+class RampAccumulator:
+    """
+    Incrementally fits ramps as read planes arrive, e.g. for real-time quicklook.
+
+    Each read updates per-pixel running sums of y, t * y and y**2 in a single O(pixels) pass.
+    The sums over the read times (n, sum(t), sum(t**2)) are shared by all pixels and kept as scalars.
+    For (M)CDS, the sums of the first and of the most recent `num_coadd` reads are also tracked.
+    A slope and error image can be emitted at any point with `fit` for each of the methods given at construction.
+    Only these methods are fit when a group is closed.
+
+    Reads are referenced to the first read of each group to avoid cancellation in the sums.
+    Multiple groups are supported with `next_group`, and group slopes are combined as in `fit_ramps_ols`.
+
+    Example:
+        acc = RampAccumulator((ny, nx), methods=('ols', 'mcds'), num_coadd=3)
+        for t, plane in reads:
+            acc.add_read(plane, t)
+        slope, slope_err = acc.fit('ols')
+    """
+
+    def __init__(
+            self, shape : tuple[int, int], methods : tuple[str, ...] = ('ols',), num_coadd : int = 1,
+            coeffs : np.ndarray | None = None, n_threads : int | None = None
+        ):
+        """
+        Args:
+            shape (tuple[int, int]): Shape (ny, nx) of the read planes.
+            methods (tuple[str, ...]): The fit methods to emit with `fit`, 'ols' and/or 'mcds' ('cds' if num_coadd=1).
+            num_coadd (int): Number of coadds for the 'mcds' method. num_coadd=1 for CDS.
+            coeffs (np.ndarray | None): Nonlinearity polynomial coefficients with shape (ny, nx, n_coeffs)
+                applied to each read plane as it is added.
+            n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
+        """
+        self.shape = tuple(shape)
+        self.methods = tuple(_parse_method(method) for method in methods)
+        self.num_coadd = num_coadd
+        self.coeffs = coeffs
+        self.n_threads = n_threads
+        self._plane = np.zeros(self.shape, dtype=np.float64) if coeffs is not None else None
+        self._group_fits = {method: [] for method in self.methods}
+        self._init_group()
+
+
+    def _init_group(self):
+        ny, nx = self.shape
+        mcds = 'mcds' in self.methods
+        self.n_reads = 0
+        self._sum_t = 0.0
+        self._sum_t2 = 0.0
+        self._times_first = 0.0
+        self._times_last = np.zeros(self.num_coadd, dtype=np.float64)
+        self._y0 = np.zeros((ny, nx), dtype=np.float64)
+        self._sum_y = np.zeros((ny, nx), dtype=np.float64)
+        self._sum_ty = np.zeros((ny, nx), dtype=np.float64)
+        self._sum_y2 = np.zeros((ny, nx), dtype=np.float64)
+        self._sum_first = np.zeros((ny, nx), dtype=np.float64) if mcds else None
+        self._sum_last = np.zeros((ny, nx), dtype=np.float64) if mcds else None
+        self._reads_last = np.zeros((self.num_coadd, ny, nx), dtype=np.float64) if mcds else None
+
+
+    def add_read(self, plane : np.ndarray, time : float):
+        """
+        Add the next read of the current group.
+
+        Args:
+            plane (np.ndarray): The read with shape (ny, nx), e.g. the native uint16 counts.
+            time (float): The read time.
+        """
+        if plane.shape != self.shape:
+            raise ValueError(f"Read plane has shape {plane.shape}, expected {self.shape}")
+        time = float(time)
+        k = self.n_reads
+        with numba_threads(self.n_threads):
+            if self.coeffs is not None:
+                plane = linearize_plane(plane, self.coeffs, self._plane)
+            if k == 0:
+                self._y0[:] = plane
+            _accumulate_read(
+                plane, time, self._y0,
+                self._sum_y, self._sum_ty, self._sum_y2,
+                self._sum_first if k < self.num_coadd else None,
+                self._sum_last, self._reads_last[k % self.num_coadd] if self._reads_last is not None else None
+            )
+        self._sum_t += time
+        self._sum_t2 += time * time
+        if k < self.num_coadd:
+            self._times_first += time
+        self._times_last[k % self.num_coadd] = time
+        self.n_reads += 1
+
+
+    def next_group(self):
+        """
+        Close the current group and start accumulating the next one.
+        """
+        for method in self.methods:
+            self._group_fits[method].append(self._fit_group(method))
+        self._init_group()
+
+
+    def fit(self, method : str = 'ols') -> tuple[np.ndarray, np.ndarray]:
+        """
+        Emit the slope and slope error images from the reads added so far.
+
+        Args:
+            method (str): One of the methods given at construction, 'ols' or 'mcds' ('cds' if num_coadd=1).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The slope and slope error images.
+        """
+        method = _parse_method(method)
+        if method not in self._group_fits:
+            raise ValueError(f"The accumulator only fits the methods {self.methods}, got {method}")
+        group_fits = list(self._group_fits[method])
+        if self.n_reads > 0 or len(group_fits) == 0:
+            group_fits.append(self._fit_group(method))
+        slopes = np.array([g[0] for g in group_fits])
+        slope_errors = np.array([g[1] for g in group_fits])
+        with numba_threads(self.n_threads):
+            return _combine_group_images(slopes, slope_errors)
+
+
+    def _fit_group(self, method : str) -> tuple[np.ndarray, np.ndarray]:
+        n = self.n_reads
+        if method == 'ols':
+            if n < 2:
+                raise ValueError(f"OLS needs at least 2 reads, got {n}")
+            with numba_threads(self.n_threads):
+                return _fit_ols_sums(
+                    n, self._sum_t, self._sum_t2,
+                    self._sum_y, self._sum_ty, self._sum_y2
+                )
+        else:
+            if n <= self.num_coadd:
+                raise ValueError(f"MCDS with num_coadd={self.num_coadd} needs more than {self.num_coadd} reads, got {n}")
+            with numba_threads(self.n_threads):
+                return _fit_mcds_sums(
+                    n, self.num_coadd, self._sum_t, self._sum_t2,
+                    self._times_first, np.sum(self._times_last),
+                    self._y0, self._sum_y, self._sum_ty, self._sum_y2,
+                    self._sum_first, self._sum_last
+                )
+
+
+def _parse_method(method : str) -> str:
+    method = method.lower()
+    if method == 'cds':
+        method = 'mcds'
+    if method not in ('ols', 'mcds'):
+        raise ValueError(f"Unknown ramp fit method: {method}")
+    return method
+
+
+@njit(nogil=True, parallel=True)
+def _accumulate_read(plane, t, y0, sum_y, sum_ty, sum_y2, sum_first, sum_last, read_last):
+    ny, nx = plane.shape
+    for i in prange(ny):
+        for j in range(nx):
+            y = plane[i, j] - y0[i, j]
+            sum_y[i, j] += y
+            sum_ty[i, j] += t * y
+            sum_y2[i, j] += y * y
+            if sum_first is not None:
+                sum_first[i, j] += y
+            # Sliding window over the last num_coadd reads, read_last holds the read being replaced
+            if sum_last is not None:
+                sum_last[i, j] += y - read_last[i, j]
+                read_last[i, j] = y
+
+
+@njit(nogil=True, parallel=True)
+def _fit_ols_sums(n, sum_t, sum_t2, sum_y, sum_ty, sum_y2):
+    ny, nx = sum_y.shape
+    slope = np.zeros((ny, nx), dtype=np.float32)
+    slope_error = np.zeros((ny, nx), dtype=np.float32)
+    sxx = sum_t2 - sum_t * sum_t / n
+    for i in prange(ny):
+        for j in range(nx):
+            sxy = sum_ty[i, j] - sum_t * sum_y[i, j] / n
+            syy = sum_y2[i, j] - sum_y[i, j] * sum_y[i, j] / n
+            _slope = sxy / sxx
+            rss = syy - _slope * sxy
+            if rss < 0:
+                rss = 0.0
+            slope[i, j] = _slope
+            slope_error[i, j] = np.sqrt(rss / (n - 2) / sxx)
+    return slope, slope_error
+
+
+@njit(nogil=True, parallel=True)
+def _fit_mcds_sums(n, num_coadd, sum_t, sum_t2, times_first, times_last, y0, sum_y, sum_ty, sum_y2, sum_first, sum_last):
+    ny, nx = sum_y.shape
+    slope = np.zeros((ny, nx), dtype=np.float32)
+    slope_error = np.zeros((ny, nx), dtype=np.float32)
+    for i in prange(ny):
+        for j in range(nx):
+            _slope = (sum_last[i, j] - sum_first[i, j]) / (times_last - times_first)
+
+            # sum((y - slope * t)**2) expanded in terms of the sums referenced to y0
+            _y0 = y0[i, j]
+            rss = sum_y2[i, j] + n * _y0**2 + _slope**2 * sum_t2 \
+                + 2 * _y0 * sum_y[i, j] - 2 * _slope * sum_ty[i, j] - 2 * _slope * _y0 * sum_t
+            if rss < 0:
+                rss = 0.0
+            slope[i, j] = _slope
+            slope_error[i, j] = np.sqrt(rss / (n - 1) / sum_t2)
+    return slope, slope_error
+
+
+@njit(nogil=True, parallel=True)
+def _combine_group_images(slopes, slope_errors):
+    n_groups, ny, nx = slopes.shape
+    slope = np.zeros((ny, nx), dtype=np.float32)
+    slope_error = np.zeros((ny, nx), dtype=np.float32)
+    for i in prange(ny):
+        # Thread-local scratch for the group fits of this row
+        slope_groups = np.zeros(n_groups, dtype=np.float32)
+        slope_error_groups = np.zeros(n_groups, dtype=np.float32)
+        for j in range(nx):
+            for k in range(n_groups):
+                slope_groups[k] = slopes[k, i, j]
+                slope_error_groups[k] = slope_errors[k, i, j]
+            slope[i, j], slope_error[i, j] = _combine_group_slopes(slope_groups, slope_error_groups)
+    return slope, slope_error
+
+
+def fit_ramps_read_major(times, ramps, method : str = 'ols', num_coadd : int = 1, coeffs=None, n_threads : int | None = None):
+    """
+    Fits read-major ramps (groups, reads, y, x) by streaming one contiguous read plane at a time through a `RampAccumulator`.
+    Gives the same results as `fit_ramps_ols` and `fit_ramps_mcds` on the pixel-major layout.
+
+    Args:
+        times (np.ndarray): Read times with shape (n_groups, n_reads).
+        ramps (np.ndarray): 4D array of ramp data with shape (n_groups, n_reads, ny, nx).
+        method (str): 'ols' or 'mcds' ('cds' if num_coadd=1).
+        num_coadd (int): Number of coadds for the 'mcds' method.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients with shape (ny, nx, n_coeffs).
+        n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The slope and slope error images.
+    """
+    n_groups, n_reads = ramps.shape[:2]
+    planes = ((k, r, ramps[k, r]) for k in range(n_groups) for r in range(n_reads))
+    return fit_read_planes(times, planes, ramps.shape[2:], method=method, num_coadd=num_coadd, coeffs=coeffs, n_threads=n_threads)
+
+
+def fit_read_planes(times, planes, shape : tuple[int, int], method : str = 'ols', num_coadd : int = 1, coeffs=None, n_threads : int | None = None):
+    """
+    Fits ramps from an iterable of read planes in readout order, e.g. `RampModel.iter_read_planes`,
+    so only one read plane needs to be in memory at a time.
+
+    Args:
+        times (np.ndarray): Read times with shape (n_groups, n_reads).
+        planes (Iterable[tuple[int, int, np.ndarray]]): The group index, read index and read plane with shape (ny, nx).
+        shape (tuple[int, int]): Shape (ny, nx) of the read planes.
+        method (str): 'ols' or 'mcds' ('cds' if num_coadd=1).
+        num_coadd (int): Number of coadds for the 'mcds' method.
+        coeffs (np.ndarray | None): Nonlinearity polynomial coefficients with shape (ny, nx, n_coeffs).
+        n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The slope and slope error images.
+    """
+    acc = RampAccumulator(shape, methods=(method,), num_coadd=num_coadd, coeffs=coeffs, n_threads=n_threads)
+    for k, r, plane in planes:
+        if k > 0 and r == 0:
+            acc.next_group()
+        acc.add_read(plane, times[k, r])
+    return acc.fit(method)
@@ -2,9 +2,11 @@
 from liger_iris_pipeline import CalculateBackgroundImagerStep
 from liger_iris_pipeline import SubtractBackgroundImagerStep
 import liger_iris_pipeline.datamodels as datamodels
+from liger_iris_pipeline.background.calc_background_imager_step import calc_scaled_sky_imager, calc_sky_imager
 from liger_iris_pipeline.utils.gdrive import download_gdrive_file
 
 import numpy as np
+import astropy.stats
 
 
 def test_calc_background_imager(tmp_path):
@@ -47,3 +49,32 @@ def test_calc_background_imager(tmp_path):
     for sci, scale in zip(sci_models, scales):
         step = SubtractBackgroundImagerStep()
         sci_sub = step.run(sci, background=sky_model, scale=scale)
+
+
+def test_calc_scaled_sky_imager():
+    rng = np.random.default_rng(1)
+    yy, xx = np.mgrid[0:64, 0:64]
+    sky = 100 + 0.2 * xx + 0.1 * yy
+    data_cube = np.array([sky * scale + rng.normal(0, 1, sky.shape) for scale in (0.9, 1.0, 1.2)], dtype=np.float32)
+    dq_cube = np.zeros(data_cube.shape, dtype=np.uint32)
+    dq_cube[1, 10:14, 10:14] = 1
+    kwargs = dict(box_size=(16, 16), filter_size=(3, 3))
+
+    # Reference: scale the Background2D of each frame by its biweight location relative to the mean and average them
+    bkgs = [calc_sky_imager(data_cube[i], dq_cube[i] > 0, **kwargs) for i in range(3)]
+    levels = np.array([astropy.stats.biweight_location(bkg.background, ignore_nan=True) for bkg in bkgs])
+    scales = levels / np.mean(levels)
+    scaled = np.array([bkgs[i].background * scales[i] for i in range(3)])
+    expected = np.nanmean(np.where(dq_cube > 0, np.nan, scaled), axis=0)
+
+    # The Background2D of each frame is returned by default, and the planes are the same without them and with workers
+    result = calc_scaled_sky_imager(data_cube, dq_cube, **kwargs)
+    np.testing.assert_allclose(result['sky_scales'], scales, rtol=1e-6)
+    np.testing.assert_allclose(result['sky'], expected, rtol=1e-5)
+    assert len(result['sky_results']) == 3
+    np.testing.assert_array_equal(result['sky_results'][2].background, bkgs[2].background)
+    for options in (dict(keep_sky_results=False), dict(n_workers=2), dict(n_workers=2, keep_sky_results=False)):
+        result_options = calc_scaled_sky_imager(data_cube, dq_cube, **options, **kwargs)
+        assert ('sky_results' in result_options) == options.get('keep_sky_results', True)
+        for key in ('sky', 'sky_err', 'sky_dq', 'sky_scales'):
+            np.testing.assert_array_equal(result_options[key], result[key])
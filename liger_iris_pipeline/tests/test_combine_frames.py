@@ -1,7 +1,15 @@
 # Imports
+import subprocess
+import sys
+import textwrap
 import numpy as np
+import pytest
 import liger_iris_pipeline
 from liger_iris_pipeline import datamodels
+from liger_iris_pipeline.combine_frames.combine_frames_step import combine_frames, _combine_frames, sigma_clip, sigma_clip_cube, meaure_error_cube, propagate_error_cube, weighted_quantile_cube
+from liger_iris_pipeline.combine_frames.frame_accumulator import FrameAccumulator
+from liger_iris_pipeline.utils import math
+from liger_iris_pipeline.utils.parallel import numba_threads
 from liger_iris_pipeline.tests.utils import get_meta
 
 
@@ -23,6 +31,70 @@ def create_frame(jd_start, itime):
     return model
 
 
+def make_stack(n_frames=9, shape=(12, 10), seed=1):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(100, 1, (n_frames,) + shape).astype(np.float32)
+    err = rng.uniform(0.5, 1.5, (n_frames,) + shape).astype(np.float32)
+    dq = np.zeros((n_frames,) + shape, dtype=np.uint32)
+
+    # Outliers, and flagged frames with NaNs
+    data[0, 0, 0] = 1000
+    data[1, 2, 3] = -1000
+    data[rng.random(data.shape) < 0.02] += 50
+    flagged = rng.random(data.shape) < 0.05
+    dq[flagged] = 1
+    data[flagged & (rng.random(data.shape) < 0.5)] = np.nan
+    return data, err, dq
+
+
+def reference_errors(data, err, dq):
+    """
+    Measured and propagated errors of the good values of each pixel stack with numpy.
+    """
+    good = dq == 0
+    w = np.where(good, 1 / err.astype(np.float64)**2, 0)
+    n_good = np.sum(good, axis=0)
+    x = np.where(good, data, 0).astype(np.float64)
+    M = np.sum(w * x, axis=0) / np.sum(w, axis=0)
+    wn = w / np.sum(w, axis=0)
+    var = np.sum(wn * (x - M)**2, axis=0) / (1 - np.sum(wn**2, axis=0))
+    err_measure = np.sqrt(var) / np.sqrt(n_good - 1)
+
+    # A single good value keeps its error, pixels without good values are NaN
+    err_measure = np.where(n_good == 1, np.sum(np.where(good, err, 0), axis=0), err_measure)
+    err_propagate = np.where(n_good > 0, np.sum(w, axis=0)**-0.5, np.nan)
+    return err_measure, err_propagate
+
+
+def test_combine_kernels_parallel():
+    data, err, dq = make_stack()
+    mask = (dq > 0) | np.isnan(data)
+    kwargs = dict(sigma_thresh_low=4.0, sigma_thresh_high=4.0, maxiters=50)
+
+    # Reference: the serial sigma clip of each pixel stack
+    mask_ref = mask.copy()
+    for i, j in np.ndindex(data.shape[1:]):
+        mask_ref[:, i, j] = sigma_clip(data[:, i, j].copy(), mask[:, i, j].copy(), **kwargs)[0]
+    assert mask_ref[0, 0, 0] and mask_ref[1, 2, 3]
+
+    # The row-parallel kernels match the references for any number of threads
+    err_measure, err_propagate = reference_errors(data, err, dq)
+    for n_threads in (1, None):
+        with numba_threads(n_threads):
+            mask_out = mask.copy()
+            sigma_clip_cube(data, mask_out, **kwargs)
+            np.testing.assert_array_equal(mask_out, mask_ref)
+            np.testing.assert_allclose(meaure_error_cube(data, err, dq), err_measure, rtol=1e-5)
+            np.testing.assert_allclose(propagate_error_cube(err, dq), err_propagate, rtol=1e-5)
+
+    # The step gives the same result for any number of threads
+    models = [datamodels.ImagerModel(data=data[k], err=err[k], dq=dq[k]) for k in range(len(data))]
+    result = liger_iris_pipeline.CombineFramesStep(n_threads=1).run(models)
+    result_parallel = liger_iris_pipeline.CombineFramesStep().run(models)
+    np.testing.assert_array_equal(result_parallel.data, result.data)
+    np.testing.assert_array_equal(result_parallel.err, result.err)
+
+
 def test_combine_frames():
 
     # Create a set of frames
@@ -41,4 +113,152 @@ def test_combine_frames():
 
     # Test model_blender
     assert result.meta.instrument.name == 'Liger'
-    assert result.meta.exposure.jd_mid == np.mean([m.meta.exposure.jd_mid for m in models])
\ No newline at end of file
+    assert result.meta.exposure.jd_mid == np.mean([m.meta.exposure.jd_mid for m in models])
+
+def test_combine_frames_tiled(tmp_path):
+    data, err, dq = make_stack()
+    filepaths = []
+    for k in range(len(data)):
+        model = datamodels.ImagerModel(data=data[k], err=err[k], dq=dq[k])
+        filepaths.append(str(tmp_path / f'frame_{k}.fits'))
+        model.save(filepaths[-1])
+
+    # Combining tiles of rows read from disk gives the same result as combining the full stacks at once
+    for kwargs in (dict(method='mean'), dict(method='wmedian', error_calc='propagate')):
+        result = combine_frames(filepaths, **kwargs)
+        expected = _combine_frames(data, err, dq, **kwargs)
+        for tiling in (dict(tile_rows=5), dict(max_memory=1E-6)):
+            result_tiled = combine_frames(filepaths, **tiling, **kwargs)
+            for key in ('data', 'err', 'dq'):
+                np.testing.assert_array_equal(result_tiled[key], result[key])
+                np.testing.assert_array_equal(result[key], expected[key])
+
+
+def test_combine_frames_fused():
+    data, err, dq = make_stack()
+    data[2, 5, 5] = 1E6
+    dq[2, 5, 5] = 1
+    dq[:, 7, 7] = 1
+    data_copy, dq_copy = data.copy(), dq.copy()
+
+    # Reference: numpy reductions of the values kept after masking flagged and NaN values and sigma clipping
+    mask = (dq > 0) | np.isnan(data)
+    sigma_clip_cube(data, mask, sigma_thresh_low=4.0, sigma_thresh_high=4.0)
+    values = np.where(mask, np.nan, data).astype(np.float64)
+    w = np.where(mask, 0, 1 / err.astype(np.float64)**2)
+    err_measure, err_propagate = reference_errors(data, err, mask.astype(np.uint32))
+    expected = dict(
+        mean=np.nanmean(values, axis=0), median=np.nanmedian(values, axis=0),
+        wmean=np.nansum(w * values, axis=0) / np.sum(w, axis=0)
+    )
+    for method, data_expected in expected.items():
+        for error_calc, err_expected in (('measure', err_measure), ('propagate', err_propagate)):
+            result = _combine_frames(data, err, dq, method=method, error_calc=error_calc, sigma_thresh_low=4.0, sigma_thresh_high=4.0, dq_reduce='or')
+            np.testing.assert_allclose(result['data'], data_expected, rtol=1e-6)
+            np.testing.assert_allclose(result['err'], err_expected, rtol=1e-5)
+            np.testing.assert_array_equal(result['dq'], np.bitwise_or.reduce(dq, axis=0))
+
+    # Flagged values are excluded from the unweighted methods too, and pixels without good values are NaN
+    assert abs(result['data'][5, 5] - 100) < 5
+    assert np.isnan(result['data'][7, 7]) and np.isnan(result['err'][7, 7])
+
+    # The inputs are not modified
+    np.testing.assert_array_equal(data, data_copy)
+    np.testing.assert_array_equal(dq, dq_copy)
+
+
+def test_weighted_median_cube():
+    data, err, dq = make_stack()
+    weights = np.where(dq > 0, 0, 1 / err.astype(np.float64)**2)
+
+    # Reference: the weighted median of each pixel stack by a full sort
+    expected = np.empty(data.shape[1:])
+    for i, j in np.ndindex(expected.shape):
+        good = weights[:, i, j] > 0
+        expected[i, j] = math.weighted_quantile(data[good, i, j].astype(np.float64), weights[good, i, j], 0.5)
+    for n_threads in (1, None):
+        with numba_threads(n_threads):
+            np.testing.assert_array_equal(weighted_quantile_cube(data.astype(np.float64), weights, 0.5), expected)
+
+    # The 'wmedian' combine of the unclipped stacks
+    result = _combine_frames(data, err, dq, method='wmedian', do_sigma_clip=False)
+    np.testing.assert_allclose(result['data'], expected, rtol=1e-6)
+
+
+def test_frame_accumulator():
+    data, err, dq = make_stack(n_frames=12)
+    data += 1E4
+
+    # Pixels with fewer good values than rejected values
+    dq[:10, 4, 4] = 1
+    dq[:11, 6, 6] = 1
+    dq[:, 8, 8] = 1
+
+    # Streaming min/max rejection matches the batch rejection, also when merging accumulators of subsets of the frames
+    acc = FrameAccumulator(data.shape[1:], num_reject_low=1, num_reject_high=2)
+    acc_a = FrameAccumulator(data.shape[1:], num_reject_low=1, num_reject_high=2)
+    acc_b = FrameAccumulator(data.shape[1:], num_reject_low=1, num_reject_high=2)
+    for k in range(len(data)):
+        acc.add(data[k], err[k], dq[k])
+        (acc_a if k % 3 == 0 else acc_b).add(data[k], err[k], dq[k])
+    acc_a.merge(acc_b)
+    for method in ('mean', 'wmean'):
+        for error_calc in ('measure', 'propagate'):
+            expected = _combine_frames(
+                data, err, dq, method=method, error_calc=error_calc, reject='minmax',
+                num_mask_low=1, num_mask_high=2, dq_reduce='or'
+            )
+            for result in (acc.finalize(method, error_calc), acc_a.finalize(method, error_calc)):
+                np.testing.assert_allclose(result['data'], expected['data'], rtol=1e-7)
+                np.testing.assert_allclose(result['err'], expected['err'], rtol=1e-5)
+                np.testing.assert_array_equal(result['dq'], expected['dq'])
+    assert np.isnan(result['data'][8, 8])
+
+
+def test_combine_frames_sharded():
+
+    # Run a parallel kernel before the process pool starts, then check that the process exits with the same result
+    script = textwrap.dedent("""
+        import numpy as np
+        from liger_iris_pipeline.combine_frames.combine_frames_step import combine_frames
+        from liger_iris_pipeline.tests.test_combine_frames import make_stack
+        from liger_iris_pipeline import datamodels
+        if __name__ == '__main__':
+            data, err, dq = make_stack()
+            models = [datamodels.ImagerModel(data=data[k], err=err[k], dq=dq[k]) for k in range(len(data))]
+            result = combine_frames(models, method='median')
+            result_sharded = combine_frames(models, method='median', n_processes=2, tile_rows=3)
+            for key in ('data', 'err', 'dq'):
+                np.testing.assert_array_equal(result_sharded[key], result[key])
+            print('OK')
+    """)
+    proc = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=600)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip().endswith('OK')
+
+
+def test_combine_frames_reject():
+    data, err, dq = make_stack()
+    good = (dq == 0) & ~np.isnan(data)
+    values = np.where(good, data, np.nan).astype(np.float64)
+
+    # Threshold, percentile and min/max rejection of the good values match numpy
+    expected = np.where((values >= 99) & (values <= 101), values, np.nan)
+    result = _combine_frames(data, err, dq, reject='threshold', value_low=99.0, value_high=101.0)
+    np.testing.assert_allclose(result['data'], np.nanmean(expected, axis=0), rtol=1e-6)
+    lo, hi = np.nanpercentile(values, [10, 80], axis=0)
+    expected = np.where((values >= lo) & (values <= hi), values, np.nan)
+    result = _combine_frames(data, err, dq, reject='percentile', percentile_low=10.0, percentile_high=80.0)
+    np.testing.assert_allclose(result['data'], np.nanmean(expected, axis=0), rtol=1e-6)
+    expected = np.sort(values, axis=0)[1:]
+    n_good = np.sum(good, axis=0)
+    expected[np.arange(len(expected))[:, None, None] >= n_good - 3] = np.nan
+    result = _combine_frames(data, err, dq, reject='minmax', num_mask_low=1, num_mask_high=2)
+    np.testing.assert_allclose(result['data'], np.nanmean(expected, axis=0), rtol=1e-6)
+
+    # One-sided thresholds, the sigma clipping thresholds are not used
+    models = [datamodels.ImagerModel(data=data[k], err=err[k], dq=dq[k]) for k in range(len(data))]
+    result = liger_iris_pipeline.CombineFramesStep(reject='threshold', value_high=101.0, thresh_high=-1E6).run(models)
+    np.testing.assert_allclose(result.data, np.nanmean(np.where(values <= 101, values, np.nan), axis=0), rtol=1e-6)
+    with pytest.raises(ValueError):
+        liger_iris_pipeline.CombineFramesStep(reject='threshold', thresh_low=99.0, thresh_high=101.0).run(models)
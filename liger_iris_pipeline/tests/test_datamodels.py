@@ -1,5 +1,9 @@
+import numpy as np
+import pytest
+from astropy.io import fits
 from liger_iris_pipeline import datamodels
 from liger_iris_pipeline.utils.gdrive import download_gdrive_file
+from liger_iris_pipeline.tests.utils import get_meta
 
 
 def test_load_liger_image():
@@ -26,4 +30,86 @@ def test_load_iris_image():
     assert input_model.meta.instrument.name == "IRIS"
     assert input_model.meta.instrument.detector == "IMG1"
     assert input_model.meta.subarray.name == "FULL"
-    assert input_model.data.shape == (4096, 4096)
\ No newline at end of file
+    assert input_model.data.shape == (4096, 4096)
+
+def test_ramp_read_difference(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    shape = (6, 5, 2, 8)
+    model = datamodels.RampModel(
+        times=np.tile(np.arange(1, 9, dtype=float), (2, 1)),
+        data=rng.integers(0, 2**16, shape).astype(np.uint16),
+        dq=rng.integers(0, 4, shape).astype(np.uint16)
+    )
+    model.meta.instrument.name = 'Liger'
+    model.meta.instrument.mode = 'IMG'
+    model.meta.instrument.filter = 'J'
+    get_meta(model)
+    filepath = model.save_read_difference(str(tmp_path / 'ramp_rd.fits'))
+
+    # The encoding is detected without reading the header again
+    def getheader(*args, **kwargs):
+        raise AssertionError("Unexpected header read")
+    monkeypatch.setattr(fits, 'getheader', getheader)
+
+    # Lossless round trip, also with wrapping differences, in the read-major layout of the file
+    model_rm = model.copy()
+    model_rm.to_read_major()
+    for loaded in (datamodels.RampModel(filepath), datamodels.RampModel(fits.open(filepath)), datamodels.open(filepath)):
+        assert isinstance(loaded, datamodels.RampModel)
+        assert loaded.meta.exposure.ramp_encoding == 'raw'
+        assert loaded.ramp_layout == 'read_major'
+        np.testing.assert_array_equal(loaded.data, model_rm.data)
+        np.testing.assert_array_equal(loaded.dq, model_rm.dq)
+        np.testing.assert_array_equal(loaded.times, model.times)
+        loaded.close()
+
+    # Bands of rows and read planes are decoded on their own
+    with datamodels.RampModel.open_lazy(filepath) as lazy:
+        assert lazy.ramp_shape == shape
+        np.testing.assert_array_equal(lazy.read_rows('data', 2, 4), model_rm.data[:, :, 2:4])
+        for k, r, plane in lazy.iter_read_planes('data'):
+            np.testing.assert_array_equal(plane, model.data[:, :, k, r])
+
+    # Files without the encoding load as usual
+    model.save(str(tmp_path / 'ramp.fits'))
+    with datamodels.RampModel(str(tmp_path / 'ramp.fits')) as loaded:
+        np.testing.assert_array_equal(loaded.data, model.data)
+
+
+def test_blend_models(tmp_path):
+    models = []
+    for i, filter in enumerate(['J', 'J', 'H']):
+        model = datamodels.ImagerModel(data=np.ones((4, 4), dtype=np.float32), err=np.ones((4, 4), dtype=np.float32), dq=np.zeros((4, 4), dtype=np.uint32))
+        model.meta.instrument.name = 'Liger'
+        model.meta.instrument.mode = 'IMG'
+        model.meta.instrument.filter = filter
+        model.meta.exposure.jd_start = 2460577.5 + i
+        model.meta.exposure.exposure_time = 300
+        get_meta(model)
+        models.append(model)
+    filepaths = []
+    for i, model in enumerate(models):
+        filepaths.append(str(tmp_path / f'frame_{i}.fits'))
+        model.save(filepaths[-1])
+
+    # Blended values, the same from models and from files
+    for input in (models, filepaths):
+        result = datamodels.ImagerModel(data=np.ones((4, 4), dtype=np.float32))
+        datamodels.blend_models(result, input)
+        assert result.meta.instrument.name == 'Liger'
+        assert result.meta.instrument.filter == 'MULTIPLE'
+        assert result.meta.exposure.jd_start == models[0].meta.exposure.jd_start
+        assert result.meta.exposure.jd_mid == np.mean([m.meta.exposure.jd_mid for m in models])
+        assert result.meta.exposure.jd_end == models[-1].meta.exposure.jd_end
+        assert len(result.hdrtab) == 3
+        assert list(result.hdrtab['FILTER']) == ['J', 'J', 'H']
+
+    # Same metadata and table as jwst.model_blender
+    model_blender = pytest.importorskip('jwst.model_blender')
+    expected = datamodels.ImagerModel(data=np.ones((4, 4), dtype=np.float32))
+    model_blender.blendmodels(expected, models)
+    flat = lambda model: {k: v for k, v in model.to_flat_dict(include_arrays=False).items() if k.startswith('meta')}
+    assert flat(result) == flat(expected)
+    assert result.hdrtab.dtype.names == expected.hdrtab.dtype.names
+    for name in expected.hdrtab.dtype.names:
+        np.testing.assert_array_equal(result.hdrtab[name], expected.hdrtab[name])
@@ -0,0 +1,282 @@
+# Imports
+import numpy as np
+import pytest
+from liger_iris_pipeline.datamodels import dqflags
+from liger_iris_pipeline.readout import FitRampStep, RampAccumulator, fit_ramps_ols, fit_ramps_mcds, fit_ramps_ols_dq, fit_ramps_optimal
+from liger_iris_pipeline.readout.fit_ramp_numba import _fit_ramp_ols, _combine_group_slopes
+from liger_iris_pipeline.tests.utils import create_ramp, get_meta
+
+
+def make_ramp(shape=(6, 5), n_groups=2, n_reads=8, read_noise=3.0, seed=1):
+    rng = np.random.default_rng(seed)
+    source = rng.uniform(10, 100, shape).astype(np.float32)
+    np.random.seed(seed)
+    ramp_model = create_ramp(source, readtime=1.0, n_reads_per_group=n_reads, n_groups=n_groups, read_noise=read_noise, poisson_noise=False)
+    ramp_model.meta.instrument.name = 'Liger'
+    ramp_model.meta.instrument.mode = 'IMG'
+    ramp_model.meta.instrument.filter = 'J'
+    get_meta(ramp_model)
+    return ramp_model
+
+
+def reference_fit_ols(times, ramps):
+    """
+    Per-pixel OLS fits with np.polyfit, combined over groups with inverse variance weights.
+    """
+    ny, nx, n_groups, n_reads = ramps.shape
+    slope = np.zeros((ny, nx))
+    slope_err = np.zeros((ny, nx))
+    for i in range(ny):
+        for j in range(nx):
+            slopes, errs = [], []
+            for k in range(n_groups):
+                p, cov = np.polyfit(times[k], ramps[i, j, k].astype(float), 1, cov='unscaled')
+                rss = np.sum((ramps[i, j, k] - np.polyval(p, times[k]))**2)
+                slopes.append(p[0])
+                errs.append(np.sqrt(cov[0, 0] * rss / (n_reads - 2)))
+            slopes, errs = np.array(slopes), np.array(errs)
+            w = 1 / errs**2
+            slope[i, j] = np.sum(slopes * w) / np.sum(w)
+            slope_err[i, j] = np.sqrt(1 / np.sum(w))
+    return slope, slope_err
+
+
+def test_fit_ramps_parallel():
+    ramp_model = make_ramp()
+    times, ramps = ramp_model.times, ramp_model.data
+
+    # Parallel kernels against the serial run and a numpy reference
+    slope, slope_err = fit_ramps_ols(times, ramps)
+    slope1, slope_err1 = fit_ramps_ols(times, ramps, n_threads=1)
+    slope_ref, slope_err_ref = reference_fit_ols(times, ramps)
+    np.testing.assert_array_equal(slope, slope1)
+    np.testing.assert_array_equal(slope_err, slope_err1)
+    np.testing.assert_allclose(slope, slope_ref, rtol=1e-5)
+    np.testing.assert_allclose(slope_err, slope_err_ref, rtol=1e-4)
+
+    # CDS of a single group is the difference of the last and first read
+    slope, _ = fit_ramps_mcds(times[:1], ramps[:, :, :1], num_coadd=1)
+    slope1, _ = fit_ramps_mcds(times[:1], ramps[:, :, :1], num_coadd=1, n_threads=1)
+    cds = (ramps[:, :, 0, -1].astype(float) - ramps[:, :, 0, 0]) / (times[0, -1] - times[0, 0])
+    np.testing.assert_array_equal(slope, slope1)
+    np.testing.assert_allclose(slope, cds, rtol=1e-5)
+
+
+def test_fit_ramps_ols_closed_form():
+    ramp_model = make_ramp()
+    times = ramp_model.times
+
+    # Large offset to check the closed-form sums against cancellation
+    ramps = ramp_model.data.astype(np.float64) + 30000
+    slope, slope_err = fit_ramps_ols(times, ramps)
+    ny, nx, n_groups, _ = ramps.shape
+    for i in range(ny):
+        for j in range(nx):
+            fits = np.array([_fit_ramp_ols(times[k], ramps[i, j, k]) for k in range(n_groups)], dtype=np.float32)
+            slope_ref, slope_err_ref = _combine_group_slopes(fits[:, 0], fits[:, 1])
+            np.testing.assert_allclose(slope[i, j], slope_ref, rtol=1e-5)
+            np.testing.assert_allclose(slope_err[i, j], slope_err_ref, rtol=1e-4)
+
+
+def test_fit_ramp_step_tiled(tmp_path):
+    ramp_model = make_ramp()
+    filepath = str(tmp_path / 'ramp.fits')
+    ramp_model.save(filepath)
+
+    # Fitting bands of rows read from disk gives the same result as fitting all rows at once
+    result = FitRampStep().run(filepath)
+    for kwargs in (dict(tile_rows=2), dict(max_memory=1E-6)):
+        result_tiled = FitRampStep(**kwargs).run(filepath)
+        np.testing.assert_array_equal(result_tiled.data, result.data)
+        np.testing.assert_array_equal(result_tiled.err, result.err)
+        np.testing.assert_array_equal(result_tiled.dq, result.dq)
+
+
+def test_fit_ramps_uint16():
+    ramp_model = make_ramp()
+    times, ramps = ramp_model.times, ramp_model.data
+    assert ramps.dtype == np.uint16
+
+    # The kernels on the native uint16 reads match the fits of the promoted float64 reads
+    for fit in (fit_ramps_ols, fit_ramps_mcds):
+        slope, slope_err = fit(times, ramps)
+        slope_ref, slope_err_ref = fit(times, ramps.astype(np.float64))
+        np.testing.assert_array_equal(slope, slope_ref)
+        np.testing.assert_allclose(slope_err, slope_err_ref, rtol=1e-6)
+
+
+def test_ramp_accumulator():
+    ramp_model = make_ramp()
+    times, ramps = ramp_model.times, ramp_model.data
+    n_groups, n_reads = times.shape
+
+    # Read-by-read fits match the batch kernels
+    acc = RampAccumulator(ramps.shape[:2], methods=('ols', 'mcds'), num_coadd=3)
+    for k in range(n_groups):
+        if k > 0:
+            acc.next_group()
+        for r in range(n_reads):
+            acc.add_read(ramps[:, :, k, r], times[k, r])
+    for method, fit in (('ols', fit_ramps_ols), ('mcds', lambda *args: fit_ramps_mcds(*args, num_coadd=3))):
+        slope, slope_err = acc.fit(method)
+        slope_ref, slope_err_ref = fit(times, ramps)
+        np.testing.assert_allclose(slope, slope_ref, rtol=1e-5)
+        np.testing.assert_allclose(slope_err, slope_err_ref, rtol=1e-4)
+
+    # Only the requested methods are fit, so OLS works with as few reads as num_coadd
+    acc = RampAccumulator(ramps.shape[:2], num_coadd=3)
+    for r in range(3):
+        acc.add_read(ramps[:, :, 0, r], times[0, r])
+    slope, _ = acc.fit('ols')
+    slope_ref, _ = fit_ramps_ols(times[:1, :3], np.ascontiguousarray(ramps[:, :, :1, :3]))
+    np.testing.assert_allclose(slope, slope_ref, rtol=1e-5)
+    with pytest.raises(ValueError):
+        acc.fit('mcds')
+
+
+def test_fit_ramps_ols_dq():
+    rng = np.random.default_rng(2)
+    ny, nx, n_reads = 100, 100, 10
+    times = np.arange(1, n_reads + 1, dtype=float)[None]
+    ramps = 1000 + 10 * times[0] + rng.normal(0, 5, (ny, nx, 1, n_reads))
+    dq = np.zeros(ramps.shape, dtype=np.uint16)
+    jump = dqflags.pixel['JUMP_DET']
+
+    # No false jumps on Gaussian ramps, and the same fit as without jump detection
+    slope, slope_err, dq_out = fit_ramps_ols_dq(times, ramps, dq, jump_sigma=5.0)
+    assert np.mean(dq_out & jump != 0) < 1E-3
+    slope_ref, slope_err_ref = fit_ramps_ols(times, ramps)
+    np.testing.assert_allclose(slope[dq_out == 0], slope_ref[dq_out == 0], rtol=1e-5)
+
+    # A large jump is detected and fit around
+    ramps_jump = ramps.copy()
+    ramps_jump[..., n_reads // 2:] += 500
+    slope, _, dq_out = fit_ramps_ols_dq(times, ramps_jump, dq, jump_sigma=5.0)
+    assert np.all(dq_out & jump != 0)
+    np.testing.assert_allclose(np.mean(slope), 10, atol=0.1)
+
+    # Saturation after 2 reads keeps the CDS slope of the 2 reads
+    slope, slope_err, dq_out = fit_ramps_ols_dq(times, ramps, dq, saturation=1025, jump_sigma=5.0)
+    cds = ramps[..., 0, 1] - ramps[..., 0, 0]
+    two_reads = (np.max(ramps[..., 0, :2], axis=-1) < 1025) & (ramps[..., 0, 2] >= 1025)
+    assert np.any(two_reads)
+    np.testing.assert_allclose(slope[two_reads], cds[two_reads], rtol=1e-5)
+    assert np.all(np.isnan(slope_err[two_reads]))
+    assert np.all(dq_out[two_reads] & dqflags.pixel['DO_NOT_USE'] == 0)
+    _, slope_err, _ = fit_ramps_ols_dq(times, ramps, dq, saturation=1025, read_noise=5.0)
+    np.testing.assert_allclose(slope_err[two_reads], np.sqrt(2 * 5.0**2 + np.maximum(cds[two_reads], 0)), rtol=1e-5)
+
+
+def test_fit_ramps_optimal():
+    rng = np.random.default_rng(3)
+    ny, nx, n_reads = 50, 50, 20
+    read_noise, signal = 10.0, 50.0
+    times = np.arange(1, n_reads + 1, dtype=float)[None]
+
+    # Noiseless ramps are fit exactly in every signal-to-noise bin
+    for _signal in (0.01, 1.0, 100.0, 1E4):
+        ramps = 1000 + _signal * np.broadcast_to(times[0], (ny, nx, 1, n_reads))
+        slope, _ = fit_ramps_optimal(times, ramps, read_noise=read_noise)
+        np.testing.assert_allclose(slope, _signal, rtol=1e-5, atol=1e-5)
+
+    # With read and shot noise, the error matches the scatter of the slopes, which is below that of OLS
+    ramps = 1000 + np.cumsum(rng.poisson(signal, (ny, nx, 1, n_reads)), axis=-1) + rng.normal(0, read_noise, (ny, nx, 1, n_reads))
+    slope, slope_err = fit_ramps_optimal(times, ramps, read_noise=read_noise)
+    slope_ols, _ = fit_ramps_ols(times, ramps)
+    np.testing.assert_allclose(np.mean(slope), signal, atol=3 * np.std(slope) / np.sqrt(ny * nx))
+    np.testing.assert_allclose(np.std(slope), np.median(slope_err), rtol=0.1)
+    assert np.std(slope) < np.std(slope_ols)
+
+
+def test_fit_ramps_mcds_read_noise():
+    ramp_model = make_ramp(n_groups=1)
+    times, ramps = ramp_model.times, ramp_model.data
+    read_noise, gain, num_coadd = 3.0, 2.0, 3
+
+    # Same slopes as the residual error, with the error of the read and shot noise model
+    slope, slope_err = fit_ramps_mcds(times, ramps, num_coadd=num_coadd, read_noise=read_noise, gain=gain)
+    slope_ref, _ = fit_ramps_mcds(times, ramps, num_coadd=num_coadd)
+    np.testing.assert_allclose(slope, slope_ref, rtol=1e-6)
+    t1, t2 = times[0, :num_coadd], times[0, -num_coadd:]
+    dt = np.mean(t2) - np.mean(t1)
+    shot = (np.minimum.outer(t1, t1).sum() + np.minimum.outer(t2, t2).sum() - 2 * np.minimum.outer(t1, t2).sum()) / num_coadd**2
+    var = 2 * read_noise**2 / num_coadd + np.maximum(slope_ref, 0) * shot / gain
+    np.testing.assert_allclose(slope_err, np.sqrt(var) / dt, rtol=1e-5)
+
+    # Not enough reads for the Fowler pairs
+    with pytest.raises(ValueError):
+        fit_ramps_mcds(times, ramps, num_coadd=5, read_noise=read_noise)
+
+
+def test_fit_ramp_step_read_major():
+    ramp_model = make_ramp()
+    ramp_model_rm = ramp_model.copy()
+    ramp_model_rm.to_read_major()
+    assert ramp_model_rm.data.shape == (2, 8, 6, 5)
+    assert ramp_model_rm.ramp_shape == ramp_model.data.shape
+
+    # Read-major fits, streamed by read plane or on a transposed view, match the pixel-major fits
+    for kwargs in (dict(method='ols'), dict(method='mcds', num_coadd=2), dict(method='ols', read_dq=True)):
+        result = FitRampStep(**kwargs).run(ramp_model)
+        result_rm = FitRampStep(**kwargs).run(ramp_model_rm)
+        np.testing.assert_allclose(result_rm.data, result.data, rtol=1e-5)
+        np.testing.assert_allclose(result_rm.err, result.err, rtol=1e-4)
+
+    # Round trip of the layout
+    ramp_model_rm.to_pixel_major()
+    np.testing.assert_array_equal(ramp_model_rm.data, ramp_model.data)
+
+
+def test_fit_ramp_step_read_difference(tmp_path):
+    ramp_model = make_ramp()
+    filepath = ramp_model.save_read_difference(str(tmp_path / 'ramp_rd.fits'))
+
+    # Fits of the encoded file, decoded by rows or by read planes, match the fit of the model
+    for kwargs in (dict(), dict(tile_rows=2), dict(read_dq=True)):
+        result = FitRampStep(**kwargs).run(ramp_model)
+        result_rd = FitRampStep(**kwargs).run(filepath)
+        np.testing.assert_allclose(result_rd.data, result.data, rtol=1e-5)
+        np.testing.assert_allclose(result_rd.err, result.err, rtol=1e-4)
+
+
+def test_fit_ramp_step_roi(tmp_path):
+    ramp_model = make_ramp(shape=(8, 7))
+    windows = [[2, 1, 3, 2], [5, 4, 3, 5]]
+    mask = np.zeros((8, 7), dtype=bool)
+    mask[0:2, 1:4] = True
+    mask[3:8, 4:7] = True
+    result = FitRampStep().run(ramp_model)
+
+    # Only the windows are fit, from the model, a file and the read-major layout, the rest is flagged
+    filepath = str(tmp_path / 'ramp.fits')
+    ramp_model.save(filepath)
+    ramp_model_rm = ramp_model.copy()
+    ramp_model_rm.to_read_major()
+    for input in (ramp_model, filepath, ramp_model_rm):
+        result_roi = FitRampStep(windows=windows).run(input)
+        np.testing.assert_allclose(result_roi.data[mask], result.data[mask], rtol=1e-5)
+        np.testing.assert_allclose(result_roi.err[mask], result.err[mask], rtol=1e-4)
+        assert np.all(np.isnan(result_roi.data[~mask]))
+        assert np.all(result_roi.dq[~mask] == dqflags.pixel['DO_NOT_USE'])
+
+    # Windows from meta.subarray_map, full-frame entries are skipped
+    ramp_model.meta.subarray_map = [
+        dict(id=0, name='FULL', xstart=1, ystart=1, xsize=7, ysize=8),
+        dict(id=1, name='CUSTOM', xstart=2, ystart=1, xsize=3, ysize=2),
+        dict(id=2, name='CUSTOM', xstart=5, ystart=4, xsize=3, ysize=5),
+    ]
+    result_roi = FitRampStep(roi=True).run(ramp_model)
+    np.testing.assert_allclose(result_roi.data[mask], result.data[mask], rtol=1e-5)
+    assert np.all(np.isnan(result_roi.data[~mask]))
+
+    # Compact models per window
+    sub_models = FitRampStep(windows=windows, roi_output='windows').run(ramp_model)
+    assert len(sub_models) == 2
+    np.testing.assert_allclose(sub_models[0].data, result.data[0:2, 1:4], rtol=1e-5)
+    np.testing.assert_allclose(sub_models[1].data, result.data[3:8, 4:7], rtol=1e-5)
+    assert (sub_models[1].meta.subarray.xstart, sub_models[1].meta.subarray.ystart) == (5, 4)
+    assert sub_models[1].meta.subarray.detxsize == 7
+
+    # Windows outside the detector
+    with pytest.raises(ValueError):
+        FitRampStep(windows=[[6, 1, 3, 2]]).run(ramp_model)
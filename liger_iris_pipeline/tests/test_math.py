@@ -0,0 +1,126 @@
+# Imports
+import numpy as np
+import astropy.stats
+from liger_iris_pipeline.utils import math
+
+
+def test_select_median():
+    rng = np.random.default_rng(1)
+    work = np.empty(64, dtype=np.float64)
+    for n in (1, 2, 7, 8, 33, 64):
+        for x in (rng.normal(size=n), rng.integers(0, 3, n).astype(np.float64)):
+
+            # Quickselect in a reused workspace matches the sorted references
+            work[:n] = x
+            assert math.median_inplace(work, n) == np.median(x)
+            for k in (0, n // 2, n - 1):
+                work[:n] = x
+                assert math.select_kth(work, k, n) == np.sort(x)[k]
+                assert np.all(work[:k] <= work[k]) and np.all(work[k + 1:n] >= work[k])
+            for q in (0, 12.5, 50, 90, 100):
+                work[:n] = x
+                np.testing.assert_allclose(math.percentile_select(work, n, q), np.percentile(x, q), rtol=1e-12)
+
+    # NaNs are ignored and the data is not modified
+    x = rng.normal(size=21)
+    x[[3, 10]] = np.nan
+    x_copy = x.copy()
+    assert math.nanmedian_select(x, work) == np.nanmedian(x)
+    np.testing.assert_array_equal(x, x_copy)
+    assert np.isnan(math.nanmedian_select(np.full(3, np.nan)))
+
+
+def test_biweight():
+    rng = np.random.default_rng(2)
+    work = np.empty(100, dtype=np.float64)
+    for n in (10, 11, 100):
+        x = rng.normal(10, 2, n)
+        x[:3] = [100, -50, 30]
+
+        # The selection-based statistics match astropy
+        np.testing.assert_allclose(math.median_absolute_deviation(x, work=work), astropy.stats.median_absolute_deviation(x), rtol=1e-12)
+        np.testing.assert_allclose(math.biweight_location(x, work=work), astropy.stats.biweight_location(x, c=6.0), rtol=1e-12)
+        np.testing.assert_allclose(
+            math.biweight_midvariance(x, work=work),
+            astropy.stats.biweight_midvariance(x, c=9.0, modify_sample_size=True), rtol=1e-10
+        )
+
+        # NaNs are ignored
+        x[5] = np.nan
+        np.testing.assert_allclose(math.median_absolute_deviation(x), astropy.stats.median_absolute_deviation(x, ignore_nan=True), rtol=1e-12)
+        np.testing.assert_allclose(math.biweight_location(x), astropy.stats.biweight_location(x, c=6.0, ignore_nan=True), rtol=1e-12)
+
+    # Constant data
+    assert math.biweight_location(np.ones(5)) == 1
+    assert math.biweight_midvariance(np.ones(5)) == 0
+
+
+def reference_weighted_quantile(values, weights, q):
+    """
+    Weighted quantile by a full sort, see `math.weighted_quantile`.
+    """
+    order = np.argsort(values, kind='stable')
+    values, cumulative = values[order], np.cumsum(weights[order])
+    target = q * cumulative[-1]
+    k = np.searchsorted(cumulative, target)
+    if cumulative[k] == target and k < len(values) - 1:
+        return (values[k] + values[k + 1]) / 2
+    return values[k]
+
+
+def test_weighted_quantile():
+    rng = np.random.default_rng(3)
+    for n in (1, 2, 5, 16, 51):
+        for q in (0.1, 0.5, 0.9):
+            values = rng.normal(size=n)
+            weights = rng.uniform(0.1, 2, n)
+            expected = reference_weighted_quantile(values, weights, q)
+            assert math.weighted_quantile(values, weights, q) == expected
+            assert math.weighted_quantile_select(values.copy(), weights.copy(), n, q) == expected
+
+    # Ties and equal weights, where the cumulative weight reaches the target exactly
+    values = np.array([3.0, 1.0, 2.0, 2.0, 4.0, 1.0])
+    weights = np.ones(6)
+    assert math.weighted_quantile(values, weights, 0.5) == reference_weighted_quantile(values, weights, 0.5) == 2
+    assert math.weighted_quantile(np.array([3.0, 1.0, 2.0, 4.0]), weights[:4], 0.5) == 2.5
+
+
+def test_frame_stats():
+    rng = np.random.default_rng(4)
+    cube = rng.normal(10, 2, (2, 150, 100)).astype(np.float32)
+    cube[0, :5] = 1000
+    cube[1, 10, :50] = np.nan
+    dq = np.zeros(cube.shape, dtype=np.uint32)
+    dq[:, 20, 20:80] = 1
+    percentiles = (0, 10, 50, 97.5, 100)
+
+    # References of the good values of each frame
+    result = math.frame_stats(cube, dq, stats=math.FRAME_STATS, percentiles=percentiles)
+    for f in range(len(cube)):
+        good = cube[f][np.isfinite(cube[f]) & (dq[f] == 0)].astype(np.float64)
+        assert result['n_good'][f] == good.size
+        np.testing.assert_allclose(result['mean'][f], np.mean(good), rtol=1e-10)
+        np.testing.assert_allclose(result['median'][f], np.median(good), rtol=1e-6)
+        np.testing.assert_allclose(result['percentiles'][f], np.percentile(good, percentiles), rtol=1e-6)
+        np.testing.assert_allclose(result['biweight_location'][f], astropy.stats.biweight_location(good, c=6.0), rtol=1e-6)
+        np.testing.assert_allclose(
+            result['biweight_scale'][f], np.sqrt(astropy.stats.biweight_midvariance(good, c=9.0, modify_sample_size=True)), rtol=1e-6
+        )
+        np.testing.assert_allclose(
+            result['sigma_clipped_mean'][f], astropy.stats.sigma_clipped_stats(good, sigma=3.0, maxiters=5)[0], rtol=1e-6
+        )
+
+    # Parallel within frames, as used for fewer frames than threads, for any number of chunks
+    codes = np.arange(len(math.FRAME_STATS), dtype=np.int64)
+    qs = np.array(percentiles, dtype=np.float64)
+    stats_out, percentiles_out, n_good = np.empty((2, len(codes))), np.empty((2, qs.size)), np.empty(2, dtype=np.int64)
+    for n_chunks in (1, 7, 64):
+        math._frame_stats_chunked(cube.reshape(2, -1), dq.reshape(2, -1), codes, qs, 3.0, 5, stats_out, percentiles_out, n_good, n_chunks)
+        for k, stat in enumerate(math.FRAME_STATS):
+            np.testing.assert_allclose(stats_out[:, k], result[stat], rtol=1e-6)
+        np.testing.assert_allclose(percentiles_out, result['percentiles'], rtol=1e-6)
+        np.testing.assert_array_equal(n_good, result['n_good'])
+
+    # A single frame
+    result_frame = math.frame_stats(cube[1], dq[1], stats=('median',))
+    assert result_frame['median'][0] == result['median'][1]
@@ -0,0 +1,55 @@
+# Imports
+import numpy as np
+from liger_iris_pipeline import datamodels
+from liger_iris_pipeline.readout import NonlinearCorrectionStep
+from liger_iris_pipeline.tests.utils import create_ramp, get_meta
+
+
+def make_ramp_nonlin():
+    source = np.full((6, 5), 3000.0, dtype=np.float32)
+    ramp_model = create_ramp(source, readtime=1.0, n_reads_per_group=8, n_groups=2, read_noise=0, poisson_noise=False)
+    ramp_model.meta.instrument.name = 'Liger'
+    ramp_model.meta.instrument.mode = 'IMG'
+    ramp_model.meta.instrument.filter = 'J'
+    get_meta(ramp_model)
+    coeffs = np.zeros((6, 5, 3), dtype=np.float32)
+    coeffs[..., 0] = 0.5
+    coeffs[..., 1] = 1
+    coeffs[..., 2] = 1E-4
+    return ramp_model, datamodels.NonlinearCorrectionModel(coeffs=coeffs)
+
+
+def test_nonlinear_correction(tmp_path):
+    ramp_model, nonlin_model = make_ramp_nonlin()
+
+    # Reference: the polynomial in float64, clipped to the uint16 range and truncated
+    x = ramp_model.data.astype(np.float64)
+    c = nonlin_model.coeffs.astype(np.float64)[:, :, None, None, :]
+    expected = np.clip(c[..., 0] + c[..., 1] * x + c[..., 2] * x**2, 0, 65535).astype(np.uint16)
+    assert np.any(c[..., 0] + c[..., 1] * x + c[..., 2] * x**2 > 65535)
+
+    # Copy
+    result = NonlinearCorrectionStep(nonlin=nonlin_model).run(ramp_model)
+    np.testing.assert_array_equal(result.data, expected)
+    assert not np.array_equal(ramp_model.data, expected)
+
+    # Read-major layout
+    ramp_model_rm = ramp_model.copy()
+    ramp_model_rm.to_read_major()
+    result = NonlinearCorrectionStep(nonlin=nonlin_model).run(ramp_model_rm)
+    result.to_pixel_major()
+    np.testing.assert_array_equal(result.data, expected)
+
+    # In place from a file, the returned model is still open and can be saved
+    filepath = str(tmp_path / 'ramp.fits')
+    ramp_model.save(filepath)
+    result = NonlinearCorrectionStep(nonlin=nonlin_model, in_place=True).run(filepath)
+    np.testing.assert_array_equal(result.data, expected)
+    result.save(str(tmp_path / 'ramp_corrected.fits'))
+    with datamodels.RampModel(str(tmp_path / 'ramp_corrected.fits')) as saved:
+        np.testing.assert_array_equal(saved.data, expected)
+
+    # In place on a model returns the same model
+    result = NonlinearCorrectionStep(nonlin=nonlin_model, in_place=True).run(ramp_model)
+    assert result is ramp_model
+    np.testing.assert_array_equal(ramp_model.data, expected)
@@ -31,3 +31,33 @@ def test_normalize_step():
 
         # Test
         np.testing.assert_allclose(step_output.data, expected_output_data, rtol=1e-6)
+
+
+def test_normalize_step_masked():
+    # NaNs and pixels flagged in the DQ array are ignored by the statistics
+    rng = np.random.default_rng(1)
+    data = rng.uniform(1, 2, (256, 256)).astype(np.float32)
+    dq = np.zeros(data.shape, dtype=np.uint32)
+    data[:20] = 100
+    dq[:20] = 1
+    data[30, :10] = np.nan
+    input_model = datamodels.ImagerModel(data=data, dq=dq, err=np.ones_like(data))
+    good = data[(dq == 0) & np.isfinite(data)]
+    for method, norm in (("median", np.median(good)), ("mean", np.mean(good.astype(np.float64)))):
+        step_output = liger_iris_pipeline.NormalizeStep(method=method).run(input_model)
+        np.testing.assert_allclose(step_output.data, data / norm, rtol=1e-6)
+        np.testing.assert_allclose(step_output.err, 1 / norm, rtol=1e-6)
+
+
+def test_normalize_step_cube():
+    # A cube is normalized by one statistic over all of its pixels
+    rng = np.random.default_rng(2)
+    data = np.concatenate([
+        rng.uniform(level, level + 1e-3, (1, 64, 64)) for level in (0, 10, 20)
+    ]).astype(np.float32)
+    input_model = datamodels.IFUCubeModel(
+        data=data, dq=np.zeros(data.shape, dtype=np.uint32), err=np.ones_like(data)
+    )
+    for method, norm in (("median", np.median(data)), ("mean", np.mean(data.astype(np.float64)))):
+        step_output = liger_iris_pipeline.NormalizeStep(method=method).run(input_model)
+        np.testing.assert_allclose(step_output.data, data / norm, rtol=1e-6)
@@ -1,6 +1,8 @@
 # Imports
 import liger_iris_pipeline
+import os
 import numpy as np
+from liger_iris_pipeline.readout import fit_ramps_ols
 from liger_iris_pipeline.tests.utils import create_ramp, get_meta
 from liger_iris_pipeline.utils.gdrive import download_gdrive_file
 
@@ -36,4 +38,79 @@ def test_imager_stage1(tmp_path):
     pipeline.ramp_fit.method = "cds"
     pipeline.ramp_fit.num_coadd = 1 # Redundant but explicit
     model_result = pipeline.run([ramp_model])[0]
-    np.testing.assert_allclose(model_result.data, source, rtol=1e-6)
\ No newline at end of file
+    np.testing.assert_allclose(model_result.data, source, rtol=1e-6)
+
+def test_imager_stage1_fused():
+
+    # Ramp and a quadratic nonlinearity model
+    source = np.full((6, 5), 100.0, dtype=np.float32)
+    ramp_model = create_ramp(source, readtime=1.0, n_reads_per_group=6, n_groups=2, read_noise=0, nonlin_coeffs=None, poisson_noise=False)
+    ramp_model.meta.instrument.name = 'Liger'
+    ramp_model.meta.instrument.mode = 'IMG'
+    ramp_model.meta.instrument.filter = 'J'
+    get_meta(ramp_model)
+    coeffs = np.zeros((6, 5, 3), dtype=np.float32)
+    coeffs[..., 1] = 1
+    coeffs[..., 2] = 1E-4
+    nonlin_model = liger_iris_pipeline.datamodels.NonlinearCorrectionModel(coeffs=coeffs)
+
+    # The fused fit matches the fit of the linearized reads
+    pipeline = liger_iris_pipeline.Stage1Pipeline()
+    pipeline.fuse_nonlin = True
+    pipeline.nonlin_corr.nonlin = nonlin_model
+    model_result = pipeline.run([ramp_model])[0]
+    ramps = ramp_model.data.astype(np.float64)
+    ramps_corr = coeffs[..., 0, None, None] + coeffs[..., 1, None, None] * ramps + coeffs[..., 2, None, None] * ramps**2
+    slope, _ = fit_ramps_ols(ramp_model.times, ramps_corr)
+    np.testing.assert_allclose(model_result.data, slope, rtol=1e-6)
+    slope_fused = model_result.data
+
+    # Skipping the nonlinearity correction fits the raw reads
+    pipeline.nonlin_corr.skip = True
+    model_result = pipeline.run([ramp_model])[0]
+    slope, _ = fit_ramps_ols(ramp_model.times, ramp_model.data)
+    np.testing.assert_allclose(model_result.data, slope, rtol=1e-6)
+    assert not np.allclose(model_result.data, slope_fused)
+
+
+def test_imager_stage1_concurrent(tmp_path):
+
+    # Exposures on disk
+    filepaths = []
+    for i in range(3):
+        source = np.full((6, 5), 100.0 * (i + 1), dtype=np.float32)
+        ramp_model = create_ramp(source, readtime=1.0, n_reads_per_group=6, n_groups=1, read_noise=0, nonlin_coeffs=None, poisson_noise=False)
+        ramp_model.meta.instrument.name = 'Liger'
+        ramp_model.meta.instrument.mode = 'IMG'
+        ramp_model.meta.instrument.filter = 'J'
+        ramp_model.meta.exposure.jd_start = 2460000.5
+        ramp_model.meta.exposure.exposure_number = i + 1
+        get_meta(ramp_model)
+        filepaths.append(str(tmp_path / f'ramp_{i}.fits'))
+        ramp_model.save(filepaths[-1])
+    coeffs = np.zeros((6, 5, 2), dtype=np.float32)
+    coeffs[..., 1] = 1
+    nonlin_model = liger_iris_pipeline.datamodels.NonlinearCorrectionModel(coeffs=coeffs)
+
+    # Serial
+    pipeline = liger_iris_pipeline.Stage1Pipeline()
+    pipeline.fuse_nonlin = True
+    pipeline.nonlin_corr.nonlin = nonlin_model
+    results = pipeline.run(filepaths)
+
+    # Prefetched reads and background saves, each result is finalized once
+    pipeline.n_workers = 2
+    pipeline.save_results = True
+    pipeline.output_dir = str(tmp_path / 'out')
+    finalized = []
+    finalize_result = pipeline.finalize_result
+    def finalize_result_counted(result, *args, **kwargs):
+        finalized.append(result)
+        return finalize_result(result, *args, **kwargs)
+    pipeline.finalize_result = finalize_result_counted
+    results_concurrent = pipeline.run(filepaths)
+    assert len(finalized) == len(filepaths)
+    assert all(any(result is f for f in finalized) for result in results_concurrent)
+    for result, result_concurrent in zip(results, results_concurrent):
+        np.testing.assert_array_equal(result_concurrent.data, result.data)
+        assert os.path.exists(result_concurrent._filepath)
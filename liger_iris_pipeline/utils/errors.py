@@ -58,4 +58,62 @@ def measure_error(data : np.ndarray, error : np.ndarray, dq : np.ndarray) -> flo
     elif n_good == 1:
         return error[mask][0]
     else:
-        return _measure_error(data[mask], error[mask])
\ No newline at end of file
+        return _measure_error(data[mask], error[mask])
+
+
+@njit(nogil=True)
+def measure_error_n(data : np.ndarray, error : np.ndarray, n : int) -> float:
+    """
+    `measure_error` of the first n values, which are all good, without temporaries.
+
+    Args:
+        data (np.ndarray): The data array.
+        error (np.ndarray): The error array.
+        n (int): Number of good values at the start of data and error.
+
+    Returns:
+        float: The measured error.
+    """
+    if n == 0:
+        return np.nan
+    elif n == 1:
+        return error[0]
+
+    # Normalized weights and weighted mean
+    sum_w = 0.0
+    sum_wx = 0.0
+    for i in range(n):
+        w = 1 / error[i]**2
+        sum_w += w
+        sum_wx += w * data[i]
+    M = sum_wx / sum_w
+
+    # Weighted variance with the bias correction of math.weighted_stddev
+    sum_w2 = 0.0
+    sum_wd2 = 0.0
+    for i in range(n):
+        w = 1 / error[i]**2 / sum_w
+        sum_w2 += w * w
+        sum_wd2 += w * (data[i] - M)**2
+    var = sum_wd2 / (1.0 - sum_w2)
+    return np.sqrt(var) / np.sqrt(n - 1)
+
+
+@njit(nogil=True)
+def propagate_error_n(error : np.ndarray, n : int) -> float:
+    """
+    `propagate_error` of the first n values, which are all good, without temporaries.
+
+    Args:
+        error (np.ndarray): The error array.
+        n (int): Number of good values at the start of error.
+
+    Returns:
+        float: The propagated error.
+    """
+    if n == 0:
+        return np.nan
+    sum_w = 0.0
+    for i in range(n):
+        sum_w += 1 / error[i]**2
+    return sum_w**-0.5
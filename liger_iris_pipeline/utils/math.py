@@ -1,5 +1,8 @@
 import numpy as np
-from numba import njit
+import numba
+from numba import njit, prange
+
+from .parallel import numba_threads
 
 @njit(nogil=True)
 def weighted_mean(x, w):
@@ -55,38 +58,114 @@ def weighted_stddev(x : np.ndarray, w : np.ndarray, M : float | None = None):
 
 @njit
 def weighted_quantile(values : np.ndarray, weights : np.ndarray, q : float = 0.5):
+    """
+    Weighted quantile of an array, the smallest value whose cumulative weight in sorted order reaches q times the total weight.
+    If the cumulative weight equals the target exactly, the mean of that and the next value is returned.
 
-    if len(values.shape) > 1:
-        values = values.ravel()
-        weights = weights.ravel()
-    
-    # Handle edge cases for q=0 and q=1
+    Args:
+        values (np.ndarray): Array of values.
+        weights (np.ndarray): Array of weights, same shape as values.
+        q (float): The quantile in [0, 1].
+
+    Returns:
+        float: The weighted quantile.
+    """
+    values = values.ravel().copy()
+    weights = weights.ravel().copy()
+    return weighted_quantile_select(values, weights, values.size, q)
+
+
+@njit(nogil=True)
+def weighted_quantile_select(values : np.ndarray, weights : np.ndarray, n : int, q : float = 0.5):
+    """
+    Weighted quantile of values[:n] by weighted quickselect, without sorting or allocating.
+    Gives the same result as `weighted_quantile`. values and weights are partially reordered in place (as pairs).
+
+    Args:
+        values (np.ndarray): 1D work array of values, modified in place.
+        weights (np.ndarray): 1D work array of weights, modified in place.
+        n (int): Number of values at the start of values and weights.
+        q (float): The quantile in [0, 1].
+
+    Returns:
+        float: The weighted quantile, NaN if n is 0.
+    """
+    if n == 0:
+        return np.nan
+
+    # Edge cases for q=0 and q=1, and no weight
+    vmin = values[0]
+    vmax = values[0]
+    total = 0.0
+    for i in range(n):
+        vmin = min(vmin, values[i])
+        vmax = max(vmax, values[i])
+        total += weights[i]
     if q == 0:
-        return np.min(values)
+        return vmin
     if q == 1:
-        return np.max(values)
-    
-    sorted_indices = np.argsort(values)
-    sorted_values = values[sorted_indices]
-    sorted_weights = weights[sorted_indices]
-    
-    total_weight = np.sum(sorted_weights)
-    target_weight = q * total_weight
-    
-    weight_sum = 0.0
-    i = 0
-    
-    while i < len(sorted_weights) and weight_sum < target_weight:
-        weight_sum += sorted_weights[i]
-        i += 1
-    
-    if weight_sum == target_weight and i < len(sorted_weights):
-        return (sorted_values[i-1] + sorted_values[i]) / 2.0
-    elif i > 0:
-        return sorted_values[i-1]
-    else:
-        return sorted_values[0]
-    
+        return vmax
+    target = q * total
+    if not target > 0:
+        return (vmax + vmin) / 2.0
+
+    # acc is the weight of all values below the window [lo, hi], which stays below the target
+    lo = 0
+    hi = n - 1
+    acc = 0.0
+    while lo <= hi:
+
+        # Median of three pivot
+        mid = (lo + hi) // 2
+        a, b, c = values[lo], values[mid], values[hi]
+        pivot = max(min(a, b), min(max(a, b), c))
+
+        # Three-way partition into [lo, lt) < pivot, [lt, gt] == pivot, (gt, hi] > pivot
+        lt = lo
+        i = lo
+        gt = hi
+        while i <= gt:
+            if values[i] < pivot:
+                values[lt], values[i] = values[i], values[lt]
+                weights[lt], weights[i] = weights[i], weights[lt]
+                lt += 1
+                i += 1
+            elif values[i] > pivot:
+                values[gt], values[i] = values[i], values[gt]
+                weights[gt], weights[i] = weights[i], weights[gt]
+                gt -= 1
+            else:
+                i += 1
+
+        # Continue in the lower partition if it reaches the target
+        w_less = 0.0
+        for k in range(lo, lt):
+            w_less += weights[k]
+        if lt > lo and acc + w_less >= target:
+            hi = lt - 1
+            continue
+        acc += w_less
+
+        # Walk the values equal to the pivot
+        for k in range(lt, gt + 1):
+            acc += weights[k]
+            if acc >= target:
+                if acc == target and k < n - 1:
+                    # The next value in sorted order
+                    if k < gt:
+                        upper = pivot
+                    else:
+                        upper = values[gt + 1]
+                        for kk in range(gt + 2, n):
+                            upper = min(upper, values[kk])
+                    return (pivot + upper) / 2.0
+                return pivot
+
+        # Continue in the upper partition
+        lo = gt + 1
+
+    # The target is not reached due to rounding
+    return vmax
 
 
 @njit
@@ -169,28 +248,223 @@ def robust_mean(x, w=None, n_sigma=4):
     
 
 @njit(nogil=True)
-def median_absolute_deviation(data : np.ndarray, M : float | None = None):
+def select_kth(a : np.ndarray, k : int, n : int):
+    """
+    Partially sort a[:n] in place (quickselect, like C++ nth_element) so a[k] is the k-th smallest value,
+    all values in a[:k] are <= a[k] and all values in a[k+1:n] are >= a[k].
+
+    Args:
+        a (np.ndarray): 1D work array, modified in place.
+        k (int): The rank to select, 0 <= k < n.
+        n (int): Number of values at the start of a to select from.
+
+    Returns:
+        The k-th smallest value.
+    """
+    lo = 0
+    hi = n - 1
+    while hi > lo:
+        # Median of three pivot
+        mid = (lo + hi) // 2
+        if a[mid] < a[lo]:
+            a[mid], a[lo] = a[lo], a[mid]
+        if a[hi] < a[lo]:
+            a[hi], a[lo] = a[lo], a[hi]
+        if a[hi] < a[mid]:
+            a[hi], a[mid] = a[mid], a[hi]
+        pivot = a[mid]
+
+        # Hoare partition
+        i = lo
+        j = hi
+        while i <= j:
+            while a[i] < pivot:
+                i += 1
+            while a[j] > pivot:
+                j -= 1
+            if i <= j:
+                a[i], a[j] = a[j], a[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return a[k]
+
+
+@njit(nogil=True)
+def median_inplace(a : np.ndarray, n : int) -> float:
+    """
+    Median of a[:n] by quickselect. a is partially sorted in place, no memory is allocated.
+
+    Args:
+        a (np.ndarray): 1D work array without NaNs, modified in place.
+        n (int): Number of values at the start of a.
+
+    Returns:
+        float: The median, NaN if n is 0.
+    """
+    if n == 0:
+        return np.nan
+    half = n // 2
+    upper = select_kth(a, half, n)
+    if n % 2 == 1:
+        return upper
+
+    # The lower middle value is the largest value of the lower partition
+    lower = a[0]
+    for i in range(1, half):
+        if a[i] > lower:
+            lower = a[i]
+    return (lower + upper) / 2
+
+
+@njit(nogil=True)
+def percentile_select(a : np.ndarray, n : int, q : float) -> float:
+    """
+    The q-th percentile of a[:n] with linear interpolation as in np.percentile, by quickselect.
+    a is partially sorted in place, no memory is allocated.
+
+    Args:
+        a (np.ndarray): 1D work array without NaNs, modified in place.
+        n (int): Number of values at the start of a, n > 0.
+        q (float): Percentile in [0, 100].
+
+    Returns:
+        float: The percentile.
+    """
+    pos = q / 100 * (n - 1)
+    k = int(np.floor(pos))
+    frac = pos - k
+    x_k = select_kth(a, k, n)
+    if frac == 0 or k + 1 >= n:
+        return x_k
+
+    # The next order statistic is the minimum of the upper partition
+    x_next = a[k + 1]
+    for i in range(k + 2, n):
+        if a[i] < x_next:
+            x_next = a[i]
+    return x_k + frac * (x_next - x_k)
+
+
+@njit(nogil=True)
+def sigma_clipped_mean_inplace(a : np.ndarray, n : int, sigma : float = 3.0, maxiters : int = 5) -> float:
+    """
+    Mean of a[:n] after iteratively rejecting values more than sigma standard deviations from the median,
+    as `astropy.stats.sigma_clipped_stats` (cenfunc='median', stdfunc='std').
+    The medians are found by quickselect and the kept values are compacted to the start of a in place.
+
+    Args:
+        a (np.ndarray): 1D work array without NaNs, modified in place.
+        n (int): Number of values at the start of a.
+        sigma (float): Number of standard deviations for clipping.
+        maxiters (int): Maximum number of clipping iterations.
+
+    Returns:
+        float: The sigma clipped mean, NaN if n is 0.
+    """
+    for _ in range(maxiters):
+        if n == 0:
+            break
+        mean = 0.0
+        for i in range(n):
+            mean += a[i]
+        mean /= n
+        var = 0.0
+        for i in range(n):
+            var += (a[i] - mean)**2
+        stddev = np.sqrt(var / n)
+        M = median_inplace(a, n)
+        n_kept = 0
+        for i in range(n):
+            if a[i] >= M - sigma * stddev and a[i] <= M + sigma * stddev:
+                a[n_kept] = a[i]
+                n_kept += 1
+        if n_kept == n:
+            break
+        n = n_kept
+    if n == 0:
+        return np.nan
+    mean = 0.0
+    for i in range(n):
+        mean += a[i]
+    return mean / n
+
+
+@njit(nogil=True)
+def nanmedian_select(data : np.ndarray, work : np.ndarray | None = None) -> float:
+    """
+    Median ignoring NaNs like np.nanmedian, by quickselect in a reusable workspace instead of sorting a copy.
+
+    Args:
+        data (np.ndarray): Array of values, not modified.
+        work (np.ndarray | None): Float64 workspace with at least data.size elements. None allocates one.
+
+    Returns:
+        float: The median, NaN if there are no finite values.
+    """
+    data = data.ravel()
+    if work is None:
+        work = np.empty(data.size, dtype=np.float64)
+    n = 0
+    for i in range(data.size):
+        if not np.isnan(data[i]):
+            work[n] = data[i]
+            n += 1
+    return median_inplace(work, n)
+
+
+@njit(nogil=True)
+def median_absolute_deviation(data : np.ndarray, M : float | None = None, work : np.ndarray | None = None):
+    """
+    Median absolute deviation ignoring NaNs, by quickselect in a reusable workspace.
+
+    Args:
+        data (np.ndarray): Array of values, not modified.
+        M (float | None): The center. None uses the median.
+        work (np.ndarray | None): Float64 workspace with at least data.size elements. None allocates one.
+
+    Returns:
+        float: The median absolute deviation.
+    """
+    data = data.ravel()
+    if work is None:
+        work = np.empty(data.size, dtype=np.float64)
     if M is None:
-        M = np.nanmedian(data)
-    return np.nanmedian(np.abs(data - M))
+        M = nanmedian_select(data, work)
+    n = 0
+    for i in range(data.size):
+        if not np.isnan(data[i]):
+            work[n] = np.abs(data[i] - M)
+            n += 1
+    return median_inplace(work, n)
 
 
 @njit(nogil=True)
 def biweight_location(
     data : np.ndarray,
     c : float | None = 6.0,
-    M : float | None = None
+    M : float | None = None,
+    work : np.ndarray | None = None
 ) -> float:
     
     # Flatten
     data = data.ravel()
 
+    # Workspace for the medians
+    if work is None:
+        work = np.empty(data.size, dtype=np.float64)
+
     # Median value
     if M is None:
-        M = np.nanmedian(data)
+        M = nanmedian_select(data, work)
 
     # MAD
-    mad = median_absolute_deviation(data, M)
+    mad = median_absolute_deviation(data, M, work)
     if mad == 0.0 or not np.isfinite(mad):
         return M
 
@@ -221,35 +495,39 @@ def biweight_midvariance(
     data : np.ndarray,
     c : float = 9.0,
     M : float | None = None,
+    work : np.ndarray | None = None
 ) -> float:
     
     # Flatten
     data = data.ravel()
 
+    # Workspace for the medians
+    if work is None:
+        work = np.empty(data.size, dtype=np.float64)
+
     # Median value
     if M is None:
-        M = np.nanmedian(data)
+        M = nanmedian_select(data, work)
 
-    # Center the data
-    d = data - M
-    mad_val = median_absolute_deviation(data, M)
+    # MAD
+    mad_val = median_absolute_deviation(data, M, work)
 
     if mad_val == 0.0 or not np.isfinite(mad_val):
         return mad_val
 
-    u = d / (c * mad_val)
-    u2 = u * u
-
-    good = np.where((np.abs(u) < 1.0) & np.isfinite(u))[0]
-    n_good = len(good)
-
-    f1 = 0
-    f2 = 0
-    for i in range(n_good):
-        ii = good[i]
-        t = 1 - u2[ii]
-        f1 += d[ii] * d[ii] * t ** 4
-        f2 += t * (1.0 - 5.0 * u2[ii])
+    # Single pass over the centered data
+    n_good = 0
+    f1 = 0.0
+    f2 = 0.0
+    for i in range(data.size):
+        d = data[i] - M
+        u = d / (c * mad_val)
+        if np.abs(u) < 1.0 and np.isfinite(u):
+            u2 = u * u
+            t = 1 - u2
+            f1 += d * d * t ** 4
+            f2 += t * (1.0 - 5.0 * u2)
+            n_good += 1
     return n_good * f1 / (f2 * f2)
 
 
@@ -274,4 +552,397 @@ def all_sc(arr : np.ndarray) -> bool:
             continue
         else:
             return False
-    return True
\ No newline at end of file
+    return True
+
+
+# Statistics computed by frame_stats
+FRAME_STATS = ('mean', 'median', 'biweight_location', 'biweight_scale', 'sigma_clipped_mean')
+
+# Minimum number of pixels per chunk and number of histogram bins for the within-frame parallel statistics
+_MIN_CHUNK_SIZE = 4096
+_SELECT_BINS = 4096
+
+
+def frame_stats(
+    cube : np.ndarray,
+    dq : np.ndarray | None = None,
+    stats : tuple[str] = ('median',),
+    percentiles : tuple[float] | None = None,
+    sigma : float = 3.0,
+    maxiters : int = 5,
+    n_threads : int | None = None
+) -> dict[str, np.ndarray]:
+    """
+    Robust statistics of each frame of a stack in one parallel call, ignoring NaNs and pixels flagged in dq.
+    The good values of each frame are gathered once, and medians, percentiles and MADs are found by quickselect
+    in O(N) instead of sorting. Each thread holds one frame of good values (in the data type) and a float64 workspace.
+    With fewer frames than threads (e.g. a single frame), each frame is instead split into chunks processed in parallel,
+    and order statistics are found by a parallel histogram of the values followed by a quickselect within one bin.
+
+    Args:
+        cube (np.ndarray): Stack of frames with shape (n_frames, ny, nx), or a single frame with shape (ny, nx).
+        dq (np.ndarray | None): DQ flags with the same shape, pixels with dq > 0 are ignored.
+        stats (tuple[str]): Statistics to compute, any of FRAME_STATS:
+            - 'mean' : Mean.
+            - 'median' : Median.
+            - 'biweight_location' : Biweight location, see `biweight_location`.
+            - 'biweight_scale' : Square root of the biweight midvariance, see `biweight_midvariance`.
+            - 'sigma_clipped_mean' : Sigma clipped mean, see `sigma_clipped_mean_inplace`.
+        percentiles (tuple[float] | None): Percentiles in [0, 100] to compute, with linear interpolation as in np.percentile.
+        sigma (float): Number of standard deviations for 'sigma_clipped_mean'.
+        maxiters (int): Maximum number of clipping iterations for 'sigma_clipped_mean'.
+        n_threads (int | None): Number of threads. None uses all available cores, 1 runs serially.
+
+    Returns:
+        dict[str, np.ndarray]: Each requested statistic with shape (n_frames,), 'percentiles' with shape (n_frames, n_percentiles)
+            if requested, and the number of good values 'n_good'. Statistics of frames without good values are NaN.
+    """
+    for stat in stats:
+        if stat not in FRAME_STATS:
+            raise ValueError(f"Unknown statistic: {stat}")
+    cube = np.asarray(cube)
+    n_frames = 1 if cube.ndim == 2 else cube.shape[0]
+    cube = cube.reshape(n_frames, -1)
+    if dq is not None:
+        dq = np.asarray(dq).reshape(n_frames, -1)
+    codes = np.array([FRAME_STATS.index(stat) for stat in stats], dtype=np.int64)
+    qs = np.array([] if percentiles is None else percentiles, dtype=np.float64)
+    stats_out = np.empty((n_frames, len(FRAME_STATS)), dtype=np.float64)
+    percentiles_out = np.empty((n_frames, qs.size), dtype=np.float64)
+    n_good = np.empty(n_frames, dtype=np.int64)
+    with numba_threads(n_threads):
+        n_threads = numba.get_num_threads()
+        if n_frames < n_threads:
+            # Too few frames to keep the threads busy, parallelize within each frame instead
+            n_chunks = max(1, min(4 * n_threads, cube.shape[1] // _MIN_CHUNK_SIZE))
+            _frame_stats_chunked(cube, dq, codes, qs, float(sigma), int(maxiters), stats_out, percentiles_out, n_good, n_chunks)
+        else:
+            _frame_stats(cube, dq, codes, qs, float(sigma), int(maxiters), stats_out, percentiles_out, n_good)
+    out = {stat: stats_out[:, FRAME_STATS.index(stat)] for stat in stats}
+    if percentiles is not None:
+        out['percentiles'] = percentiles_out
+    out['n_good'] = n_good
+    return out
+
+
+@njit(nogil=True, parallel=True)
+def _frame_stats(cube, dq, codes, qs, sigma, maxiters, stats_out, percentiles_out, n_good):
+    n_frames, n_pix = cube.shape
+    for f in prange(n_frames):
+
+        # Thread-local good values of this frame and workspace for the MADs
+        values = np.empty(n_pix, dtype=cube.dtype)
+        work = np.empty(n_pix, dtype=np.float64)
+        n = 0
+        for i in range(n_pix):
+            if np.isfinite(cube[f, i]) and (dq is None or dq[f, i] == 0):
+                values[n] = cube[f, i]
+                n += 1
+        n_good[f] = n
+        stats_out[f, :] = np.nan
+        percentiles_out[f, :] = np.nan
+        if n == 0:
+            continue
+        good = values[:n]
+
+        # Statistics that keep the order of the values first, then those that partially sort them in place
+        for code in codes:
+            if code == 0:
+                total = 0.0
+                for i in range(n):
+                    total += good[i]
+                stats_out[f, 0] = total / n
+            elif code == 2:
+                stats_out[f, 2] = biweight_location(good, work=work)
+            elif code == 3:
+                stats_out[f, 3] = np.sqrt(biweight_midvariance(good, work=work))
+        for k in range(qs.size):
+            percentiles_out[f, k] = percentile_select(good, n, qs[k])
+        for code in codes:
+            if code == 1:
+                stats_out[f, 1] = median_inplace(good, n)
+        for code in codes:
+            if code == 4:
+                stats_out[f, 4] = sigma_clipped_mean_inplace(good, n, sigma, maxiters)
+
+
+@njit(nogil=True)
+def _frame_stats_chunked(cube, dq, codes, qs, sigma, maxiters, stats_out, percentiles_out, n_good, n_chunks):
+    """
+    `_frame_stats` with each frame split into n_chunks chunks processed in parallel, for stacks with fewer frames than threads.
+    """
+    n_frames, n_pix = cube.shape
+    values = np.empty(n_pix, dtype=np.float64)
+    work = np.empty(n_pix, dtype=np.float64)
+    work2 = np.empty(n_pix, dtype=np.float64)
+    for f in range(n_frames):
+        n = _gather_good_chunked(cube, dq, f, values, n_chunks)
+        n_good[f] = n
+        stats_out[f, :] = np.nan
+        percentiles_out[f, :] = np.nan
+        if n == 0:
+            continue
+        for code in codes:
+            if code == 0:
+                stats_out[f, 0] = _sum_chunked(values, n, n_chunks) / n
+            elif code == 1:
+                stats_out[f, 1] = _median_chunked(values, n, work, n_chunks)
+            elif code == 2:
+                stats_out[f, 2] = _biweight_location_chunked(values, n, work, work2, n_chunks)
+            elif code == 3:
+                stats_out[f, 3] = np.sqrt(_biweight_midvariance_chunked(values, n, work, work2, n_chunks))
+        for k in range(qs.size):
+            percentiles_out[f, k] = _percentile_chunked(values, n, qs[k], work, n_chunks)
+        for code in codes:
+            if code == 4:
+                stats_out[f, 4] = _sigma_clipped_mean_chunked(values, n, sigma, maxiters, work, work2, n_chunks)
+
+
+@njit(nogil=True)
+def _chunk_bounds(n, n_chunks, c):
+    size = -(-n // n_chunks)
+    return min(c * size, n), min((c + 1) * size, n)
+
+
+@njit(nogil=True, parallel=True)
+def _gather_good_chunked(cube, dq, f, values, n_chunks):
+    """
+    Gather the finite and unflagged values of frame f into values in their original order, in parallel.
+    """
+    n_pix = cube.shape[1]
+    counts = np.zeros(n_chunks, dtype=np.int64)
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n_pix, n_chunks, c)
+        count = 0
+        for i in range(i0, i1):
+            if np.isfinite(cube[f, i]) and (dq is None or dq[f, i] == 0):
+                count += 1
+        counts[c] = count
+    offsets = np.zeros(n_chunks + 1, dtype=np.int64)
+    for c in range(n_chunks):
+        offsets[c + 1] = offsets[c] + counts[c]
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n_pix, n_chunks, c)
+        k = offsets[c]
+        for i in range(i0, i1):
+            if np.isfinite(cube[f, i]) and (dq is None or dq[f, i] == 0):
+                values[k] = cube[f, i]
+                k += 1
+    return offsets[n_chunks]
+
+
+@njit(nogil=True, parallel=True)
+def _sum_chunked(x, n, n_chunks):
+    sums = np.zeros(n_chunks, dtype=np.float64)
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        total = 0.0
+        for i in range(i0, i1):
+            total += x[i]
+        sums[c] = total
+    return np.sum(sums)
+
+
+@njit(nogil=True, parallel=True)
+def _select_kth_chunked(x, n, k, work, n_chunks):
+    """
+    The k-th smallest value of x[:n] without modifying x. A parallel histogram of the values finds the bin of the
+    k-th value, whose values are gathered into work and selected by quickselect.
+    """
+    lows = np.empty(n_chunks, dtype=np.float64)
+    highs = np.empty(n_chunks, dtype=np.float64)
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        lo = np.inf
+        hi = -np.inf
+        for i in range(i0, i1):
+            lo = min(lo, x[i])
+            hi = max(hi, x[i])
+        lows[c] = lo
+        highs[c] = hi
+    lo = np.min(lows)
+    hi = np.max(highs)
+    if lo == hi:
+        return lo
+
+    # Bin counts of each chunk, the bins are monotonic in the values
+    scale = _SELECT_BINS / (hi - lo)
+    counts = np.zeros((n_chunks, _SELECT_BINS), dtype=np.int64)
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        for i in range(i0, i1):
+            counts[c, min(int((x[i] - lo) * scale), _SELECT_BINS - 1)] += 1
+
+    # The bin of the k-th value
+    below = 0
+    b = 0
+    for b in range(_SELECT_BINS):
+        count = 0
+        for c in range(n_chunks):
+            count += counts[c, b]
+        if below + count > k:
+            break
+        below += count
+
+    # Gather the values of the bin and select within them
+    offsets = np.zeros(n_chunks + 1, dtype=np.int64)
+    for c in range(n_chunks):
+        offsets[c + 1] = offsets[c] + counts[c, b]
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        j = offsets[c]
+        for i in range(i0, i1):
+            if min(int((x[i] - lo) * scale), _SELECT_BINS - 1) == b:
+                work[j] = x[i]
+                j += 1
+    return select_kth(work, k - below, offsets[n_chunks])
+
+
+@njit(nogil=True)
+def _median_chunked(x, n, work, n_chunks):
+    """
+    `median_inplace` of x[:n] in parallel, without modifying x.
+    """
+    half = n // 2
+    upper = _select_kth_chunked(x, n, half, work, n_chunks)
+    if n % 2 == 1:
+        return upper
+    return (_select_kth_chunked(x, n, half - 1, work, n_chunks) + upper) / 2
+
+
+@njit(nogil=True)
+def _percentile_chunked(x, n, q, work, n_chunks):
+    """
+    `percentile_select` of x[:n] in parallel, without modifying x.
+    """
+    pos = q / 100 * (n - 1)
+    k = int(np.floor(pos))
+    frac = pos - k
+    x_k = _select_kth_chunked(x, n, k, work, n_chunks)
+    if frac == 0 or k + 1 >= n:
+        return x_k
+    return x_k + frac * (_select_kth_chunked(x, n, k + 1, work, n_chunks) - x_k)
+
+
+@njit(nogil=True, parallel=True)
+def _abs_deviation_chunked(x, n, M, out, n_chunks):
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        for i in range(i0, i1):
+            out[i] = np.abs(x[i] - M)
+
+
+@njit(nogil=True, parallel=True)
+def _biweight_sums_chunked(x, n, M, c_mad, n_chunks):
+    """
+    The sums of the biweight location and midvariance of x[:n] for u = (x - M) / c_mad.
+    """
+    sums = np.zeros((n_chunks, 5), dtype=np.float64)
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        for i in range(i0, i1):
+            d = x[i] - M
+            u = d / c_mad
+            if np.abs(u) < 1.0:
+                u2 = u * u
+                t = 1 - u2
+                sums[c, 0] += d * t * t
+                sums[c, 1] += t * t
+                sums[c, 2] += d * d * t ** 4
+                sums[c, 3] += t * (1.0 - 5.0 * u2)
+                sums[c, 4] += 1
+    out = np.zeros(5, dtype=np.float64)
+    for c in range(n_chunks):
+        out += sums[c]
+    return out
+
+
+@njit(nogil=True)
+def _biweight_location_chunked(x, n, work, work2, n_chunks, c=6.0):
+    """
+    `biweight_location` of x[:n] in parallel.
+    """
+    M = _median_chunked(x, n, work, n_chunks)
+    _abs_deviation_chunked(x, n, M, work2, n_chunks)
+    mad = _median_chunked(work2, n, work, n_chunks)
+    if mad == 0.0 or not np.isfinite(mad):
+        return M
+    sums = _biweight_sums_chunked(x, n, M, c * mad, n_chunks)
+    if sums[1] == 0:
+        return M
+    return M + sums[0] / sums[1]
+
+
+@njit(nogil=True)
+def _biweight_midvariance_chunked(x, n, work, work2, n_chunks, c=9.0):
+    """
+    `biweight_midvariance` of x[:n] in parallel.
+    """
+    M = _median_chunked(x, n, work, n_chunks)
+    _abs_deviation_chunked(x, n, M, work2, n_chunks)
+    mad = _median_chunked(work2, n, work, n_chunks)
+    if mad == 0.0 or not np.isfinite(mad):
+        return mad
+    sums = _biweight_sums_chunked(x, n, M, c * mad, n_chunks)
+    return sums[4] * sums[2] / (sums[3] * sums[3])
+
+
+@njit(nogil=True, parallel=True)
+def _squared_deviation_sum_chunked(x, n, M, n_chunks):
+    sums = np.zeros(n_chunks, dtype=np.float64)
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        total = 0.0
+        for i in range(i0, i1):
+            total += (x[i] - M)**2
+        sums[c] = total
+    return np.sum(sums)
+
+
+@njit(nogil=True, parallel=True)
+def _compact_within_chunked(x, n, low, high, out, n_chunks):
+    """
+    Copy the values of x[:n] within [low, high] to the start of out in order, in parallel. Returns the number copied.
+    """
+    counts = np.zeros(n_chunks, dtype=np.int64)
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        count = 0
+        for i in range(i0, i1):
+            if x[i] >= low and x[i] <= high:
+                count += 1
+        counts[c] = count
+    offsets = np.zeros(n_chunks + 1, dtype=np.int64)
+    for c in range(n_chunks):
+        offsets[c + 1] = offsets[c] + counts[c]
+    for c in prange(n_chunks):
+        i0, i1 = _chunk_bounds(n, n_chunks, c)
+        j = offsets[c]
+        for i in range(i0, i1):
+            if x[i] >= low and x[i] <= high:
+                out[j] = x[i]
+                j += 1
+    return offsets[n_chunks]
+
+
+@njit(nogil=True)
+def _sigma_clipped_mean_chunked(x, n, sigma, maxiters, work, work2, n_chunks):
+    """
+    `sigma_clipped_mean_inplace` of x[:n] in parallel. x and work2 are used as alternating buffers of the kept values.
+    """
+    kept = x
+    spare = work2
+    for _ in range(maxiters):
+        if n == 0:
+            break
+        mean = _sum_chunked(kept, n, n_chunks) / n
+        stddev = np.sqrt(_squared_deviation_sum_chunked(kept, n, mean, n_chunks) / n)
+        M = _median_chunked(kept, n, work, n_chunks)
+        n_kept = _compact_within_chunked(kept, n, M - sigma * stddev, M + sigma * stddev, spare, n_chunks)
+        kept, spare = spare, kept
+        if n_kept == n:
+            break
+        n = n_kept
+    if n == 0:
+        return np.nan
+    return _sum_chunked(kept, n, n_chunks) / n
@@ -0,0 +1,26 @@
+from contextlib import contextmanager
+
+import numba
+
+__all__ = ['numba_threads']
+
+
+@contextmanager
+def numba_threads(n_threads : int | None = None):
+    """
+    Temporarily set the number of threads used by numba parallel (prange) kernels.
+
+    Args:
+        n_threads (int | None): Number of threads. None leaves the current setting untouched,
+            which defaults to all cores (``NUMBA_NUM_THREADS``). Values are clipped to [1, NUMBA_NUM_THREADS].
+    """
+    if n_threads is None:
+        yield
+        return
+    n_threads = max(1, min(int(n_threads), numba.config.NUMBA_NUM_THREADS))
+    n_threads_prev = numba.get_num_threads()
+    numba.set_num_threads(n_threads)
+    try:
+        yield
+    finally:
+        numba.set_num_threads(n_threads_prev)
@@ -111,3 +111,75 @@ def get_subarray_model(sci_model, ref_model):
         return sub_model
     else:
         return ref_model
+
+
+def parse_windows(windows, shape : tuple[int, int] | None = None) -> list[dict]:
+    """
+    Normalize region-of-interest windows to subarray parameters as in meta.subarray_map.
+    Full-frame entries (id 0 or name FULL) are skipped.
+
+    Args:
+        windows (list): The windows, either subarray parameters with xstart, ystart, xsize and ysize
+            (e.g. meta.subarray_map), or sequences (xstart, ystart, xsize, ysize). xstart/ystart use 1-based indexing.
+        shape (tuple[int, int] | None): The detector shape (ny, nx) to check the windows against.
+
+    Returns:
+        list[dict]: The subarray parameters id, xstart, ystart, xsize and ysize of each window.
+    """
+    result = []
+    for i, window in enumerate(windows):
+        if hasattr(window, 'instance'):
+            window = window.instance
+        if isinstance(window, dict):
+            if window.get('id') == 0 or window.get('name') == 'FULL':
+                continue
+            params = {k: int(window[k]) for k in ('xstart', 'ystart', 'xsize', 'ysize')}
+            params['id'] = int(window.get('id', i + 1))
+        else:
+            xstart, ystart, xsize, ysize = (int(v) for v in window)
+            params = dict(id=i + 1, xstart=xstart, ystart=ystart, xsize=xsize, ysize=ysize)
+        if params['xstart'] < 1 or params['ystart'] < 1 or params['xsize'] < 1 or params['ysize'] < 1:
+            raise ValueError(f"Invalid window {params}")
+        if shape is not None and (params['ystart'] - 1 + params['ysize'] > shape[0] or params['xstart'] - 1 + params['xsize'] > shape[1]):
+            raise ValueError(f"Window {params} exceeds the detector shape {tuple(shape)}")
+        result.append(params)
+    return result
+
+
+def window_slices(window : dict) -> tuple[slice, slice]:
+    """
+    The 0-based (y, x) slices of a window from `parse_windows`.
+    """
+    ystart = window['ystart'] - 1
+    xstart = window['xstart'] - 1
+    return slice(ystart, ystart + window['ysize']), slice(xstart, xstart + window['xsize'])
+
+
+def extract_windows(model, windows) -> list:
+    """
+    Cut compact per-window models out of a full-frame image model, e.g. the ROI output of FitRampStep.
+    The subarray parameters of each window are stored in meta.subarray.
+
+    Args:
+        model (ImagerModel | IFUImageModel): The full-frame model.
+        windows (list): The windows, see `parse_windows`.
+
+    Returns:
+        list: One model of the same type per window.
+    """
+    ny, nx = model.data.shape
+    sub_models = []
+    for window in parse_windows(windows, (ny, nx)):
+        ys, xs = window_slices(window)
+        sub_model = model.__class__(data=model.data[ys, xs].copy(), err=model.err[ys, xs].copy(), dq=model.dq[ys, xs].copy())
+        sub_model.update(model)
+        sub_model.meta.subarray.name = 'CUSTOM'
+        sub_model.meta.subarray.id = window['id']
+        sub_model.meta.subarray.xstart = window['xstart']
+        sub_model.meta.subarray.ystart = window['ystart']
+        sub_model.meta.subarray.xsize = window['xsize']
+        sub_model.meta.subarray.ysize = window['ysize']
+        sub_model.meta.subarray.detxsize = nx
+        sub_model.meta.subarray.detysize = ny
+        sub_models.append(sub_model)
+    return sub_models